@@ -6,3 +6,24 @@ from django.conf import settings
 # If you fulfill the requirements, the OpenStreetMap layer is nicer
 # https://docs.djangoproject.com/en/dev/ref/contrib/gis/tutorial/#osmgeoadmin
 MULTIGTFS_OSMADMIN = getattr(settings, 'MULTIGTFS_OSMADMIN', True)
+
+# Directory for caching exported feeds, keyed by the feed content revision.
+# Set to None to disable the cache.
+MULTIGTFS_EXPORT_CACHE_DIR = getattr(settings, 'MULTIGTFS_EXPORT_CACHE_DIR', None)
+
+# Maximum number of results in the in-process schedule query cache
+MULTIGTFS_QUERY_CACHE_SIZE = getattr(settings, 'MULTIGTFS_QUERY_CACHE_SIZE', 4096)
+
+# Seconds between checks that cached query results are still current, for
+# changes made by other processes.  Changes in this process are seen at once.
+MULTIGTFS_QUERY_CACHE_REVISION_TTL = getattr(
+    settings, 'MULTIGTFS_QUERY_CACHE_REVISION_TTL', 5.0)
+
+# Move the stop times of imported feeds into packed storage, with one row of
+# arrays per trip.  See multigtfs.models.PackedStopTimes.
+MULTIGTFS_PACK_STOP_TIMES = getattr(settings, 'MULTIGTFS_PACK_STOP_TIMES', False)
+
+# Import shapes.txt as the geometry of the shapes, without a row for each
+# point.  Extra columns of shapes.txt are dropped in this mode.  See
+# multigtfs.models.Shape.import_compact_txt.
+MULTIGTFS_COMPACT_SHAPES = getattr(settings, 'MULTIGTFS_COMPACT_SHAPES', False)
@@ -0,0 +1,416 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Columnar (Parquet and Arrow IPC) versions of GTFS files.
+
+Each GTFS file is stored as a table with the same name and columns, such
+as stop_times.parquet, but with native types rather than text:
+
+- Times (SecondsField) are integer seconds since the start of the day
+- Dates are date32
+- Booleans are bool
+- Latitudes and longitudes are float64
+- Related IDs, text and extra columns are strings
+
+Tables in this layout can be imported too, without parsing text.
+
+This requires pyarrow, which is an optional dependency.
+"""
+from logging import getLogger
+import os.path
+
+from django.contrib.gis.geos import Point
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import ExpressionWrapper, F, FloatField, Func, IntegerField
+from django.db.models.fields.json import KeyTextTransform
+
+from multigtfs.models.base import batch_size, re_point
+from multigtfs.models.fields import Seconds, SecondsField
+
+logger = getLogger(__name__)
+
+FORMATS = {
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+
+def get_pyarrow():
+    """Import pyarrow, or raise ImproperlyConfigured if not installed"""
+    try:
+        import pyarrow
+        import pyarrow.compute  # noqa: F401
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:  # pragma: nocover
+        raise ImproperlyConfigured(
+            "pyarrow is required for Parquet and Arrow GTFS files"
+        )
+    return pyarrow
+
+
+def table_filename(klass, fmt):
+    """Return the columnar filename of a GTFS file, like stop_times.parquet"""
+    return os.path.splitext(klass._filename)[0] + FORMATS[fmt]
+
+
+def column_type(klass, field_pattern):
+    """Return the Arrow type of a column in a model's _column_map"""
+    pa = get_pyarrow()
+    field_name = field_pattern.split("__", 1)[0]
+    if "__" in field_pattern:
+        return pa.string()
+    if re_point.match(field_name):
+        return pa.float64()
+    field = klass._meta.get_field(field_name)
+    internal_type = field.get_internal_type()
+    if isinstance(field, SecondsField):
+        return pa.int32()
+    elif internal_type == "DateField":
+        return pa.date32()
+    elif internal_type == "BooleanField":
+        return pa.bool_()
+    elif internal_type in (
+        "IntegerField",
+        "SmallIntegerField",
+        "PositiveSmallIntegerField",
+    ):
+        return pa.int32()
+    elif internal_type in ("BigIntegerField", "PositiveIntegerField"):
+        return pa.int64()
+    elif internal_type == "FloatField":
+        return pa.float64()
+    else:
+        return pa.string()
+
+
+def table_schema(klass, column_map, extra_columns=()):
+    """Return the Arrow schema of a GTFS table"""
+    pa = get_pyarrow()
+    fields = [
+        pa.field(csv_name, column_type(klass, field_pattern))
+        for csv_name, field_pattern in column_map
+    ]
+    fields.extend(pa.field(column, pa.string()) for column in extra_columns)
+    return pa.schema(fields)
+
+
+def _column_values(klass, column_map, extra_columns):
+    """Get query expressions that select the native value of each column"""
+    values = []
+    for csv_name, field_pattern in column_map:
+        point_match = re_point.match(field_pattern)
+        if "__" in field_pattern:
+            values.append(F(field_pattern))
+        elif point_match:
+            name, index = point_match.groups()
+            function = ("ST_X", "ST_Y")[int(index)]
+            values.append(Func(F(name), function=function, output_field=FloatField()))
+        elif isinstance(klass._meta.get_field(field_pattern), SecondsField):
+            values.append(
+                ExpressionWrapper(
+                    klass._export_field(field_pattern), output_field=IntegerField()
+                )
+            )
+        else:
+            values.append(klass._export_field(field_pattern))
+    for column in extra_columns:
+        values.append(KeyTextTransform(column, "extra_data"))
+    return values
+
+
+def export_table(klass, feed, path, fmt="parquet", feed_filter=None):
+    """Export a GTFS table of a feed as a Parquet or Arrow IPC file
+
+    Rows are streamed from the database and written in record batches.
+
+    Returns the number of records written, or None if there were none.
+    """
+    pa = get_pyarrow()
+    objects = klass._export_objects(feed)
+    if feed_filter:
+        objects = feed_filter.filter(klass, feed, objects)
+    if not objects.exists() or klass._skip_export(objects):
+        return
+
+    column_map = objects.populated_column_map()
+    fields = [field for _, field in column_map]
+    extra_columns = feed.meta.get("extra_columns", {}).get(klass.__name__, [])
+    schema = table_schema(klass, column_map, extra_columns)
+    values = _column_values(klass, column_map, extra_columns)
+    rows_query = klass._rows_query(
+        objects, klass._export_sort_fields(fields), values
+    )
+
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+
+    def write_batch(rows):
+        columns = list(zip(*rows))
+        arrays = [
+            pa.array(column, type=field.type)
+            for column, field in zip(columns, schema)
+        ]
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+    count = 0
+    try:
+        rows = []
+        for item in rows_query.iterator(chunk_size=batch_size):
+            rows.append(item)
+            if len(rows) == batch_size:
+                write_batch(rows)
+                count += len(rows)
+                logger.info("Exported %d %s", count, klass._meta.verbose_name_plural)
+                rows = []
+        if rows:
+            write_batch(rows)
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+
+def is_compatible(actual, expected):
+    """Can a column of the actual type be imported as the expected type?
+
+    Integer and floating point columns are widened, integer codes are
+    accepted for text and boolean columns (such as location_type), and
+    other dates and timestamps are accepted as dates.
+    """
+    pa = get_pyarrow()
+    types = pa.types
+    if actual == expected or types.is_null(actual):
+        return True
+    if types.is_integer(expected) or types.is_floating(expected):
+        return types.is_integer(actual) or (
+            types.is_floating(expected) and types.is_floating(actual)
+        )
+    if types.is_string(expected):
+        return types.is_large_string(actual) or types.is_integer(actual)
+    if types.is_boolean(expected):
+        return types.is_integer(actual)
+    if types.is_date32(expected):
+        return types.is_date(actual) or types.is_timestamp(actual)
+    return False
+
+
+def validate_schema(klass, schema):
+    """Check a table schema against the _column_map of a model
+
+    Returns a dictionary of column name to the expected Arrow type, for
+    the columns in the _column_map.  Other columns are extra columns.
+
+    Raises ValueError if a column has an incompatible type.  Missing
+    columns are allowed, like in GTFS files, since exports drop the
+    columns that are empty in every row.
+    """
+    expected = dict(
+        (csv_name, column_type(klass, field_pattern))
+        for csv_name, field_pattern in klass._column_map
+    )
+    errors = []
+    for field in schema:
+        if field.name in expected and not is_compatible(
+            field.type, expected[field.name]
+        ):
+            errors.append(
+                "%s is %s, expected %s"
+                % (field.name, field.type, expected[field.name])
+            )
+    if errors:
+        raise ValueError(
+            "Invalid schema for %s: %s" % (klass._filename, "; ".join(errors))
+        )
+    return dict(
+        (name, pa_type) for name, pa_type in expected.items() if name in schema.names
+    )
+
+
+def read_batches(path):
+    """Return the schema and an iterator of record batches of a table file"""
+    pa = get_pyarrow()
+    if path.endswith(FORMATS["parquet"]):
+        parquet_file = pa.parquet.ParquetFile(path)
+        return parquet_file.schema_arrow, parquet_file.iter_batches(batch_size)
+    reader = pa.ipc.open_file(path)
+    batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    return reader.schema, batches
+
+
+def _column_converters(klass, feed):
+    """Get converters from Arrow values to model fields, by column"""
+    cache = {}
+
+    def get_related_id(field, rel_name):
+        related = field.related_model
+        key = (related.__name__, rel_name)
+
+        def convert(value):
+            if value is None or value == "":
+                return None
+            if key not in cache:
+                pairs = related.objects.filter(
+                    **{related._rel_to_feed: feed}
+                ).values_list(rel_name, "id")
+                cache[key] = dict((str(x), i) for x, i in pairs)
+            if value not in cache[key]:
+                kwargs = {related._rel_to_feed: feed, rel_name: value}
+                cache[key][value] = related.objects.create(**kwargs).id
+            return cache[key][value]
+
+        return convert
+
+    def get_default(field):
+        def convert(value):
+            return field.get_default() if value is None else value
+
+        return convert
+
+    def char_convert(value):
+        return value or ""
+
+    def seconds_convert(value):
+        return None if value is None else Seconds(value)
+
+    converters = {}
+    for csv_name, field_pattern in klass._column_map:
+        if "__" in field_pattern:
+            field_base, rel_name = field_pattern.split("__", 1)
+            field = klass._meta.get_field(field_base)
+            converters[csv_name] = (field_base + "_id", get_related_id(field, rel_name))
+        elif re_point.match(field_pattern):
+            converters[csv_name] = (field_pattern, None)
+        else:
+            field = klass._meta.get_field(field_pattern)
+            if isinstance(field, SecondsField):
+                converter = seconds_convert
+            elif field.get_internal_type() in ("CharField", "TextField"):
+                converter = char_convert
+            elif not field.null and field.has_default():
+                converter = get_default(field)
+            else:
+                converter = None
+            converters[csv_name] = (field_pattern, converter)
+    return converters
+
+
+def import_table(klass, path, feed, filter_func=None):
+    """Import a GTFS table of a feed from a Parquet or Arrow IPC file
+
+    The typed columns are cast to the types in the _column_map and used
+    directly, so no text is parsed.  Columns that are not in the
+    _column_map are stored as text in extra_data, like for GTFS files.
+
+    Keyword arguments:
+    klass - The model of the GTFS table
+    path - The path of the .parquet or .arrow file
+    feed - The feed to import the records into
+    filter_func - If set, a function that is called with each record batch
+        and returns a boolean mask of the rows to import
+
+    Returns the number of imported records.
+    """
+    pa = get_pyarrow()
+    schema, batches = read_batches(path)
+    types = validate_schema(klass, schema)
+    converters = _column_converters(klass, feed)
+    extra_names = [name for name in schema.names if name not in types]
+    point_names = [None, None]
+    for csv_name, field_pattern in klass._column_map:
+        point_match = re_point.match(field_pattern)
+        if point_match and csv_name in types:
+            point_names[int(point_match.group("index"))] = csv_name
+
+    unique_rows = dict()
+    extra_counts = dict((name, 0) for name in extra_names)
+    new_objects = []
+    count = 0
+    for batch in batches:
+        if filter_func is not None:
+            offsets = pa.compute.indices_nonzero(filter_func(batch)).to_pylist()
+        else:
+            offsets = range(batch.num_rows)
+        columns = {}
+        for name in schema.names:
+            column = batch.column(name)
+            if name in types:
+                column = column.cast(types[name])
+            columns[name] = column.to_pylist()
+
+        for offset in offsets:
+            row_number = count + offset + 1
+            # A missing unique column is blank, as in GTFS files
+            ukey = tuple(
+                columns[name][offset] if name in columns else ""
+                for name in klass._unique_fields
+            )
+            if ukey in unique_rows:
+                logger.warning(
+                    "%s row %d is a duplicate of row %d, not imported.",
+                    os.path.basename(path),
+                    row_number,
+                    unique_rows[ukey],
+                )
+                continue
+            unique_rows[ukey] = row_number
+
+            fields = dict()
+            if klass._rel_to_feed == "feed":
+                fields["feed"] = feed
+            for name in types:
+                if name in point_names:
+                    continue
+                field_name, converter = converters[name]
+                value = columns[name][offset]
+                fields[field_name] = converter(value) if converter else value
+            if point_names != [None, None]:
+                fields["point"] = Point(
+                    columns[point_names[0]][offset],
+                    columns[point_names[1]][offset],
+                    srid=4326,
+                )
+            for name in extra_names:
+                value = columns[name][offset]
+                if value is not None and value != "":
+                    fields.setdefault("extra_data", {})[name] = str(value)
+                    extra_counts[name] += 1
+            new_objects.append(klass(**fields))
+
+            if len(new_objects) == batch_size:
+                klass.objects.bulk_create(new_objects)
+                logger.info(
+                    "Imported %d %s",
+                    len(unique_rows),
+                    klass._meta.verbose_name_plural,
+                )
+                new_objects = []
+        count += batch.num_rows
+
+    if new_objects:
+        klass.objects.bulk_create(new_objects)
+
+    # Take note of extra fields
+    extra_found = [name for name in extra_names if extra_counts[name]]
+    if extra_found:
+        extra_columns = feed.meta.setdefault("extra_columns", {}).setdefault(
+            klass.__name__, []
+        )
+        for name in extra_found:
+            if name not in extra_columns:
+                extra_columns.append(name)
+        feed.save()
+    return len(unique_rows)
@@ -2,7 +2,7 @@
 
 Handle compatibility between Python versions, Django versions, etc.
 """
-from codecs import BOM_UTF8
+from codecs import BOM_UTF8, getincrementaldecoder
 from distutils.version import LooseVersion
 from io import TextIOWrapper
 from zipfile import ZipFile, ZIP_DEFLATED
@@ -81,6 +81,22 @@ def opener_from_zipfile(zipfile):
     return opener
 
 
+def writer_from_zipfile(zipfile):
+    """
+    Returns a function that will open a new file in a zipfile by name.
+
+    The member is opened as text, so rows can be streamed into the archive
+    without holding the whole file in memory.  ZIP64 extensions are forced,
+    since the final size of the member isn't known in advance.
+    """
+
+    def opener(filename):
+        inner_file = zipfile.open(filename, 'w', force_zip64=True)
+        return TextIOWrapper(inner_file, encoding='utf-8', newline='')
+
+    return opener
+
+
 def write_text_rows(writer, rows):
     '''Write CSV row data which may include text.'''
     for row in rows:
@@ -97,6 +113,27 @@ def write_text_rows(writer, rows):
             writer.writerow(new_row)
 
 
+def copy_to(cursor, sql, params, out):
+    """
+    Run a COPY ... TO STDOUT statement, writing the output to a text file.
+
+    psycopg2 cursors stream with copy_expert(), which doesn't accept query
+    parameters, so they are merged on the client first.  psycopg 3 cursors
+    stream with copy(), which returns encoded chunks.
+    """
+    if hasattr(cursor, 'copy_expert'):
+        statement = cursor.mogrify(sql, params)
+        if isinstance(statement, bytes):
+            statement = statement.decode('utf-8')
+        cursor.copy_expert(statement, out)
+    else:
+        decoder = getincrementaldecoder('utf-8')()
+        with cursor.copy(sql, params) as copy:
+            for data in copy:
+                out.write(decoder.decode(bytes(data)))
+        out.write(decoder.decode(b'', final=True))
+
+
 from django.db.models import Manager, QuerySet
 assert Manager
 assert QuerySet
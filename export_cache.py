@@ -0,0 +1,127 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""On-disk cache of exported GTFS files.
+
+Each GTFS file of a feed is cached under a key built from the content
+revisions (see FeedRevision) of every model it is exported from, so a
+change to one model only invalidates the files that depend on it.  The
+assembled zip is cached under a key built from all the file keys.
+"""
+from hashlib import sha1
+import json
+import os
+import os.path
+import shutil
+
+
+def export_dependencies(klass):
+    """Return the names of the models that a GTFS file is exported from
+
+    This is the model itself, plus the models that are reached through the
+    relation to the feed and through related columns, such as Trip and Stop
+    for stop_times.txt.  Records deleted by a cascade belong to one of these
+    models, so their revisions are bumped too.
+    """
+    names = {klass.__name__}
+    paths = [klass._rel_to_feed]
+    paths.extend(field for _, field in klass._column_map if "__" in field)
+    for path in paths:
+        model = klass
+        for part in path.split("__"):
+            field = model._meta.get_field(part)
+            if not field.is_relation:
+                break
+            model = field.related_model
+            if model._meta.model_name == "feed":
+                break
+            names.add(model.__name__)
+    return sorted(names)
+
+
+class ExportCache(object):
+    """Exported GTFS files of a feed, cached in a directory"""
+
+    def __init__(self, cache_dir, feed, gtfs_order, deterministic=False):
+        self.directory = os.path.join(cache_dir, str(feed.id))
+        os.makedirs(self.directory, exist_ok=True)
+        revisions = feed.revisions()
+        self.keys = {}
+        for klass in gtfs_order:
+            parts = [
+                "%s=%d" % (name, revisions.get(name, 0))
+                for name in export_dependencies(klass)
+            ]
+            if deterministic:
+                parts.append("deterministic")
+            self.keys[klass] = sha1(";".join(parts).encode("utf-8")).hexdigest()
+        archive_parts = [self.keys[klass] for klass in gtfs_order]
+        self.archive_key = sha1(";".join(archive_parts).encode("utf-8")).hexdigest()
+
+    def member_path(self, klass):
+        """Return the path of the cached GTFS file"""
+        return os.path.join(
+            self.directory, "%s.%s" % (klass._filename, self.keys[klass])
+        )
+
+    def has_member(self, klass):
+        """Is the GTFS file for the current revisions in the cache?"""
+        return os.path.exists(self.member_path(klass) + ".json")
+
+    def member_records(self, klass):
+        """Return the cached record count, or None if there were no records"""
+        with open(self.member_path(klass) + ".json") as info_file:
+            return json.load(info_file)["records"]
+
+    def store_member(self, klass, temp_path, records):
+        """Move an exported GTFS file into the cache"""
+        path = self.member_path(klass)
+        if records is not None:
+            os.replace(temp_path, path)
+        with open(path + ".json.tmp", "w") as info_file:
+            json.dump({"records": records}, info_file)
+        os.replace(path + ".json.tmp", path + ".json")
+        self._prune(klass._filename + ".", os.path.basename(path))
+
+    @property
+    def archive_path(self):
+        """Return the path of the cached zip file"""
+        return os.path.join(self.directory, "feed.%s.zip" % self.archive_key)
+
+    def has_archive(self):
+        """Is the zip file for the current revisions in the cache?"""
+        return os.path.exists(self.archive_path)
+
+    def store_archive(self, temp_path):
+        """Move an assembled zip file into the cache"""
+        os.replace(temp_path, self.archive_path)
+        self._prune("feed.", os.path.basename(self.archive_path))
+
+    def copy_archive(self, gtfs_file):
+        """Copy the cached zip file to a path or a writable binary file"""
+        if isinstance(gtfs_file, (str, os.PathLike)):
+            shutil.copyfile(self.archive_path, gtfs_file)
+        else:
+            with open(self.archive_path, "rb") as archive:
+                shutil.copyfileobj(archive, gtfs_file)
+
+    def _prune(self, prefix, keep):
+        """Remove cached files for older revisions"""
+        for filename in os.listdir(self.directory):
+            if (
+                filename.startswith(prefix)
+                and not filename.startswith(keep)
+                and not filename.endswith(".tmp")
+            ):
+                os.unlink(os.path.join(self.directory, filename))
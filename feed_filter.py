@@ -0,0 +1,164 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Select a subset of a feed for export."""
+from django.contrib.gis.geos import Polygon
+from django.db.models import Q
+
+from multigtfs.models import (
+    CombinedStopTime,
+    FareRule,
+    Route,
+    Service,
+    ServiceDates,
+    Stop,
+    Trip,
+)
+
+
+class FeedFilter(object):
+    """A subset of a feed, selected by trips
+
+    Trips are selected by the filters, and the other records are limited to
+    the ones that the selected trips reference, directly or indirectly, so
+    the exported subset is a complete feed.  All the filters are built as
+    subqueries, so they are evaluated by the database as part of each
+    export query.
+
+    Keyword arguments:
+    start_date, end_date - Keep trips with service on a date in this range.
+        Calendars and calendar dates of the kept services are not clipped.
+    route_ids - Keep trips on routes with these route_ids
+    agency_ids - Keep trips on routes of agencies with these agency_ids
+    bbox - Keep trips that stop within this (min_lon, min_lat, max_lon,
+        max_lat) box.  All the stops of a kept trip are exported.
+    """
+
+    def __init__(
+        self,
+        start_date=None,
+        end_date=None,
+        route_ids=None,
+        agency_ids=None,
+        bbox=None,
+    ):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.route_ids = route_ids
+        self.agency_ids = agency_ids
+        self.bbox = bbox
+
+    def __str__(self):
+        parts = []
+        for name in ("start_date", "end_date", "route_ids", "agency_ids", "bbox"):
+            value = getattr(self, name)
+            if value:
+                parts.append("%s=%s" % (name, value))
+        return ", ".join(parts)
+
+    def filter(self, klass, feed, objects):
+        """Limit the objects of a model in the feed to the subset"""
+        method = getattr(self, "_filter_" + klass._meta.model_name, None)
+        if method is None:
+            return objects
+        return method(feed, objects)
+
+    def trips(self, feed):
+        """Return the selected trips"""
+        trips = Trip.objects.in_feed(feed)
+        if self.route_ids:
+            trips = trips.filter(route__route_id__in=self.route_ids)
+        if self.agency_ids:
+            trips = trips.filter(route__agency__agency_id__in=self.agency_ids)
+        if self.start_date or self.end_date:
+            dates = ServiceDates.objects.filter(service__feed=feed)
+            if self.start_date:
+                dates = dates.filter(date__gte=self.start_date)
+            if self.end_date:
+                dates = dates.filter(date__lte=self.end_date)
+            trips = trips.filter(service__in=dates.values("service"))
+        if self.bbox:
+            box = Polygon.from_bbox(self.bbox)
+            box.srid = 4326
+            visits = CombinedStopTime.objects.filter(stop__point__within=box)
+            trips = trips.filter(id__in=visits.values("trip"))
+        return trips
+
+    def stops(self, feed):
+        """Return the stops of the selected trips, with their stations"""
+        visited = CombinedStopTime.objects.filter(
+            trip__in=self.trips(feed)
+        ).values("stop")
+        stations = Stop.objects.filter(id__in=visited).values("parent_station")
+        return Stop.objects.in_feed(feed).filter(
+            Q(id__in=visited) | Q(id__in=stations)
+        )
+
+    def routes(self, feed):
+        """Return the routes of the selected trips"""
+        return Route.objects.in_feed(feed).filter(
+            id__in=self.trips(feed).values("route")
+        )
+
+    def services(self, feed):
+        """Return the services of the selected trips"""
+        return Service.objects.in_feed(feed).filter(
+            id__in=self.trips(feed).values("service")
+        )
+
+    def fare_rules(self, feed):
+        """Return the fare rules that apply to the selected routes"""
+        return FareRule.objects.in_feed(feed).filter(
+            Q(route__isnull=True) | Q(route__in=self.routes(feed))
+        )
+
+    def _filter_agency(self, feed, objects):
+        return objects.filter(id__in=self.routes(feed).values("agency"))
+
+    def _filter_service(self, feed, objects):
+        return objects.filter(id__in=self.services(feed))
+
+    def _filter_servicedate(self, feed, objects):
+        return objects.filter(service__in=self.services(feed))
+
+    def _filter_fare(self, feed, objects):
+        # Fares without rules apply to the whole feed
+        ruled = FareRule.objects.in_feed(feed).values("fare")
+        kept = self.fare_rules(feed).values("fare")
+        return objects.filter(Q(id__in=kept) | ~Q(id__in=ruled))
+
+    def _filter_farerule(self, feed, objects):
+        return objects.filter(id__in=self.fare_rules(feed))
+
+    def _filter_frequency(self, feed, objects):
+        return objects.filter(trip__in=self.trips(feed))
+
+    def _filter_route(self, feed, objects):
+        return objects.filter(id__in=self.routes(feed))
+
+    def _filter_shapepoint(self, feed, objects):
+        return objects.filter(shape__in=self.trips(feed).values("shape"))
+
+    def _filter_stoptime(self, feed, objects):
+        return objects.filter(trip__in=self.trips(feed))
+
+    def _filter_stop(self, feed, objects):
+        return objects.filter(id__in=self.stops(feed))
+
+    def _filter_transfer(self, feed, objects):
+        stops = self.stops(feed)
+        return objects.filter(from_stop__in=stops, to_stop__in=stops)
+
+    def _filter_trip(self, feed, objects):
+        return objects.filter(id__in=self.trips(feed))
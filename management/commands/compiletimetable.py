@@ -0,0 +1,75 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import unicode_literals
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from multigtfs.models import Feed
+from multigtfs.timetable import compile_timetable
+
+
+class Command(BaseCommand):
+    help = "Compiles a GTFS feed into a memory-mapped timetable snapshot"
+
+    def add_arguments(self, parser):
+        # Positional arguments
+        parser.add_argument("feed_id", metavar="GTFS Feed ID", type=int)
+        parser.add_argument(
+            "directory", metavar="DIRECTORY", help="The snapshot directory"
+        )
+
+    def handle(self, *args, **options):
+        # Setup logging
+        verbosity = int(options["verbosity"])
+        console = logging.StreamHandler(self.stderr)
+        formatter = logging.Formatter("%(levelname)s - %(message)s")
+        logger_name = "multigtfs"
+        if verbosity == 0:
+            level = logging.WARNING
+        elif verbosity == 1:
+            level = logging.INFO
+        elif verbosity == 2:
+            level = logging.DEBUG
+        else:
+            level = logging.DEBUG
+            logger_name = ""
+            formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+        console.setLevel(level)
+        console.setFormatter(formatter)
+        logger = logging.getLogger(logger_name)
+        logger.setLevel(level)
+        logger.addHandler(console)
+
+        # Disable database query logging
+        if settings.DEBUG:
+            connection.use_debug_cursor = False
+
+        feed_id = options.get("feed_id")
+        try:
+            feed = Feed.objects.get(id=feed_id)
+        except Feed.DoesNotExist:
+            raise CommandError("Feed %s not found" % feed_id)
+
+        start_time = time.time()
+        timetable = compile_timetable(feed, options.get("directory"))
+        end_time = time.time()
+        self.stdout.write(
+            "Compiled %d stop times of Feed %s to %s in %0.1f seconds\n"
+            % (len(timetable), feed_id, timetable.directory, end_time - start_time)
+        )
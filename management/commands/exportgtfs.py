@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import unicode_literals
+from argparse import ArgumentTypeError
+from datetime import datetime
 import logging
 
 from django.db import connection
@@ -20,6 +22,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.template.defaultfilters import slugify
 
+from multigtfs.feed_filter import FeedFilter
 from multigtfs.models.feed import Feed
 
 
@@ -37,6 +40,56 @@ class Command(BaseCommand):
                             type=str,
                             dest='name',
                             help='Set the name of the exported feed')
+        parser.add_argument('-j', '--processes',
+                            type=int,
+                            dest='processes',
+                            default=None,
+                            help=(
+                                'Export the GTFS files concurrently in this'
+                                ' many worker processes'))
+        parser.add_argument('--deterministic',
+                            action='store_true',
+                            dest='deterministic',
+                            default=False,
+                            help=(
+                                'Export byte-identical files for identical'
+                                ' feeds, and print their SHA-256 digests'))
+        parser.add_argument('--format',
+                            choices=('zip', 'parquet', 'arrow'),
+                            dest='format',
+                            default='zip',
+                            help=(
+                                'Export a zipped GTFS feed, or a directory of'
+                                ' Parquet or Arrow files (requires pyarrow)'))
+        parser.add_argument('--start-date',
+                            type=parse_date,
+                            dest='start_date',
+                            help=(
+                                'Only export trips with service on or after'
+                                ' this date (YYYY-MM-DD)'))
+        parser.add_argument('--end-date',
+                            type=parse_date,
+                            dest='end_date',
+                            help=(
+                                'Only export trips with service on or before'
+                                ' this date (YYYY-MM-DD)'))
+        parser.add_argument('--route',
+                            action='append',
+                            dest='route_ids',
+                            metavar='ROUTE_ID',
+                            help='Only export trips on this route (repeatable)')
+        parser.add_argument('--agency',
+                            action='append',
+                            dest='agency_ids',
+                            metavar='AGENCY_ID',
+                            help=(
+                                'Only export trips of this agency'
+                                ' (repeatable)'))
+        parser.add_argument('--bbox',
+                            type=parse_bbox,
+                            dest='bbox',
+                            metavar='MIN_LON,MIN_LAT,MAX_LON,MAX_LAT',
+                            help='Only export trips that stop in this box')
 
     def handle(self, *args, **options):
         # Setup logging
@@ -71,11 +124,51 @@ class Command(BaseCommand):
             feed = Feed.objects.get(id=feed_id)
         except Feed.DoesNotExist:
             raise CommandError('Feed %s not found' % feed_id)
+        out_format = options.get('format') or 'zip'
         out_name = options.get('name') or slugify(feed.name)
-        if not out_name.endswith('.zip'):
+        if out_format == 'zip' and not out_name.endswith('.zip'):
             out_name += '.zip'
         self.stdout.write(
             "Exporting Feed %s to %s...\n" % (feed_id, out_name))
-        feed.export_gtfs(out_name)
+        feed_filter = None
+        filter_options = dict(
+            (name, options.get(name)) for name in (
+                'start_date', 'end_date', 'route_ids', 'agency_ids', 'bbox'))
+        if any(filter_options.values()):
+            feed_filter = FeedFilter(**filter_options)
+        if out_format != 'zip':
+            feed.export_columnar(
+                out_name, fmt=out_format, feed_filter=feed_filter)
+            self.stdout.write(
+                "Successfully exported Feed %s to %s\n" % (feed_id, out_name))
+            return
+        digests = feed.export_gtfs(
+            out_name, processes=options.get('processes'),
+            deterministic=options.get('deterministic'),
+            feed_filter=feed_filter)
+        if digests:
+            for filename, digest in sorted(digests['files'].items()):
+                self.stdout.write("%s  %s\n" % (digest, filename))
+            self.stdout.write("%s  %s\n" % (digests['archive'], out_name))
         self.stdout.write(
             "Successfully exported Feed %s to %s\n" % (feed_id, out_name))
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD command line argument"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ArgumentTypeError('Dates must be in YYYY-MM-DD format')
+
+
+def parse_bbox(value):
+    """Parse a MIN_LON,MIN_LAT,MAX_LON,MAX_LAT command line argument"""
+    try:
+        bbox = tuple(float(v) for v in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise ArgumentTypeError(
+            'The box must be MIN_LON,MIN_LAT,MAX_LON,MAX_LAT')
+    return bbox
@@ -0,0 +1,97 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import unicode_literals
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from multigtfs.models import Feed, Footpath
+from multigtfs.models.footpath import DETOUR_FACTOR, MAX_DISTANCE, WALKING_SPEED
+
+
+class Command(BaseCommand):
+    help = "Generates walking transfers between nearby stops of GTFS feeds"
+
+    def add_arguments(self, parser):
+        # Positional arguments
+        parser.add_argument("feed_ids", nargs="*", metavar="Feed ID", type=int)
+
+        # Named (optional) arguments
+        parser.add_argument(
+            "-a",
+            "--all",
+            action="store_true",
+            dest="all",
+            default=False,
+            help="Generate footpaths in all feeds",
+        )
+        parser.add_argument(
+            "--max-distance",
+            type=float,
+            dest="max_distance",
+            default=MAX_DISTANCE,
+            help="The longest footpath, in meters (default %(default)s)",
+        )
+        parser.add_argument(
+            "--speed",
+            type=float,
+            dest="speed",
+            default=WALKING_SPEED,
+            help="Walking speed, in meters per second (default %(default)s)",
+        )
+        parser.add_argument(
+            "--detour",
+            type=float,
+            dest="detour",
+            default=DETOUR_FACTOR,
+            help=(
+                "Ratio of the walking distance to the straight line"
+                " (default %(default)s)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        # Validate the arguments
+        all_feeds = options.get("all")
+        feed_ids = options.get("feed_ids")
+        if len(feed_ids) == 0 and not all_feeds:
+            raise CommandError("You must pass in a feed ID or --all.")
+        if len(feed_ids) > 0 and all_feeds:
+            raise CommandError("You can't specify a feed and --all.")
+
+        # Get the feeds
+        if all_feeds:
+            feeds = Feed.objects.order_by("id")
+        else:
+            feeds = []
+            for feed_id in feed_ids:
+                try:
+                    feeds.append(Feed.objects.get(id=feed_id))
+                except Feed.DoesNotExist:
+                    raise CommandError("Feed %s not found" % feed_id)
+
+        for feed in feeds:
+            start_time = time.time()
+            count = Footpath.generate(
+                feed,
+                max_distance=options.get("max_distance"),
+                speed=options.get("speed"),
+                detour=options.get("detour"),
+            )
+            end_time = time.time()
+            self.stdout.write(
+                "Feed %d: Generated %d footpaths in %0.1f seconds\n"
+                % (feed.id, count, end_time - start_time)
+            )
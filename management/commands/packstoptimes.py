@@ -0,0 +1,82 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import unicode_literals
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from multigtfs.models import Feed, PackedStopTimes
+
+
+class Command(BaseCommand):
+    help = "Moves the stop times of GTFS feeds into packed storage, or back"
+
+    def add_arguments(self, parser):
+        # Positional arguments
+        parser.add_argument("feed_ids", nargs="*", metavar="Feed ID", type=int)
+
+        # Named (optional) arguments
+        parser.add_argument(
+            "-a",
+            "--all",
+            action="store_true",
+            dest="all",
+            default=False,
+            help="Pack the stop times of all feeds",
+        )
+        parser.add_argument(
+            "-u",
+            "--unpack",
+            action="store_true",
+            dest="unpack",
+            default=False,
+            help="Move packed stop times back into the stop_time table",
+        )
+
+    def handle(self, *args, **options):
+        # Validate the arguments
+        all_feeds = options.get("all")
+        feed_ids = options.get("feed_ids")
+        if len(feed_ids) == 0 and not all_feeds:
+            raise CommandError("You must pass in a feed ID or --all.")
+        if len(feed_ids) > 0 and all_feeds:
+            raise CommandError("You can't specify a feed and --all.")
+
+        # Get the feeds
+        if all_feeds:
+            feeds = Feed.objects.order_by("id")
+        else:
+            feeds = []
+            for feed_id in feed_ids:
+                try:
+                    feeds.append(Feed.objects.get(id=feed_id))
+                except Feed.DoesNotExist:
+                    raise CommandError("Feed %s not found" % feed_id)
+
+        for feed in feeds:
+            start_time = time.time()
+            with transaction.atomic():
+                if options.get("unpack"):
+                    count = PackedStopTimes.unpack(feed)
+                    message = "Unpacked %d stop times"
+                else:
+                    count = PackedStopTimes.pack(feed)
+                    message = "Packed the stop times of %d trips"
+            end_time = time.time()
+            self.stdout.write(
+                ("Feed %d: " + message + " in %0.1f seconds\n")
+                % (feed.id, count, end_time - start_time)
+            )
@@ -20,10 +20,21 @@ import time
 from pathlib import Path
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import connection
+from django.db import connection, transaction
 
 from geohelper import fix_unmonotone_stops
-from multigtfs.models import Feed, Route, Shape, Trip, StopTime
+from multigtfs.models import (
+    DutyChain,
+    Feed,
+    FeedRevision,
+    FrequencyDeparture,
+    PackedStopTimes,
+    Pattern,
+    Route,
+    Shape,
+    Trip,
+    StopTime,
+)
 from multigtfs.models.service_dates import ServiceDates
 from multigtfs.models.stop import Stop
 from multigtfs.models.trip_time import TripTime
@@ -105,74 +116,114 @@ class Command(BaseCommand):
         for feed in feeds:
             logger.info("Updating geometries in Feed %s (ID %s)...", feed.name, feed.id)
 
-            start_time = time.time()
-            stops = Stop.objects.in_feed(feed)
-            end_time = time.time()
-            logger.debug(
-                "Imported %s stop%s in %0.1f seconds",
-                stops.count(),
-                "" if stops.count() == 1 else "s",
-                end_time - start_time,
-            )
+            # Each feed is refreshed atomically, so a failure can't leave it
+            # half unpacked
+            with transaction.atomic(), FeedRevision.bulk(feed.id) as revisions:
+                unpacked = PackedStopTimes.unpack(feed)
+                if unpacked:
+                    logger.debug("Unpacked %d stop times", unpacked)
+
+                start_time = time.time()
+                stops = Stop.objects.in_feed(feed)
+                end_time = time.time()
+                logger.debug(
+                    "Imported %s stop%s in %0.1f seconds",
+                    stops.count(),
+                    "" if stops.count() == 1 else "s",
+                    end_time - start_time,
+                )
 
-            start_time = time.time()
-            shapes = Shape.objects.in_feed(feed)
-            for shape in shapes:
-                shape.update_geometry(update_parent=False)
-            end_time = time.time()
-            logger.debug(
-                "Imported %s shape%s in %0.1f seconds",
-                shapes.count(),
-                "" if shapes.count() == 1 else "s",
-                end_time - start_time,
-            )
+                start_time = time.time()
+                shapes = Shape.objects.in_feed(feed).with_geometry()
+                for shape in shapes:
+                    shape.update_geometry(update_parent=False)
+                end_time = time.time()
+                logger.debug(
+                    "Imported %s shape%s in %0.1f seconds",
+                    shapes.count(),
+                    "" if shapes.count() == 1 else "s",
+                    end_time - start_time,
+                )
 
-            start_time = time.time()
-            trips = Trip.objects.in_feed(feed)
-            for trip in trips:
-                trip.update_geometry(update_parent=False)
-            end_time = time.time()
-            logger.debug(
-                "Imported %s trip%s in %0.1f seconds",
-                trips.count(),
-                "" if trips.count() == 1 else "s",
-                end_time - start_time,
-            )
+                start_time = time.time()
+                trips = Trip.objects.in_feed(feed).with_geometry()
+                for trip in trips:
+                    trip.update_geometry(update_parent=False)
+                end_time = time.time()
+                logger.debug(
+                    "Imported %s trip%s in %0.1f seconds",
+                    trips.count(),
+                    "" if trips.count() == 1 else "s",
+                    end_time - start_time,
+                )
 
-            start_time = time.time()
-            routes = Route.objects.in_feed(feed)
-            for route in routes:
-                route.update_geometry()
-            end_time = time.time()
-            logger.debug(
-                "Imported %s route%s in %0.1f seconds",
-                routes.count(),
-                "" if routes.count() == 1 else "s",
-                end_time - start_time,
-            )
+                start_time = time.time()
+                routes = Route.objects.in_feed(feed).with_geometry()
+                for route in routes:
+                    route.update_geometry()
+                end_time = time.time()
+                logger.debug(
+                    "Imported %s route%s in %0.1f seconds",
+                    routes.count(),
+                    "" if routes.count() == 1 else "s",
+                    end_time - start_time,
+                )
 
-            start_time = time.time()
-            StopTime.objects.update()
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE stop_time SET shape_dist_traveled = ST_LineLocatePoint(ST_Transform(t.geometry, 32633), ST_Transform(s.point, 32633)) * ST_Length(ST_Transform(t.geometry, 32633)) FROM trip t, stop s WHERE t.id = stop_time.trip_id AND s.id = stop_time.stop_id AND s.feed_id = %s",
-                    [feed.id],
+                start_time = time.time()
+                StopTime.objects.update()
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE stop_time SET shape_dist_traveled = ST_LineLocatePoint(ST_Transform(COALESCE(sh.geometry, t.geometry), 32633), ST_Transform(s.point, 32633)) * ST_Length(ST_Transform(COALESCE(sh.geometry, t.geometry), 32633)) FROM trip t LEFT JOIN shape sh ON sh.id = t.shape_id, stop s WHERE t.id = stop_time.trip_id AND s.id = stop_time.stop_id AND s.feed_id = %s",
+                        [feed.id],
+                    )
+                    stop_time_count = cursor.rowcount
+                end_time = time.time()
+                logger.debug(
+                    "Imported geometries for %d stop_times in %0.1f seconds",
+                    stop_time_count,
+                    end_time - start_time,
                 )
-                stop_time_count = cursor.rowcount
-            end_time = time.time()
-            logger.debug(
-                "Imported geometries for %d stop_times in %0.1f seconds",
-                stop_time_count,
-                end_time - start_time,
-            )
 
-            ServiceDates.refresh()
-            logger.info("Refreshed service dates materialized view")
+                start_time = time.time()
+                interpolated = StopTime.interpolate_times(feed)
+                end_time = time.time()
+                logger.debug(
+                    "Interpolated %d missing stop times in %0.1f seconds",
+                    interpolated,
+                    end_time - start_time,
+                )
+
+                start_time = time.time()
+                patterns = Pattern.refresh(feed)
+                end_time = time.time()
+                logger.debug(
+                    "Extracted %d trip patterns in %0.1f seconds",
+                    patterns,
+                    end_time - start_time,
+                )
+
+                ServiceDates.refresh()
+                logger.info("Refreshed service dates materialized view")
+
+                TripTime.refresh()
+                logger.info("Refreshed trip time materialized view")
+
+                DutyChain.refresh()
+                logger.info("Refreshed duty chain materialized view")
+
+                departures = FrequencyDeparture.refresh(feed)
+                logger.info("Expanded frequencies into %d departures", departures)
+
+                # Fix the stop times before they are moved out of stop_time
+                fix_unmonotone_stops()
 
-            TripTime.refresh()
-            logger.info("Refreshed trip time materialized view")
+                if unpacked:
+                    packed = PackedStopTimes.pack(feed)
+                    logger.debug("Packed the stop times of %d trips", packed)
 
-            fix_unmonotone_stops()
+                # The raw SQL updates don't save records, so they don't
+                # collect their model names
+                revisions.update(["StopTime", "Trip", "Shape", "Route", "Pattern"])
 
             total_end = time.time()
             logger.info(
@@ -0,0 +1,25 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the model', max_length=63)),
+                ('revision', models.BigIntegerField(default=0)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='multigtfs.feed')),
+            ],
+            options={
+                'db_table': 'feed_revision',
+                'unique_together': {('feed', 'name')},
+            },
+        ),
+    ]
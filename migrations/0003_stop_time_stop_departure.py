@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0002_feedrevision'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stoptime',
+            index=models.Index(fields=['stop', 'departure_time'], name='stop_time_stop_departure'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0003_stop_time_stop_departure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stoptime',
+            name='interpolated',
+            field=models.BooleanField(default=False, help_text='Were the arrival and departure times interpolated?'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+import django.db.models.deletion
+import multigtfs.models.fields.seconds
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0004_stoptime_interpolated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrequencyDeparture',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('departure', multigtfs.models.fields.seconds.SecondsField(help_text='Time of the departure from the first stop')),
+                ('offset', models.IntegerField(help_text='Seconds added to the stop times of the template trip')),
+                ('exact', models.BooleanField(help_text='Is the departure exactly scheduled, or an estimate?')),
+                ('frequency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='multigtfs.frequency')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='multigtfs.trip')),
+            ],
+            options={
+                'db_table': 'frequency_departure',
+                'indexes': [models.Index(fields=['trip', 'departure'], name='frequency_departure_trip')],
+            },
+        ),
+    ]
@@ -0,0 +1,78 @@
+import django.db.models.deletion
+import multigtfs.models.fields.seconds
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0005_frequencydeparture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DutyChain',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=7)),
+                ('chain_id', models.CharField(max_length=255)),
+                ('date', models.DateField()),
+                ('position', models.IntegerField(help_text='Position of the trip in the chain')),
+                ('start_time', multigtfs.models.fields.seconds.SecondsField()),
+                ('end_time', multigtfs.models.fields.seconds.SecondsField()),
+                ('layover', models.IntegerField(help_text='Seconds since the end of the previous trip', null=True)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='multigtfs.feed')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='multigtfs.trip')),
+            ],
+            options={
+                'db_table': 'duty_chain',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(
+            """
+            CREATE MATERIALIZED VIEW duty_chain AS
+            WITH chain_trip AS (
+                SELECT t.id AS trip_id, r.feed_id, t.service_id,
+                       'block' AS kind, b.block_id AS chain_id
+                FROM trip t
+                JOIN route r ON r.id = t.route_id
+                JOIN block b ON b.id = t.block_id
+                UNION ALL
+                SELECT t.id AS trip_id, r.feed_id, t.service_id,
+                       'brigade' AS kind, r.route_id || ':' || t.brigade_id AS chain_id
+                FROM trip t
+                JOIN route r ON r.id = t.route_id
+                WHERE t.brigade_id IS NOT NULL
+            )
+            SELECT row_number() OVER (
+                       ORDER BY ct.feed_id, sd.date, ct.kind, ct.chain_id,
+                                tt.start_time, ct.trip_id
+                   ) AS id,
+                   ct.feed_id, ct.kind, ct.chain_id, sd.date, ct.trip_id,
+                   row_number() OVER chain AS position,
+                   tt.start_time, tt.end_time,
+                   tt.start_time - lag(tt.end_time) OVER chain AS layover
+            FROM chain_trip ct
+            JOIN trip_time tt ON tt.trip_id = ct.trip_id
+            JOIN service_dates sd ON sd.service_id = ct.service_id
+            WINDOW chain AS (
+                PARTITION BY ct.feed_id, sd.date, ct.kind, ct.chain_id
+                ORDER BY tt.start_time, ct.trip_id
+            )
+            """,
+            "DROP MATERIALIZED VIEW duty_chain",
+        ),
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX duty_chain_id ON duty_chain (id)",
+            "DROP INDEX duty_chain_id",
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX duty_chain_chain ON duty_chain (feed_id, date, kind, chain_id, position)",
+            "DROP INDEX duty_chain_chain",
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX duty_chain_trip ON duty_chain (trip_id, date)",
+            "DROP INDEX duty_chain_trip",
+        ),
+    ]
@@ -0,0 +1,26 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0006_dutychain'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Footpath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.FloatField(help_text='Straight-line distance in meters')),
+                ('walking_time', models.IntegerField(help_text='Estimated walking time in seconds')),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='multigtfs.feed')),
+                ('from_stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='footpath_from_stop', to='multigtfs.stop')),
+                ('to_stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='footpath_to_stop', to='multigtfs.stop')),
+            ],
+            options={
+                'db_table': 'footpath',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0007_footpath'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Pattern',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pattern_hash', models.CharField(help_text='MD5 hash of the stop sequence', max_length=32)),
+                ('stop_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), help_text='IDs of the stops, in stop_sequence order', size=None)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='multigtfs.feed')),
+            ],
+            options={
+                'db_table': 'pattern',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='pattern',
+            constraint=models.UniqueConstraint(fields=('feed', 'pattern_hash'), name='pattern_feed_hash'),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='pattern',
+            field=models.ForeignKey(blank=True, help_text='Sequence of stops visited by this trip', null=True, on_delete=django.db.models.deletion.SET_NULL, to='multigtfs.pattern'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import multigtfs.models.fields.seconds
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0008_pattern'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedStopTimes',
+            fields=[
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='multigtfs.trip')),
+                ('start_time', multigtfs.models.fields.seconds.SecondsField(help_text='First arrival time of the trip', null=True)),
+                ('stop_sequences', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('arrival_offsets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(null=True), help_text='Seconds since start_time', size=None)),
+                ('departure_offsets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(null=True), help_text='Seconds since start_time', size=None)),
+                ('distances', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), help_text='shape_dist_traveled of the stops, if any is set', null=True, size=None)),
+                ('pickup_types', models.TextField(help_text='One character for each stop')),
+                ('drop_off_types', models.TextField(help_text='One character for each stop')),
+                ('interpolated', django.contrib.postgres.fields.ArrayField(base_field=models.BooleanField(), size=None)),
+                ('details', models.JSONField(help_text='stop_headsign and extra_data, by position of the stop', null=True)),
+                ('pattern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='multigtfs.pattern')),
+            ],
+            options={
+                'db_table': 'packed_stop_times',
+                'verbose_name_plural': 'packed stop times',
+            },
+        ),
+        migrations.CreateModel(
+            name='UnpackedStopTime',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('arrival_time', multigtfs.models.fields.seconds.SecondsField(null=True)),
+                ('departure_time', multigtfs.models.fields.seconds.SecondsField(null=True)),
+                ('stop_sequence', models.IntegerField()),
+                ('stop_headsign', models.CharField(max_length=255)),
+                ('pickup_type', models.CharField(max_length=1)),
+                ('drop_off_type', models.CharField(max_length=1)),
+                ('shape_dist_traveled', models.FloatField(null=True)),
+                ('interpolated', models.BooleanField()),
+                ('extra_data', models.JSONField()),
+                ('stop', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='multigtfs.stop')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='multigtfs.trip')),
+            ],
+            options={
+                'db_table': 'unpacked_stop_time',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(
+            """
+            CREATE VIEW unpacked_stop_time AS
+            SELECT p.trip_id::bigint * 65536 + s.position AS id,
+                   p.trip_id, s.stop_id,
+                   p.start_time + p.arrival_offsets[s.position] AS arrival_time,
+                   p.start_time + p.departure_offsets[s.position] AS departure_time,
+                   p.stop_sequences[s.position] AS stop_sequence,
+                   COALESCE(p.details -> s.position::text ->> 'stop_headsign', '')
+                       AS stop_headsign,
+                   trim(substr(p.pickup_types, s.position::int, 1)) AS pickup_type,
+                   trim(substr(p.drop_off_types, s.position::int, 1)) AS drop_off_type,
+                   p.distances[s.position] AS shape_dist_traveled,
+                   p.interpolated[s.position] AS interpolated,
+                   COALESCE(p.details -> s.position::text -> 'extra_data', '{}')
+                       AS extra_data
+            FROM packed_stop_times p
+            JOIN pattern pt ON pt.id = p.pattern_id
+            CROSS JOIN LATERAL unnest(pt.stop_ids) WITH ORDINALITY AS s(stop_id, position)
+            """,
+            "DROP VIEW unpacked_stop_time",
+        ),
+    ]
@@ -0,0 +1,52 @@
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0009_packedstoptimes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shape',
+            name='distances',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), blank=True, help_text='shape_dist_traveled of the vertices of a compact shape', null=True, size=None),
+        ),
+        migrations.CreateModel(
+            name='ShapeVertex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('point', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('sequence', models.IntegerField()),
+                ('traveled', models.FloatField(blank=True, null=True)),
+                ('extra_data', models.JSONField(null=True)),
+                ('shape', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='vertices', to='multigtfs.shape')),
+            ],
+            options={
+                'db_table': 'shape_vertex',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(
+            """
+            CREATE VIEW shape_vertex AS
+            SELECT sp.id, sp.shape_id, sp.point, sp.sequence, sp.traveled,
+                   sp.extra_data
+            FROM shape_point sp
+            UNION ALL
+            SELECT -(s.id * 16777216 + v.path[1]) AS id, s.id AS shape_id,
+                   v.geom::geometry(Point, 4326) AS point, v.path[1] AS sequence,
+                   s.distances[v.path[1]] AS traveled, '{}'::jsonb AS extra_data
+            FROM shape s
+            CROSS JOIN LATERAL ST_DumpPoints(s.geometry) v
+            WHERE NOT EXISTS (
+                SELECT 1 FROM shape_point sp WHERE sp.shape_id = s.id
+            )
+            """,
+            "DROP VIEW shape_vertex",
+        ),
+    ]
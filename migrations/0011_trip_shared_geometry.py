@@ -0,0 +1,21 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0010_shape_compact'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trip',
+            name='geometry',
+            field=django.contrib.gis.db.models.fields.LineStringField(blank=True, help_text='Geometry cache of Stops, if no Shape', null=True, srid=4326),
+        ),
+        migrations.RunSQL(
+            "UPDATE trip SET geometry = NULL WHERE shape_id IS NOT NULL",
+            "UPDATE trip SET geometry = s.geometry FROM shape s WHERE s.id = trip.shape_id",
+        ),
+    ]
@@ -0,0 +1,147 @@
+import django.db.models.deletion
+import multigtfs.models.fields.seconds
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0011_trip_shared_geometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CombinedStopTime',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('arrival_time', multigtfs.models.fields.seconds.SecondsField(blank=True, default=None, null=True)),
+                ('departure_time', multigtfs.models.fields.seconds.SecondsField(blank=True, default=None, null=True)),
+                ('stop_sequence', models.IntegerField()),
+                ('stop_headsign', models.CharField(blank=True, max_length=255)),
+                ('pickup_type', models.CharField(blank=True, max_length=1)),
+                ('drop_off_type', models.CharField(blank=True, max_length=1)),
+                ('shape_dist_traveled', models.FloatField(blank=True, null=True)),
+                ('interpolated', models.BooleanField(default=False)),
+                ('extra_data', models.JSONField(blank=True, default=dict, null=True)),
+                ('stop', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='multigtfs.stop')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='multigtfs.trip')),
+            ],
+            options={
+                'db_table': 'combined_stop_time',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(
+            """
+            CREATE VIEW combined_stop_time AS
+            SELECT id, trip_id, stop_id, arrival_time, departure_time,
+                   stop_sequence, stop_headsign, pickup_type, drop_off_type,
+                   shape_dist_traveled, interpolated, extra_data
+            FROM stop_time
+            UNION ALL
+            SELECT -id, trip_id, stop_id, arrival_time, departure_time,
+                   stop_sequence, stop_headsign, pickup_type, drop_off_type,
+                   shape_dist_traveled, interpolated, extra_data
+            FROM unpacked_stop_time
+            """,
+            "DROP VIEW combined_stop_time",
+        ),
+        # Rebuild trip_time, and duty_chain which depends on it, from the
+        # stop times of packed trips too
+        migrations.RunSQL(
+            [
+                "DROP MATERIALIZED VIEW duty_chain",
+                "DROP MATERIALIZED VIEW trip_time",
+                """
+                CREATE MATERIALIZED VIEW trip_time AS
+                SELECT trip_id,
+                       MIN(arrival_time) as start_time,
+                       MAX(arrival_time) as end_time
+                FROM combined_stop_time
+                GROUP BY trip_id
+                """,
+                "CREATE UNIQUE INDEX trip_time_trip ON trip_time (trip_id)",
+                """
+                CREATE MATERIALIZED VIEW duty_chain AS
+                WITH chain_trip AS (
+                    SELECT t.id AS trip_id, r.feed_id, t.service_id,
+                           'block' AS kind, b.block_id AS chain_id
+                    FROM trip t
+                    JOIN route r ON r.id = t.route_id
+                    JOIN block b ON b.id = t.block_id
+                    UNION ALL
+                    SELECT t.id AS trip_id, r.feed_id, t.service_id,
+                           'brigade' AS kind, r.route_id || ':' || t.brigade_id AS chain_id
+                    FROM trip t
+                    JOIN route r ON r.id = t.route_id
+                    WHERE t.brigade_id IS NOT NULL
+                )
+                SELECT row_number() OVER (
+                           ORDER BY ct.feed_id, sd.date, ct.kind, ct.chain_id,
+                                    tt.start_time, ct.trip_id
+                       ) AS id,
+                       ct.feed_id, ct.kind, ct.chain_id, sd.date, ct.trip_id,
+                       row_number() OVER chain AS position,
+                       tt.start_time, tt.end_time,
+                       tt.start_time - lag(tt.end_time) OVER chain AS layover
+                FROM chain_trip ct
+                JOIN trip_time tt ON tt.trip_id = ct.trip_id
+                JOIN service_dates sd ON sd.service_id = ct.service_id
+                WINDOW chain AS (
+                    PARTITION BY ct.feed_id, sd.date, ct.kind, ct.chain_id
+                    ORDER BY tt.start_time, ct.trip_id
+                )
+                """,
+                "CREATE UNIQUE INDEX duty_chain_id ON duty_chain (id)",
+                "CREATE INDEX duty_chain_chain ON duty_chain (feed_id, date, kind, chain_id, position)",
+                "CREATE INDEX duty_chain_trip ON duty_chain (trip_id, date)",
+            ],
+            [
+                "DROP MATERIALIZED VIEW duty_chain",
+                "DROP MATERIALIZED VIEW trip_time",
+                """
+                CREATE MATERIALIZED VIEW trip_time AS
+                SELECT trip_id,
+                       MIN(arrival_time) as start_time,
+                       MAX(arrival_time) as end_time
+                FROM stop_time
+                GROUP BY trip_id
+                """,
+                "CREATE UNIQUE INDEX trip_time_trip ON trip_time (trip_id)",
+                """
+                CREATE MATERIALIZED VIEW duty_chain AS
+                WITH chain_trip AS (
+                    SELECT t.id AS trip_id, r.feed_id, t.service_id,
+                           'block' AS kind, b.block_id AS chain_id
+                    FROM trip t
+                    JOIN route r ON r.id = t.route_id
+                    JOIN block b ON b.id = t.block_id
+                    UNION ALL
+                    SELECT t.id AS trip_id, r.feed_id, t.service_id,
+                           'brigade' AS kind, r.route_id || ':' || t.brigade_id AS chain_id
+                    FROM trip t
+                    JOIN route r ON r.id = t.route_id
+                    WHERE t.brigade_id IS NOT NULL
+                )
+                SELECT row_number() OVER (
+                           ORDER BY ct.feed_id, sd.date, ct.kind, ct.chain_id,
+                                    tt.start_time, ct.trip_id
+                       ) AS id,
+                       ct.feed_id, ct.kind, ct.chain_id, sd.date, ct.trip_id,
+                       row_number() OVER chain AS position,
+                       tt.start_time, tt.end_time,
+                       tt.start_time - lag(tt.end_time) OVER chain AS layover
+                FROM chain_trip ct
+                JOIN trip_time tt ON tt.trip_id = ct.trip_id
+                JOIN service_dates sd ON sd.service_id = ct.service_id
+                WINDOW chain AS (
+                    PARTITION BY ct.feed_id, sd.date, ct.kind, ct.chain_id
+                    ORDER BY tt.start_time, ct.trip_id
+                )
+                """,
+                "CREATE UNIQUE INDEX duty_chain_id ON duty_chain (id)",
+                "CREATE INDEX duty_chain_chain ON duty_chain (feed_id, date, kind, chain_id, position)",
+                "CREATE INDEX duty_chain_trip ON duty_chain (trip_id, date)",
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+SHAPE_VERTEX = """
+    CREATE OR REPLACE VIEW shape_vertex AS
+    SELECT sp.id, sp.shape_id, sp.point, sp.sequence, sp.traveled,
+           sp.extra_data
+    FROM shape_point sp
+    UNION ALL
+    SELECT -(s.id * 16777216 + v.path[1]) AS id, s.id AS shape_id,
+           v.geom::geometry(Point, 4326) AS point, %s AS sequence,
+           s.distances[v.path[1]] AS traveled, '{}'::jsonb AS extra_data
+    FROM shape s
+    CROSS JOIN LATERAL ST_DumpPoints(s.geometry) v
+    WHERE NOT EXISTS (
+        SELECT 1 FROM shape_point sp WHERE sp.shape_id = s.id
+    )
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multigtfs', '0012_combinedstoptime'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shape',
+            name='sequences',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, help_text='shape_pt_sequence of the vertices of a compact shape', null=True, size=None),
+        ),
+        migrations.RunSQL(
+            SHAPE_VERTEX % "COALESCE(s.sequences[v.path[1]], v.path[1])",
+            SHAPE_VERTEX % "v.path[1]",
+        ),
+    ]
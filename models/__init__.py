@@ -17,18 +17,24 @@ from __future__ import unicode_literals
 
 from .agency import Agency
 from .block import Block
+from .duty_chain import DutyChain
 from .fare import Fare
 from .fare_rule import FareRule
 from .feed import Feed
 from .feed_info import FeedInfo
+from .feed_revision import FeedRevision
+from .footpath import Footpath
 from .frequency import Frequency
+from .frequency_departure import FrequencyDeparture
+from .packed_stop_times import PackedStopTimes, UnpackedStopTime
+from .pattern import Pattern
 from .route import Route
 from .service import Service
 from .service_date import ServiceDate
 from .service_dates import ServiceDates
-from .shape import Shape, ShapePoint
+from .shape import Shape, ShapePoint, ShapeVertex
 from .stop import Stop
-from .stop_time import StopTime
+from .stop_time import CombinedStopTime, StopTime
 from .transfer import Transfer
 from .trip import Trip
 from .trip_time import TripTime
@@ -38,21 +44,30 @@ from .zone import Zone
 __models = (
     Agency,
     Block,
+    CombinedStopTime,
+    DutyChain,
     Fare,
     FareRule,
     Feed,
     FeedInfo,
+    FeedRevision,
+    Footpath,
     Frequency,
+    FrequencyDeparture,
+    PackedStopTimes,
+    Pattern,
     Route,
     Service,
     ServiceDate,
     ServiceDates,
     Shape,
     ShapePoint,
+    ShapeVertex,
     Stop,
     StopTime,
     Transfer,
     Trip,
     TripTime,
+    UnpackedStopTime,
     Zone,
 )
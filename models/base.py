@@ -17,16 +17,43 @@
 from __future__ import unicode_literals
 from codecs import BOM_UTF8
 from collections import defaultdict
+from contextlib import nullcontext
 from csv import reader, writer
-from datetime import datetime, date
+from datetime import datetime
 from logging import getLogger
 import re
 
 from django.contrib.gis.db import models
+from django.contrib.postgres.aggregates import BoolOr
+from django.db import connection
+from django.db.models import (
+    BooleanField,
+    Case,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Func,
+    IntegerField,
+    Q,
+    TextField,
+    Value,
+    When,
+)
+from django.db.models.functions import NullIf
+from django.db.models.fields.json import KeyTextTransform
 from django.db.models.fields.related import ManyToManyField
 from io import StringIO
 
-from multigtfs.compat import get_blank_value, write_text_rows, Manager, QuerySet
+from multigtfs.compat import (
+    copy_to,
+    get_blank_value,
+    write_text_rows,
+    Manager,
+    QuerySet,
+)
+from multigtfs.models.feed_revision import FeedRevision
+from multigtfs.models.fields import SecondsArray, SecondsField
+from multigtfs.query_cache import query_cache
 
 logger = getLogger(__name__)
 re_point = re.compile(r"(?P<name>point)\[(?P<index>\d)\]")
@@ -35,10 +62,53 @@ CSV_BOM = BOM_UTF8.decode("utf-8")
 
 
 class BaseQuerySet(QuerySet):
+    def seconds_array(self, field_name):
+        """Return the values of a SecondsField as a SecondsArray
+
+        The times are read as integers, without creating a Seconds object
+        for each one.  Order the queryset first for a meaningful order.
+        """
+        values = self.values_list(
+            ExpressionWrapper(F(field_name), output_field=IntegerField()), flat=True
+        )
+        return SecondsArray(list(values))
+
+    def geometry_field_names(self):
+        """Return the names of the geometry fields that are deferred
+
+        These are the lines and shapes, such as Trip.geometry.  Points are
+        small, and are loaded.
+        """
+        return [
+            field.name
+            for field in self.model._meta.concrete_fields
+            if isinstance(field, models.GeometryField)
+            and not isinstance(field, models.PointField)
+        ]
+
+    def with_geometry(self):
+        """Load the geometry fields, which are deferred by default
+
+        If only some fields are loaded (see QuerySet.only), the geometry
+        fields are loaded with them.
+        """
+        deferred, is_deferred = self.query.deferred_loading
+        if not is_deferred:
+            return self.only(*deferred, *self.geometry_field_names())
+        remaining = set(deferred) - set(self.geometry_field_names())
+        queryset = self.defer(None)
+        if remaining:
+            queryset = queryset.defer(*remaining)
+        return queryset
+
     def populated_column_map(self):
-        """Return the _column_map without unused optional fields"""
-        column_map = []
+        """Return the _column_map without unused optional fields
+
+        All optional columns are checked in a single aggregate query, rather
+        than one query per column.
+        """
         cls = self.model
+        optional = {}
         for csv_name, field_pattern in cls._column_map:
             # Separate the local field name from foreign columns
             if "__" in field_pattern:
@@ -53,26 +123,61 @@ class BaseQuerySet(QuerySet):
             else:
                 field = cls._meta.get_field(field_name)
 
-            # Only add optional columns if they are used in the records
+            # Optional columns are only added if used in the records
             if field and field.blank and not field.has_default():
                 kwargs = {field_name: get_blank_value(field)}
-                if self.exclude(**kwargs).exists():
-                    column_map.append((csv_name, field_pattern))
-            else:
-                column_map.append((csv_name, field_pattern))
-        return column_map
+                optional[csv_name] = BoolOr(
+                    ExpressionWrapper(~Q(**kwargs), output_field=BooleanField())
+                )
+
+        populated = {}
+        if optional:
+            aggregates = {
+                "populated_%d" % i: agg for i, agg in enumerate(optional.values())
+            }
+            results = self.aggregate(**aggregates)
+            for i, csv_name in enumerate(optional):
+                populated[csv_name] = bool(results["populated_%d" % i])
+
+        return [
+            (csv_name, field_pattern)
+            for csv_name, field_pattern in cls._column_map
+            if populated.get(csv_name, True)
+        ]
 
 
 class BaseManager(Manager):
     def get_queryset(self):
-        """Return the custom queryset."""
-        return BaseQuerySet(self.model)
+        """Return the custom queryset, with geometry fields deferred"""
+        queryset = BaseQuerySet(self.model)
+        geometry_fields = queryset.geometry_field_names()
+        if geometry_fields:
+            queryset = queryset.defer(*geometry_fields)
+        return queryset
+
+    def with_geometry(self):
+        """Return the objects, with the geometry fields loaded"""
+        return self.get_queryset().with_geometry()
 
     def in_feed(self, feed):
         """Return the objects in the target feed"""
         kwargs = {self.model._rel_to_feed: feed}
         return self.filter(**kwargs)
 
+    def cached(self, name, args, compute, feed_id):
+        """Return a query result from the in-process query cache
+
+        Cached results are shared, and must not be modified.
+
+        Keyword arguments:
+        name - The name of the query, unique for the model
+        args - A tuple of the hashable query arguments
+        compute - A function that runs the query
+        feed_id - The ID of the feed, or a function that returns it
+        """
+        key = (self.model.__name__, name) + tuple(args)
+        return query_cache.get(key, compute, feed_id)
+
 
 class Base(models.Model):
     """Base class for models that are defined in the GTFS spec
@@ -94,6 +199,10 @@ class Base(models.Model):
     on a feed like this:
     Model.objects.filter(_rel_to_feed=feed)
 
+    _export_with_copy - If True, export_txt formats the rows in the database
+    and streams them with COPY ... TO STDOUT, rather than formatting them in
+    Python.  This is used for the largest GTFS files.  The default is False.
+
     """
 
     class Meta:
@@ -105,6 +214,56 @@ class Base(models.Model):
     # The relation of the model to the feed it belongs to.
     _rel_to_feed = "feed"
 
+    # Export with PostgreSQL COPY instead of formatting rows in Python
+    _export_with_copy = False
+
+    def save(self, *args, **kwargs):
+        """Save the record, and bump the content revision of the feed
+
+        Inside FeedRevision.bulk, the revision is bumped once at the end.
+        """
+        super(Base, self).save(*args, **kwargs)
+        if FeedRevision.collect(type(self).__name__):
+            return
+        feed_id = self._get_feed_id()
+        if feed_id:
+            FeedRevision.bump(feed_id, [type(self).__name__])
+
+    def delete(self, *args, **kwargs):
+        """Delete the record, and bump the content revision of the feed"""
+        if FeedRevision.collect(type(self).__name__):
+            return super(Base, self).delete(*args, **kwargs)
+        feed_id = self._get_feed_id()
+        result = super(Base, self).delete(*args, **kwargs)
+        if feed_id:
+            FeedRevision.bump(feed_id, [type(self).__name__])
+        return result
+
+    def _get_feed_id(self):
+        """Get the ID of the feed the record belongs to, if any
+
+        The ID is read through the related records that are loaded, and
+        only queried if one of them is not.
+        """
+        record = self
+        parts = self._rel_to_feed.split("__")
+        for part in parts[:-1]:
+            if not record._meta.get_field(part).is_cached(record):
+                break
+            record = getattr(record, part)
+            if record is None:
+                return None
+        else:
+            return getattr(record, parts[-1] + "_id")
+        if self.pk is None:
+            return None
+        return (
+            type(self)
+            .objects.filter(pk=self.pk)
+            .values_list(self._rel_to_feed, flat=True)
+            .first()
+        )
+
     @classmethod
     def import_txt(cls, txt_file, feed, filter_func=None):
         """Import from the GTFS text file"""
@@ -307,47 +466,72 @@ class Base(models.Model):
             feed.save()
         return len(unique_line)
 
+    @classmethod
+    def import_table(cls, path, feed, filter_func=None):
+        """Import from a Parquet or Arrow IPC file (see multigtfs.columnar)"""
+        from multigtfs.columnar import import_table
+
+        return import_table(cls, path, feed, filter_func)
+
     @classmethod
     def export_txt(cls, feed):
         """Export records as a GTFS comma-separated file"""
-        objects = cls.objects.in_feed(feed)
+        out = StringIO()
+        if cls.write_txt(feed, lambda filename: nullcontext(out)) is None:
+            return
+        return out.getvalue()
+
+    @classmethod
+    def write_txt(cls, feed, opener, deterministic=False, feed_filter=None):
+        """Stream records into a GTFS comma-separated file
+
+        Keyword arguments:
+        feed - The feed to export
+        opener - A function that takes the GTFS filename and returns a
+            writable text file, used as a context manager.  It is only
+            called if there are records to export.
+        deterministic - If True, rows are sorted by every exported column
+            after the usual sort order, and extra columns are sorted by
+            name, so the output only depends on the records.
+        feed_filter - A FeedFilter that selects the exported subset of the
+            feed, or None to export every record.
+
+        Returns the number of records written, or None if there were none.
+        """
+        objects = cls._export_objects(feed)
+        if feed_filter:
+            objects = feed_filter.filter(cls, feed, objects)
 
         # If no records, return None
-        if not objects.exists():
+        if not objects.exists() or cls._skip_export(objects):
             return
 
         # Get the columns used in the dataset
         column_map = objects.populated_column_map()
         columns, fields = zip(*column_map)
         extra_columns = feed.meta.get("extra_columns", {}).get(cls.__name__, [])
+        if deterministic:
+            extra_columns = sorted(extra_columns)
 
         # Get sort order
-        if hasattr(cls, "_sort_order"):
-            sort_fields = cls._sort_order
-        else:
-            sort_fields = []
-            for field in fields:
-                base_field = field.split("__", 1)[0]
-                point_match = re_point.match(base_field)
-                if point_match:
-                    continue
-                field_type = cls._meta.get_field(base_field)
-                assert not isinstance(field_type, ManyToManyField)
-                sort_fields.append(field)
-
-        # Create CSV writer
-        out = StringIO()
-        csv_writer = writer(out, lineterminator="\n")
-
-        # Write header row
-        header_row = [str(c) for c in columns]
-        header_row.extend(extra_columns)
-        write_text_rows(csv_writer, [header_row])
+        sort_fields = cls._export_sort_fields(fields)
 
         # Report the work to be done
         total = objects.count()
         logger.info("%d %s to export...", total, cls._meta.verbose_name_plural)
 
+        if cls._export_with_copy and connection.vendor == "postgresql":
+            values = cls._compile_copy_columns(column_map, extra_columns)
+            rows_query = cls._rows_query(objects, sort_fields, values, deterministic)
+            sql, params = rows_query.query.sql_with_params()
+            copy_sql = "COPY (%s) TO STDOUT WITH CSV" % sql
+            with opener(cls._filename) as out:
+                cls._write_header(out, columns, extra_columns)
+                with connection.cursor() as cursor:
+                    copy_to(cursor, copy_sql, params, out)
+            logger.info("Exported %d %s", total, cls._meta.verbose_name_plural)
+            return total
+
         # Populate related items cache
         model_to_field_name = {}
         cache = {}
@@ -357,57 +541,277 @@ class Base(models.Model):
                 field = cls._meta.get_field(local_field_name)
                 field_type = field.related_model
                 model_name = field_type.__name__
-                if model_name in model_to_field_name:
+                if model_name in model_to_field_name and not feed_filter:
                     # Already loaded this model under a different field name
                     cache[field_name] = cache[model_to_field_name[model_name]]
                 else:
                     # Load all feed data for this model
-                    pairs = field_type.objects.in_feed(feed).values_list(
-                        "id", subfield_name
-                    )
+                    related = field_type.objects.in_feed(feed)
+                    if feed_filter:
+                        # Only the related items of the subset
+                        related = related.filter(
+                            id__in=objects.values(local_field_name)
+                        )
+                    pairs = related.values_list("id", subfield_name)
                     cache[field_name] = dict((i, str(x)) for i, x in pairs)
                     cache[field_name][None] = ""
                     model_to_field_name[model_name] = field_name
 
-        # Assemble the rows, writing when we hit batch size
-        count = 0
-        rows = []
-        for item in objects.order_by(*sort_fields).iterator():
-            row = []
-            for csv_name, field_name in column_map:
-                obj = item
-                point_match = re_point.match(field_name)
-                if "__" in field_name:
-                    # Return relations from cache
-                    local_field_name = field_name.split("__", 1)[0]
-                    field_id = getattr(obj, local_field_name + "_id")
-                    row.append(cache[field_name][field_id])
-                elif point_match:
-                    # Get the lat or long from the point
-                    name, index = point_match.groups()
-                    field = getattr(obj, name)
-                    row.append(field.coords[int(index)])
+        # Compile the row formatter once, rather than per row
+        values, formatters = cls._compile_export_columns(
+            column_map, extra_columns, cache
+        )
+        rows_query = cls._rows_query(objects, sort_fields, values, deterministic)
+
+        with opener(cls._filename) as out:
+            csv_writer = cls._write_header(out, columns, extra_columns)
+
+            # Assemble the rows, writing when we hit batch size
+            count = 0
+            rows = []
+            for item in rows_query.iterator(chunk_size=batch_size):
+                rows.append([fmt(value) for fmt, value in zip(formatters, item)])
+                if len(rows) % batch_size == 0:  # pragma: no cover
+                    write_text_rows(csv_writer, rows)
+                    count += len(rows)
+                    logger.info(
+                        "Exported %d %s", count, cls._meta.verbose_name_plural
+                    )
+                    rows = []
+
+            # Write rows smaller than batch size
+            write_text_rows(csv_writer, rows)
+            count += len(rows)
+        return count
+
+    @classmethod
+    def _export_objects(cls, feed):
+        """Get the exported records of the feed
+
+        The records can be of another model with the same exported fields,
+        such as a view.
+        """
+        return cls.objects.in_feed(feed)
+
+    @classmethod
+    def _skip_export(cls, objects):
+        """Should the file be skipped, although there are records to export?
+
+        objects are the exported records, after any feed filter.
+        """
+        return False
+
+    @classmethod
+    def _export_field(cls, field_name):
+        """Get the query expression for the exported value of a field"""
+        return F(field_name)
+
+    @classmethod
+    def _export_sort_fields(cls, fields):
+        """Get the sort order of exported records"""
+        if hasattr(cls, "_sort_order"):
+            return cls._sort_order
+        sort_fields = []
+        for field in fields:
+            base_field = field.split("__", 1)[0]
+            point_match = re_point.match(base_field)
+            if point_match:
+                continue
+            field_type = cls._meta.get_field(base_field)
+            assert not isinstance(field_type, ManyToManyField)
+            sort_fields.append(field)
+        return sort_fields
+
+    @staticmethod
+    def _rows_query(objects, sort_fields, values, deterministic=False):
+        """Return the sorted rows as tuples of the exported values
+
+        If deterministic, ties in the sort order are broken by the exported
+        values, so that equal records always come out in the same order.
+        """
+        value_names = ["export_%d" % i for i in range(len(values))]
+        order = list(sort_fields)
+        if deterministic:
+            order.extend(value_names)
+        return (
+            objects.annotate(**dict(zip(value_names, values)))
+            .order_by(*order)
+            .values_list(*value_names)
+        )
+
+    @staticmethod
+    def _write_header(out, columns, extra_columns):
+        """Write the header row, and return the CSV writer for the data rows"""
+        csv_writer = writer(out, lineterminator="\n")
+        header_row = [str(c) for c in columns]
+        header_row.extend(extra_columns)
+        write_text_rows(csv_writer, [header_row])
+        return csv_writer
+
+    @classmethod
+    def _compile_export_columns(cls, column_map, extra_columns, cache):
+        """Get the database values and formatters for the exported columns
+
+        Returns two lists, with an item per output column:
+        - A query expression that selects the raw value
+        - A function that converts the raw value to the CSV cell
+        """
+        values = []
+        formatters = []
+        for csv_name, field_name in column_map:
+            point_match = re_point.match(field_name)
+            if "__" in field_name:
+                # Relations are selected by ID and mapped with the cache
+                local_field_name = field_name.split("__", 1)[0]
+                values.append(F(local_field_name + "_id"))
+                formatters.append(cache[field_name].__getitem__)
+            elif point_match:
+                # Get the lat or long from the database, not GEOS
+                name, index = point_match.groups()
+                function = ("ST_X", "ST_Y")[int(index)]
+                values.append(
+                    Func(F(name), function=function, output_field=FloatField())
+                )
+                formatters.append(_format_text)
+            else:
+                field = cls._meta.get_field(field_name)
+                if isinstance(field, SecondsField):
+                    # Skip creating Seconds instances
+                    values.append(
+                        ExpressionWrapper(
+                            cls._export_field(field_name), output_field=IntegerField()
+                        )
+                    )
+                    formatters.append(_format_seconds)
+                elif isinstance(field, models.DateField):
+                    values.append(cls._export_field(field_name))
+                    formatters.append(_format_date)
+                elif isinstance(field, models.BooleanField):
+                    values.append(cls._export_field(field_name))
+                    formatters.append(_format_bool)
                 else:
-                    # Handle other field types
-                    field = getattr(obj, field_name) if obj else ""
-                    if isinstance(field, date):
-                        formatted = field.strftime("%Y%m%d")
-                        row.append(str(formatted))
-                    elif isinstance(field, bool):
-                        row.append(1 if field else 0)
-                    elif field is None:
-                        row.append("")
-                    else:
-                        row.append(str(field))
-            for col in extra_columns:
-                row.append(obj.extra_data.get(col, ""))
-            rows.append(row)
-            if len(rows) % batch_size == 0:  # pragma: no cover
-                write_text_rows(csv_writer, rows)
-                count += len(rows)
-                logger.info("Exported %d %s", count, cls._meta.verbose_name_plural)
-                rows = []
-
-        # Write rows smaller than batch size
-        write_text_rows(csv_writer, rows)
-        return out.getvalue()
+                    values.append(cls._export_field(field_name))
+                    formatters.append(_format_text)
+        for col in extra_columns:
+            values.append(KeyTextTransform(col, "extra_data"))
+            formatters.append(_format_text)
+        return values, formatters
+
+    @classmethod
+    def _compile_copy_columns(cls, column_map, extra_columns):
+        """Get query expressions that format the exported columns in SQL
+
+        The expressions return the CSV cell as text, matching the Python
+        formatters of _compile_export_columns.  Empty text is returned as
+        NULL, because COPY quotes empty strings but not NULLs.
+        """
+        values = []
+        for csv_name, field_name in column_map:
+            point_match = re_point.match(field_name)
+            if "__" in field_name:
+                values.append(NullIf(F(field_name), Value("")))
+            elif point_match:
+                name, index = point_match.groups()
+                function = ("ST_X", "ST_Y")[int(index)]
+                values.append(
+                    FloatText(
+                        Func(F(name), function=function, output_field=FloatField())
+                    )
+                )
+            else:
+                field = cls._meta.get_field(field_name)
+                if isinstance(field, SecondsField):
+                    values.append(SecondsText(cls._export_field(field_name)))
+                elif isinstance(field, models.DateField):
+                    values.append(
+                        Func(
+                            cls._export_field(field_name),
+                            Value("YYYYMMDD"),
+                            function="to_char",
+                            output_field=TextField(),
+                        )
+                    )
+                elif isinstance(field, models.BooleanField):
+                    values.append(
+                        Case(When(**{field_name: True}, then=1), default=0)
+                    )
+                elif isinstance(field, models.FloatField):
+                    values.append(FloatText(cls._export_field(field_name)))
+                elif isinstance(field, (models.CharField, models.TextField)):
+                    values.append(
+                        NullIf(cls._export_field(field_name), Value(""))
+                    )
+                else:
+                    values.append(cls._export_field(field_name))
+        for col in extra_columns:
+            values.append(NullIf(KeyTextTransform(col, "extra_data"), Value("")))
+        return values
+
+
+class RepeatedArgFunc(Func):
+    """A function whose template refers to its one argument several times
+
+    The compiled argument is substituted at each %(expressions)s in the
+    template, in parentheses, and its params are repeated to match.
+    """
+
+    arity = 1
+
+    def as_sql(self, compiler, connection, **extra_context):
+        arg_sql, arg_params = compiler.compile(self.get_source_expressions()[0])
+        count = self.template.count("%(expressions)s")
+        sql = self.template % {"expressions": "(%s)" % arg_sql}
+        return sql, tuple(arg_params) * count
+
+
+class SecondsText(RepeatedArgFunc):
+    """Format database seconds as HH:MM:SS text"""
+
+    template = (
+        "CASE WHEN %(expressions)s < 36000 THEN '0' ELSE '' END"
+        " || (%(expressions)s / 3600)::text"
+        " || ':' || lpad(mod(%(expressions)s / 60, 60)::text, 2, '0')"
+        " || ':' || lpad(mod(%(expressions)s, 60)::text, 2, '0')"
+    )
+    output_field = TextField()
+
+
+class FloatText(RepeatedArgFunc):
+    """Format a double as text, like Python's str(float)
+
+    PostgreSQL drops the fractional part of integral values, which Python
+    writes as "1.0".  Non-integral values at or above 1e15, which PostgreSQL
+    writes in exponent notation, are not handled.
+    """
+
+    template = (
+        "CASE WHEN %(expressions)s = trunc(%(expressions)s)"
+        " AND abs(%(expressions)s) < 1e16"
+        " THEN trunc(%(expressions)s)::numeric::text || '.0'"
+        " ELSE %(expressions)s::text END"
+    )
+    output_field = TextField()
+
+
+def _format_text(value):
+    """Format a value as a CSV cell"""
+    return "" if value is None else str(value)
+
+
+def _format_date(value):
+    """Format a date as a CSV cell, in YYYYMMDD format"""
+    return "" if value is None else value.strftime("%Y%m%d")
+
+
+def _format_bool(value):
+    """Format a boolean as a CSV cell"""
+    return 1 if value else 0
+
+
+def _format_seconds(value):
+    """Format database seconds as a CSV cell, in HH:MM:SS format"""
+    if value is None:
+        return ""
+    minutes, seconds = divmod(value, 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%02d:%02d:%02d" % (hours, minutes, seconds)
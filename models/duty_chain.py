@@ -0,0 +1,88 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from django.db import connection, models
+
+from multigtfs.models.fields.seconds import SecondsField
+from multigtfs.models.trip import Trip
+
+
+class DutyChain(models.Model):
+    """A trip in the sequence of trips run by one vehicle on a date
+
+    This data is not part of the GTFS.  Chains are built from the block of
+    the trips (kind "block", chain_id is the block_id), and from their
+    brigade (kind "brigade", chain_id is "<route_id>:<brigade_id>", as
+    brigade numbers are per route).  A trip with both is in two chains.
+
+    This is a materialized view over trip_time and service_dates, so it is
+    refreshed after them.
+    """
+
+    BLOCK = "block"
+    BRIGADE = "brigade"
+
+    feed = models.ForeignKey("Feed", on_delete=models.DO_NOTHING)
+    kind = models.CharField(max_length=7)
+    chain_id = models.CharField(max_length=255)
+    date = models.DateField()
+    trip = models.ForeignKey(Trip, on_delete=models.DO_NOTHING)
+    position = models.IntegerField(help_text="Position of the trip in the chain")
+    start_time = SecondsField()
+    end_time = SecondsField()
+    layover = models.IntegerField(
+        null=True, help_text="Seconds since the end of the previous trip"
+    )
+
+    def __str__(self):
+        return "%s %s %s-%d %s" % (
+            self.kind,
+            self.chain_id,
+            self.date,
+            self.position,
+            self.trip,
+        )
+
+    @classmethod
+    def refresh(cls):
+        with connection.cursor() as cursor:
+            cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY duty_chain")
+
+    @classmethod
+    def chain(cls, feed, date, kind, chain_id):
+        """Return the trips of a chain on a date, in order"""
+        return (
+            cls.objects.filter(feed=feed, date=date, kind=kind, chain_id=chain_id)
+            .select_related("trip")
+            .order_by("position")
+        )
+
+    @classmethod
+    def chain_of_trip(cls, trip, date, kind=BRIGADE):
+        """Return the whole chain that a trip is part of on a date, in order"""
+        links = cls.objects.filter(trip=trip, date=date, kind=kind)
+        return (
+            cls.objects.filter(
+                feed__in=links.values("feed"),
+                date=date,
+                kind=kind,
+                chain_id__in=links.values("chain_id"),
+            )
+            .select_related("trip")
+            .order_by("position")
+        )
+
+    class Meta:
+        managed = False
+        db_table = "duty_chain"
@@ -14,24 +14,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import unicode_literals
-from zipfile import ZipFile
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile, ZipInfo
+import hashlib
 import logging
+import multiprocessing
 import os
 import os.path
+import shutil
+import tempfile
 import time
 from timepred.processing.geohelper import fix_unmonotone_stops
 
-from django.db import connection
+import django
+from django.apps import apps
+from django.db import connection, connections, transaction
 from django.contrib.gis.db import models
 from django.db.models import Manager
 from django.db.models.signals import post_save
-from multigtfs.compat import open_writable_zipfile, opener_from_zipfile
+from multigtfs import columnar
+from multigtfs.app_settings import (
+    MULTIGTFS_EXPORT_CACHE_DIR,
+    MULTIGTFS_PACK_STOP_TIMES,
+)
+from multigtfs.compat import (
+    open_writable_zipfile,
+    opener_from_zipfile,
+    writer_from_zipfile,
+)
+from multigtfs.export_cache import ExportCache
 from multigtfs.models.service_dates import ServiceDates
 from .agency import Agency
+from .duty_chain import DutyChain
 from .fare import Fare
 from .fare_rule import FareRule
 from .feed_info import FeedInfo
+from .feed_revision import FeedRevision
 from .frequency import Frequency
+from .frequency_departure import FrequencyDeparture
+from .packed_stop_times import PackedStopTimes
+from .pattern import Pattern
 from .route import Route
 from .service import Service
 from .service_date import ServiceDate
@@ -44,6 +66,22 @@ from .trip_time import TripTime
 
 logger = logging.getLogger(__name__)
 
+export_order = (
+    Agency,
+    Service,
+    ServiceDate,
+    Fare,
+    FareRule,
+    FeedInfo,
+    Frequency,
+    Route,
+    ShapePoint,
+    StopTime,
+    Stop,
+    Transfer,
+    Trip,
+)
+
 
 class Feed(models.Model):
     """Represents a single GTFS feed.
@@ -55,6 +93,7 @@ class Feed(models.Model):
     id: int
     route_set: Manager[Route]
     shape_set: Manager[Shape]
+    feedrevision_set: Manager[FeedRevision]
 
     name = models.CharField(max_length=255)
     created = models.DateTimeField(auto_now_add=True)
@@ -75,162 +114,538 @@ class Feed(models.Model):
 
         Keyword arguments:
         gtfs_obj - A path to a zipped GTFS file, a path to an extracted
-            GTFS file, or an open GTFS zip file.
+            GTFS file, or an open GTFS zip file.  The GTFS file can contain
+            Parquet or Arrow tables, such as stop_times.parquet, instead of
+            text files (see multigtfs.columnar).  If a table is in both
+            forms, the columnar file is imported.
 
         Returns is a list of objects imported
         """
         total_start = time.time()
 
-        # Determine the type of gtfs_obj
-        opener = None
-        filelist = None
-        if isinstance(gtfs_obj, str) and os.path.isdir(gtfs_obj):
-            opener = open
-            filelist = []
-            for dirpath, dirnames, filenames in os.walk(gtfs_obj):
-                filelist.extend([os.path.join(dirpath, f) for f in filenames])
-        else:
-            zfile = ZipFile(gtfs_obj, "r")
-            opener = opener_from_zipfile(zfile)
-            filelist = zfile.namelist()
-
-        gtfs_order = (
-            Agency,
-            Stop,
-            Route,
-            Service,
-            ServiceDate,
-            ShapePoint,
-            Trip,
-            StopTime,
-            Frequency,
-            Fare,
-            FareRule,
-            Transfer,
-            FeedInfo,
-        )
-        post_save.disconnect(dispatch_uid="post_save_shapepoint")
-        post_save.disconnect(dispatch_uid="post_save_stop")
-        try:
-            for klass in gtfs_order:
-                for f in filelist:
-                    if os.path.basename(f) == klass._filename:
-                        start_time = time.time()
+        with FeedRevision.bulk(self.id) as revisions:
+            # Determine the type of gtfs_obj
+            opener = None
+            filelist = None
+            zfile = None
+            if isinstance(gtfs_obj, str) and os.path.isdir(gtfs_obj):
+                opener = open
+                filelist = []
+                for dirpath, dirnames, filenames in os.walk(gtfs_obj):
+                    filelist.extend([os.path.join(dirpath, f) for f in filenames])
+            else:
+                zfile = ZipFile(gtfs_obj, "r")
+                opener = opener_from_zipfile(zfile)
+                filelist = zfile.namelist()
+            members = {}
+            for f in filelist:
+                members.setdefault(os.path.basename(f), f)
+
+            gtfs_order = (
+                Agency,
+                Stop,
+                Route,
+                Service,
+                ServiceDate,
+                ShapePoint,
+                Trip,
+                StopTime,
+                Frequency,
+                Fare,
+                FareRule,
+                Transfer,
+                FeedInfo,
+            )
+            post_save.disconnect(dispatch_uid="post_save_shapepoint")
+            post_save.disconnect(dispatch_uid="post_save_stop")
+            try:
+                for klass in gtfs_order:
+                    # Import one source per table, preferring columnar files
+                    candidates = [
+                        columnar.table_filename(klass, fmt) for fmt in columnar.FORMATS
+                    ] + [klass._filename]
+                    found = [name for name in candidates if name in members]
+                    if not found:
+                        continue
+                    filename = found[0]
+                    if len(found) > 1:
+                        logger.warning(
+                            "Importing %s, ignoring %s", filename, ", ".join(found[1:])
+                        )
+                    f = members[filename]
+                    start_time = time.time()
+                    if filename == klass._filename:
                         table = opener(f)
                         count = klass.import_txt(table, self) or 0
-                        end_time = time.time()
-                        logger.info(
-                            "Imported %s (%d %s) in %0.1f seconds",
-                            klass._filename,
-                            count,
-                            klass._meta.verbose_name_plural,
-                            end_time - start_time,
-                        )
                         table.close()
+                    elif zfile:
+                        # Columnar tables are read from a path
+                        with tempfile.TemporaryDirectory() as temp_dir:
+                            path = zfile.extract(f, temp_dir)
+                            count = klass.import_table(path, self) or 0
+                    else:
+                        count = klass.import_table(f, self) or 0
+                    end_time = time.time()
+                    logger.info(
+                        "Imported %s (%d %s) in %0.1f seconds",
+                        filename,
+                        count,
+                        klass._meta.verbose_name_plural,
+                        end_time - start_time,
+                    )
 
-        finally:
-            post_save.connect(post_save_shapepoint, sender=ShapePoint)
-            post_save.connect(post_save_stop, sender=Stop)
-
-        # Update geometries
-        start_time = time.time()
-        for shape in self.shape_set.all():
-            shape.update_geometry(update_parent=False)
-        end_time = time.time()
-        logger.info(
-            "Updated geometries for %d shapes in %0.1f seconds",
-            self.shape_set.count(),
-            end_time - start_time,
-        )
-
-        start_time = time.time()
-        trips = Trip.objects.in_feed(self)
-        for trip in trips:
-            trip.update_geometry(update_parent=False)
-        end_time = time.time()
-        logger.info(
-            "Updated geometries for %d trips in %0.1f seconds",
-            trips.count(),
-            end_time - start_time,
-        )
-
-        start_time = time.time()
-        routes = self.route_set.all()
-        for route in routes:
-            route.update_geometry()
-        end_time = time.time()
-        logger.info(
-            "Updated geometries for %d routes in %0.1f seconds",
-            routes.count(),
-            end_time - start_time,
-        )
-
-        start_time = time.time()
-        with connection.cursor() as cursor:
-            cursor.execute(
-                "UPDATE stop_time SET shape_dist_traveled = ST_LineLocatePoint(ST_Transform(t.geometry, 32633), ST_Transform(s.point, 32633)) * ST_Length(ST_Transform(t.geometry, 32633)) FROM trip t, stop s WHERE t.id = stop_time.trip_id AND s.id = stop_time.stop_id AND s.feed_id = %s",
-                [self.id],
+            finally:
+                post_save.connect(post_save_shapepoint, sender=ShapePoint)
+                post_save.connect(post_save_stop, sender=Stop)
+
+            # Update geometries
+            start_time = time.time()
+            for shape in self.shape_set.with_geometry():
+                shape.update_geometry(update_parent=False)
+            end_time = time.time()
+            logger.info(
+                "Updated geometries for %d shapes in %0.1f seconds",
+                self.shape_set.count(),
+                end_time - start_time,
             )
-            stop_time_count = cursor.rowcount
-        end_time = time.time()
-        logger.info(
-            "Updated geometries for %d stop_times in %0.1f seconds",
-            stop_time_count,
-            end_time - start_time,
-        )
 
-        ServiceDates.refresh()
-        logger.info("Refreshed service dates materialized view")
+            start_time = time.time()
+            trips = Trip.objects.in_feed(self).with_geometry()
+            for trip in trips:
+                trip.update_geometry(update_parent=False)
+            end_time = time.time()
+            logger.info(
+                "Updated geometries for %d trips in %0.1f seconds",
+                trips.count(),
+                end_time - start_time,
+            )
+
+            start_time = time.time()
+            routes = self.route_set.with_geometry()
+            for route in routes:
+                route.update_geometry()
+            end_time = time.time()
+            logger.info(
+                "Updated geometries for %d routes in %0.1f seconds",
+                routes.count(),
+                end_time - start_time,
+            )
+
+            start_time = time.time()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE stop_time SET shape_dist_traveled = ST_LineLocatePoint(ST_Transform(COALESCE(sh.geometry, t.geometry), 32633), ST_Transform(s.point, 32633)) * ST_Length(ST_Transform(COALESCE(sh.geometry, t.geometry), 32633)) FROM trip t LEFT JOIN shape sh ON sh.id = t.shape_id, stop s WHERE t.id = stop_time.trip_id AND s.id = stop_time.stop_id AND s.feed_id = %s",
+                    [self.id],
+                )
+                stop_time_count = cursor.rowcount
+            end_time = time.time()
+            logger.info(
+                "Updated geometries for %d stop_times in %0.1f seconds",
+                stop_time_count,
+                end_time - start_time,
+            )
+
+            start_time = time.time()
+            interpolated = StopTime.interpolate_times(self)
+            end_time = time.time()
+            logger.info(
+                "Interpolated %d missing stop times in %0.1f seconds",
+                interpolated,
+                end_time - start_time,
+            )
+
+            start_time = time.time()
+            patterns = Pattern.refresh(self)
+            end_time = time.time()
+            logger.info(
+                "Extracted %d trip patterns in %0.1f seconds",
+                patterns,
+                end_time - start_time,
+            )
+
+            ServiceDates.refresh()
+            logger.info("Refreshed service dates materialized view")
+
+            TripTime.refresh()
+            logger.info("Refreshed trip time materialized view")
+
+            DutyChain.refresh()
+            logger.info("Refreshed duty chain materialized view")
 
-        TripTime.refresh()
-        logger.info("Refreshed trip time materialized view")
+            departures = FrequencyDeparture.refresh(self)
+            logger.info("Expanded frequencies into %d departures", departures)
 
-        fix_unmonotone_stops()
+            # Fix the stop times before they are moved out of stop_time
+            fix_unmonotone_stops()
+
+            if MULTIGTFS_PACK_STOP_TIMES:
+                start_time = time.time()
+                packed = PackedStopTimes.pack(self)
+                end_time = time.time()
+                logger.info(
+                    "Packed the stop times of %d trips in %0.1f seconds",
+                    packed,
+                    end_time - start_time,
+                )
+
+            revisions.update(
+                [klass.__name__ for klass in gtfs_order] + ["Block", "Shape", "Zone"]
+            )
 
         total_end = time.time()
         logger.info("Import completed in %0.1f seconds.", total_end - total_start)
 
-    def export_gtfs(self, gtfs_file):
+    def export_gtfs(
+        self,
+        gtfs_file,
+        processes=None,
+        cache_dir=None,
+        deterministic=False,
+        feed_filter=None,
+    ):
         """Export a GTFS file as feed
 
         Keyword arguments:
         gtfs_file - A path or file-like object for the GTFS feed
+        processes - If more than 1, the number of worker processes used to
+            export the GTFS files concurrently.  Workers are spawned fresh
+            and set up Django from DJANGO_SETTINGS_MODULE, with the database
+            settings of this connection.  They read from a snapshot exported
+            by this connection, so they see the same committed data.
+        cache_dir - A directory for caching exported files by the content
+            revision of the feed.  Defaults to MULTIGTFS_EXPORT_CACHE_DIR.
+            Only the files whose records changed are exported again.
+        deterministic - If True, the zip file only depends on the records
+            in the feed: rows and extra columns are fully sorted, and the
+            zip entries have fixed timestamps.
+        feed_filter - A FeedFilter that selects a subset of the feed, such as
+            a date range or some routes.  Filtered exports are not cached.
 
         This function will close the file in order to finalize it.
+
+        Returns None, or if deterministic is True, a dictionary with the
+        SHA-256 hex digest of the zip file as "archive", and a dictionary of
+        GTFS filename to the SHA-256 hex digest of the file as "files".
+        """
+        total_start = time.time()
+        gtfs_order = export_order
+
+        if cache_dir is None:
+            cache_dir = MULTIGTFS_EXPORT_CACHE_DIR
+        if feed_filter:
+            logger.info("Exporting the subset of the feed with %s", feed_filter)
+
+        digests = None
+        if cache_dir and not feed_filter:
+            digests = self._export_cached(
+                gtfs_file, gtfs_order, processes, cache_dir, deterministic
+            )
+        elif deterministic or (processes and processes > 1):
+            temp_dir = tempfile.mkdtemp()
+            try:
+                paths = dict(
+                    (klass, os.path.join(temp_dir, klass._filename))
+                    for klass in gtfs_order
+                )
+                records = self._export_files(
+                    paths, processes, deterministic, feed_filter
+                )
+                digests = self._write_archive(
+                    gtfs_file, gtfs_order, paths, records, deterministic
+                )
+            finally:
+                shutil.rmtree(temp_dir)
+        else:
+            z = open_writable_zipfile(gtfs_file)
+            opener = writer_from_zipfile(z)
+            for klass in gtfs_order:
+                start_time = time.time()
+                record_count = klass.write_txt(
+                    self, opener, feed_filter=feed_filter
+                )
+                if record_count is not None:
+                    end_time = time.time()
+                    logger.info(
+                        "Exported %s (%d %s) in %0.1f seconds",
+                        klass._filename,
+                        record_count,
+                        klass._meta.verbose_name_plural,
+                        end_time - start_time,
+                    )
+            z.close()
+        total_end = time.time()
+        logger.info("Export completed in %0.1f seconds.", total_end - total_start)
+        if digests:
+            for filename, digest in sorted(digests["files"].items()):
+                logger.info("SHA-256 of %s: %s", filename, digest)
+            logger.info("SHA-256 of archive: %s", digests["archive"])
+        return digests
+
+    def export_columnar(self, directory, fmt="parquet", feed_filter=None):
+        """Export the feed as a directory of Parquet or Arrow IPC files
+
+        Each GTFS file is written as a typed table, such as
+        stop_times.parquet, with times as integer seconds (see
+        multigtfs.columnar).  Requires pyarrow.
+
+        Keyword arguments:
+        directory - The directory for the files, created if missing
+        fmt - "parquet" or "arrow"
+        feed_filter - A FeedFilter that selects a subset of the feed
+
+        Returns a dictionary of filename to the number of records.
         """
         total_start = time.time()
-        z = open_writable_zipfile(gtfs_file)
-
-        gtfs_order = (
-            Agency,
-            Service,
-            ServiceDate,
-            Fare,
-            FareRule,
-            FeedInfo,
-            Frequency,
-            Route,
-            ShapePoint,
-            StopTime,
-            Stop,
-            Transfer,
-            Trip,
-        )
-
-        for klass in gtfs_order:
+        if fmt not in columnar.FORMATS:
+            raise ValueError("Unknown columnar format %r" % fmt)
+        os.makedirs(directory, exist_ok=True)
+        records = {}
+        for klass in export_order:
             start_time = time.time()
-            content = klass.export_txt(self)
-            if content:
-                z.writestr(klass._filename, content)
+            filename = columnar.table_filename(klass, fmt)
+            record_count = columnar.export_table(
+                klass,
+                self,
+                os.path.join(directory, filename),
+                fmt,
+                feed_filter=feed_filter,
+            )
+            if record_count is not None:
+                records[filename] = record_count
                 end_time = time.time()
-                record_count = content.count(type(content)("\n")) - 1
                 logger.info(
                     "Exported %s (%d %s) in %0.1f seconds",
-                    klass._filename,
+                    filename,
                     record_count,
                     klass._meta.verbose_name_plural,
                     end_time - start_time,
                 )
-        z.close()
         total_end = time.time()
         logger.info("Export completed in %0.1f seconds.", total_end - total_start)
+        return records
+
+    def _export_cached(
+        self, gtfs_file, gtfs_order, processes, cache_dir, deterministic=False
+    ):
+        """Export the feed through the on-disk export cache"""
+        cache = ExportCache(cache_dir, self, gtfs_order, deterministic)
+        if cache.has_archive():
+            logger.info("Using cached export %s", cache.archive_path)
+        else:
+            missing = dict(
+                (klass, cache.member_path(klass) + ".tmp")
+                for klass in gtfs_order
+                if not cache.has_member(klass)
+            )
+            records = self._export_files(missing, processes, deterministic)
+            for klass, temp_path in missing.items():
+                cache.store_member(klass, temp_path, records[klass])
+
+            paths = dict((klass, cache.member_path(klass)) for klass in gtfs_order)
+            records = dict(
+                (klass, cache.member_records(klass)) for klass in gtfs_order
+            )
+            temp_path = cache.archive_path + ".tmp"
+            self._write_archive(temp_path, gtfs_order, paths, records, deterministic)
+            cache.store_archive(temp_path)
+        cache.copy_archive(gtfs_file)
+
+        if deterministic:
+            files = {}
+            for klass in gtfs_order:
+                if cache.member_records(klass) is not None:
+                    files[klass._filename] = _file_digest(cache.member_path(klass))
+            return {"archive": _file_digest(cache.archive_path), "files": files}
+
+    def _export_files(
+        self, paths, processes=None, deterministic=False, feed_filter=None
+    ):
+        """Export GTFS files to paths, a dictionary of model to file path
+
+        Returns a dictionary of model to record count, or None if the model
+        has no records and no file was written.
+        """
+        if processes and processes > 1:
+            results = self._export_parallel(
+                paths, processes, deterministic, feed_filter
+            )
+        else:
+            results = {}
+            for klass, path in paths.items():
+                results[klass] = _export_member(
+                    self.id,
+                    klass._meta.label,
+                    path,
+                    deterministic=deterministic,
+                    feed_filter=feed_filter,
+                )
+
+        records = {}
+        for klass, (record_count, elapsed) in results.items():
+            records[klass] = record_count
+            if record_count is not None:
+                logger.info(
+                    "Exported %s (%d %s) in %0.1f seconds",
+                    klass._filename,
+                    record_count,
+                    klass._meta.verbose_name_plural,
+                    elapsed,
+                )
+        return records
+
+    def _export_parallel(
+        self, paths, processes, deterministic=False, feed_filter=None
+    ):
+        """Export GTFS files in worker processes
+
+        Returns a dictionary of model to (record count, elapsed seconds).
+        """
+        # Keep the transaction open until the workers are done, so that
+        # the exported snapshot stays valid
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot = cursor.fetchone()[0]
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(
+                processes,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(connection.alias, dict(connection.settings_dict)),
+            ) as executor:
+                futures = dict(
+                    (
+                        klass,
+                        executor.submit(
+                            _export_member,
+                            self.id,
+                            klass._meta.label,
+                            path,
+                            snapshot,
+                            deterministic,
+                            feed_filter,
+                        ),
+                    )
+                    for klass, path in paths.items()
+                )
+                return dict(
+                    (klass, future.result()) for klass, future in futures.items()
+                )
+
+    @staticmethod
+    def _write_archive(gtfs_file, gtfs_order, paths, records, deterministic=False):
+        """Assemble exported GTFS files into a zip file
+
+        If deterministic, the entries get fixed metadata, and the SHA-256
+        digests are returned as described in export_gtfs.
+        """
+        if not deterministic:
+            z = open_writable_zipfile(gtfs_file)
+            for klass in gtfs_order:
+                if records[klass] is not None:
+                    z.write(paths[klass], klass._filename)
+            z.close()
+            return None
+
+        if isinstance(gtfs_file, (str, os.PathLike)):
+            out = open(gtfs_file, "wb")
+        else:
+            out = gtfs_file
+        try:
+            digest_file = _DigestFile(out)
+            z = open_writable_zipfile(digest_file)
+            files = {}
+            for klass in gtfs_order:
+                if records[klass] is None:
+                    continue
+                member_digest = hashlib.sha256()
+                zinfo = ZipInfo(klass._filename, date_time=(1980, 1, 1, 0, 0, 0))
+                zinfo.compress_type = z.compression
+                zinfo.create_system = 3
+                zinfo.external_attr = 0o644 << 16
+                with open(paths[klass], "rb") as src, z.open(
+                    zinfo, "w", force_zip64=True
+                ) as dst:
+                    for chunk in iter(lambda: src.read(1 << 20), b""):
+                        member_digest.update(chunk)
+                        dst.write(chunk)
+                files[klass._filename] = member_digest.hexdigest()
+            z.close()
+        finally:
+            if out is not gtfs_file:
+                out.close()
+        return {"archive": digest_file.sha256.hexdigest(), "files": files}
+
+    @property
+    def revision(self):
+        """The content revision of the feed, bumped on every change"""
+        return FeedRevision.total(self.id)
+
+    def revisions(self):
+        """Return the content revisions of the feed, by model name"""
+        return dict(self.feedrevision_set.values_list("name", "revision"))
+
+
+class _DigestFile(object):
+    """A write-only file wrapper that computes the SHA-256 of the data
+
+    It can't tell or seek, so ZipFile writes to it as a stream, and the
+    zip file is the same whatever the type of the wrapped file.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+def _file_digest(path):
+    """Return the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as src:
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _init_worker(alias, settings_dict):
+    """Set up Django in a worker process
+
+    The connection uses the settings of the parent process, which can
+    differ from DJANGO_SETTINGS_MODULE, such as the test database.
+    """
+    django.setup()
+    connections[alias].settings_dict.update(settings_dict)
+
+
+def _export_member(
+    feed_id, model_label, path, snapshot=None, deterministic=False, feed_filter=None
+):
+    """Export one GTFS file to a path, possibly in a worker process
+
+    If snapshot is set, the records are read from that exported snapshot.
+    deterministic and feed_filter are passed on to write_txt.
+
+    Returns the record count (or None if there are no records) and the
+    elapsed seconds.
+    """
+    start_time = time.time()
+    klass = apps.get_model(model_label)
+
+    def opener(filename):
+        return open(path, "w", encoding="utf-8", newline="")
+
+    with transaction.atomic():
+        if snapshot:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cursor.execute("SET TRANSACTION SNAPSHOT %s", [snapshot])
+        feed = Feed.objects.get(id=feed_id)
+        record_count = klass.write_txt(feed, opener, deterministic, feed_filter)
+    return record_count, time.time() - start_time
@@ -0,0 +1,94 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+import threading
+
+from django.db import connection, models
+from django.db.models import Sum
+
+from multigtfs.query_cache import query_cache
+
+_bulk = threading.local()
+
+
+class FeedRevision(models.Model):
+    """The content revision of one model's records in a feed.
+
+    This data is not part of the GTFS.  The revision is bumped when the
+    feed is imported, and when records are saved or deleted through the
+    model, and is used to key cached exports and query results.  Bulk
+    updates and deletes through a QuerySet do not bump the revision.
+    """
+
+    feed = models.ForeignKey("Feed", on_delete=models.CASCADE)
+    name = models.CharField(max_length=63, help_text="Name of the model")
+    revision = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return "%d-%s-%d" % (self.feed_id, self.name, self.revision)
+
+    @classmethod
+    def bump(cls, feed_id, names):
+        """Increment the revisions of the named models in a feed"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO feed_revision (feed_id, name, revision) SELECT %s, name, 1 FROM unnest(%s::varchar[]) AS name ON CONFLICT (feed_id, name) DO UPDATE SET revision = feed_revision.revision + 1",
+                [feed_id, sorted(set(names))],
+            )
+        query_cache.invalidate(feed_id)
+
+    @classmethod
+    @contextmanager
+    def bulk(cls, feed_id):
+        """Bump the revisions of a feed once, after a bulk operation
+
+        Records saved or deleted inside the block don't bump the revisions
+        one by one.  The names of their models are collected in the yielded
+        set, which can be added to, and are bumped when the block exits.
+        Only records of the feed should be changed inside the block.
+        """
+        names = set()
+        stack = _bulk.__dict__.setdefault("stack", [])
+        stack.append(names)
+        try:
+            yield names
+        finally:
+            stack.pop()
+        if names:
+            cls.bump(feed_id, names)
+
+    @classmethod
+    def collect(cls, name):
+        """Collect the name for the current bulk operation, if there is one
+
+        Returns True if the name was collected, and need not be bumped.
+        """
+        stack = getattr(_bulk, "stack", None)
+        if not stack:
+            return False
+        stack[-1].add(name)
+        return True
+
+    @classmethod
+    def total(cls, feed_id):
+        """Return the content revision of a feed, the sum of its models'"""
+        revisions = cls.objects.filter(feed_id=feed_id)
+        return revisions.aggregate(total=Sum("revision"))["total"] or 0
+
+    class Meta:
+        db_table = "feed_revision"
+        app_label = "multigtfs"
+        unique_together = (("feed", "name"),)
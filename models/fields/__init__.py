@@ -15,7 +15,8 @@
 from __future__ import unicode_literals
 
 from .seconds import Seconds, SecondsField
+from .seconds_array import SecondsArray
 
 # pyflakes be quiet
-__classes__ = Seconds
+__classes__ = (Seconds, SecondsArray)
 __fields__ = SecondsField
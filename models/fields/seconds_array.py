@@ -0,0 +1,161 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"Define an array of GTFS times of day, for bulk arithmetic"
+
+from __future__ import unicode_literals
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .seconds import Seconds
+
+try:
+    import numpy as np
+except ImportError:  # pragma: nocover
+    np = None
+
+DAY = 24 * 60 * 60
+MISSING = -1
+
+
+class SecondsArray(object):
+    """An array of GTFS seconds values, stored as int32 in a NumPy array
+
+    This is the vectorized companion of Seconds.  Missing values (such as
+    blank stop times) are stored as -1, stay missing through arithmetic,
+    compare as False, and are formatted as empty strings.
+
+    This requires numpy, which is an optional dependency.
+    """
+
+    def __init__(self, values=()):
+        if np is None:  # pragma: nocover
+            raise ImproperlyConfigured("numpy is required for SecondsArray")
+        if isinstance(values, SecondsArray):
+            values = values.values
+        elif not isinstance(values, np.ndarray):
+            values = [
+                MISSING if v is None else getattr(v, "seconds", v) for v in values
+            ]
+        self.values = np.asarray(values, dtype=np.int32)
+
+    @property
+    def missing(self):
+        """A boolean array, True where the value is missing"""
+        return self.values < 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        for value in self.values.tolist():
+            yield None if value < 0 else Seconds(value)
+
+    def __getitem__(self, index):
+        values = self.values[index]
+        if isinstance(values, np.ndarray):
+            return SecondsArray(values)
+        return None if values < 0 else Seconds(int(values))
+
+    def __repr__(self):
+        return "SecondsArray(%s)" % self.format()
+
+    def format(self):
+        """Return the values as a list of HH:MM:SS strings"""
+        minutes, seconds = np.divmod(self.values, 60)
+        hours, minutes = np.divmod(minutes, 60)
+        return [
+            "" if h < 0 else "%02d:%02d:%02d" % (h, m, s)
+            for h, m, s in zip(hours.tolist(), minutes.tolist(), seconds.tolist())
+        ]
+
+    @staticmethod
+    def _seconds(other):
+        """Convert an operand to seconds, as a scalar or an array"""
+        if isinstance(other, SecondsArray):
+            return other.values
+        if isinstance(other, timedelta):
+            return int(other.total_seconds())
+        if isinstance(other, np.ndarray) and other.dtype.kind == "m":
+            return other.astype("timedelta64[s]").astype(np.int64)
+        return getattr(other, "seconds", other)
+
+    def _shift(self, other, sign):
+        """Add or subtract seconds, wrapping negative times into the previous day
+
+        The result is missing where either operand is missing.
+        """
+        seconds = np.asarray(self._seconds(other), dtype=np.int64)
+        values = self.values.astype(np.int64) + sign * seconds
+        values = np.where(values < 0, values % DAY, values)
+        missing = self.missing
+        if isinstance(other, SecondsArray):
+            missing = missing | other.missing
+        return SecondsArray(np.where(missing, MISSING, values))
+
+    def __add__(self, other):
+        return self._shift(other, 1)
+
+    def __sub__(self, other):
+        return self._shift(other, -1)
+
+    def delay(self, datetimes):
+        """Return the delays of datetimes against the times, as timedelta64
+
+        Like Seconds.delay, each datetime is compared with the time on the
+        same day, the day before and the day after, and the delay with the
+        smallest absolute value is returned.  Missing times give NaT.
+
+        Keyword arguments:
+        datetimes - A naive datetime in the time zone of the feed, or an
+            array or list of them
+        """
+        moments = np.asarray(datetimes, dtype="datetime64[us]")
+        midnights = moments.astype("datetime64[D]").astype("datetime64[us]")
+        time_of_day = (moments - midnights).astype(np.int64)
+        delays = time_of_day - self.values.astype(np.int64) * 1000000
+        day = DAY * 1000000
+        candidates = np.stack((delays, delays + day, delays - day))
+        best = np.abs(candidates).argmin(axis=0)
+        delays = np.take_along_axis(candidates, best[np.newaxis], axis=0)[0]
+        delays = delays.astype("timedelta64[us]")
+        return np.where(self.missing, np.timedelta64("NaT", "us"), delays)
+
+    def _compare(self, other, method):
+        result = method(self.values, self._seconds(other)) & ~self.missing
+        if isinstance(other, SecondsArray):
+            result &= ~other.missing
+        return result
+
+    def __lt__(self, other):
+        return self._compare(other, np.less)
+
+    def __le__(self, other):
+        return self._compare(other, np.less_equal)
+
+    def __eq__(self, other):
+        return self._compare(other, np.equal)
+
+    def __ge__(self, other):
+        return self._compare(other, np.greater_equal)
+
+    def __gt__(self, other):
+        return self._compare(other, np.greater)
+
+    def __ne__(self, other):
+        return self._compare(other, np.not_equal)
+
+    __hash__ = None
@@ -0,0 +1,108 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from django.db import connection, models
+
+from multigtfs.models.stop import Stop
+
+# Defaults for generated footpaths
+MAX_DISTANCE = 300.0
+WALKING_SPEED = 1.3
+DETOUR_FACTOR = 1.25
+
+
+class Footpath(models.Model):
+    """A walking transfer between two nearby stops
+
+    This data is not part of the GTFS.  Unlike Transfer, footpaths are not
+    published by the agency, but generated from the stop locations.  There
+    is a footpath in each direction.
+    """
+
+    feed = models.ForeignKey("Feed", on_delete=models.CASCADE)
+    from_stop = models.ForeignKey(
+        Stop, on_delete=models.CASCADE, related_name="footpath_from_stop"
+    )
+    to_stop = models.ForeignKey(
+        Stop, on_delete=models.CASCADE, related_name="footpath_to_stop"
+    )
+    distance = models.FloatField(help_text="Straight-line distance in meters")
+    walking_time = models.IntegerField(help_text="Estimated walking time in seconds")
+
+    def __str__(self):
+        return "%s-%s" % (self.from_stop, self.to_stop)
+
+    @classmethod
+    def generate(
+        cls,
+        feed,
+        max_distance=MAX_DISTANCE,
+        speed=WALKING_SPEED,
+        detour=DETOUR_FACTOR,
+    ):
+        """Generate the footpaths between the stops of a feed
+
+        Replaces the footpaths of the feed with one for each pair of stops
+        or platforms (location_type 0 or blank, not stations, entrances or
+        nodes) within max_distance meters.  Pairs are found with the
+        spatial index on stop.point, through a bounding box around each
+        stop, and then measured on the spheroid, so this scales with the
+        number of nearby pairs rather than the square of the stops.
+
+        Keyword arguments:
+        feed - The feed
+        max_distance - The longest footpath, in meters
+        speed - The walking speed, in meters per second
+        detour - The ratio of the walking distance to the straight line
+
+        Returns the number of footpaths.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM footpath WHERE feed_id = %s", [feed.id])
+            cursor.execute(
+                """
+                INSERT INTO footpath
+                    (feed_id, from_stop_id, to_stop_id, distance, walking_time)
+                SELECT a.feed_id, a.id, b.id, d.distance,
+                       ceil(d.distance * %(detour)s / %(speed)s)
+                FROM stop a
+                JOIN stop b
+                  ON b.feed_id = a.feed_id
+                 AND b.id <> a.id
+                 AND b.location_type IN ('', '0')
+                 AND b.point && ST_Expand(
+                     a.point,
+                     %(distance)s / (111000 * cos(radians(ST_Y(a.point)))),
+                     %(distance)s / 110000
+                 )
+                CROSS JOIN LATERAL (
+                    SELECT ST_Distance(a.point::geography, b.point::geography)
+                        AS distance
+                ) d
+                WHERE a.feed_id = %(feed_id)s
+                  AND a.location_type IN ('', '0')
+                  AND d.distance <= %(distance)s
+                """,
+                {
+                    "feed_id": feed.id,
+                    "distance": max_distance,
+                    "speed": speed,
+                    "detour": detour,
+                },
+            )
+            return cursor.rowcount
+
+    class Meta:
+        db_table = "footpath"
+        app_label = "multigtfs"
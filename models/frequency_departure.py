@@ -0,0 +1,102 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from django.db import connection, models
+
+from multigtfs.models.fields import SecondsField
+from multigtfs.models.frequency import Frequency
+from multigtfs.models.trip import Trip
+
+
+class FrequencyDeparture(models.Model):
+    """A concrete departure of a frequency-based trip
+
+    This data is not part of the GTFS.  Each departure in the frequency
+    window is stored as the offset from the times of the template trip,
+    so its stop times are the trip's stop times shifted by the offset.
+    """
+
+    frequency = models.ForeignKey(Frequency, on_delete=models.CASCADE)
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
+    departure = SecondsField(help_text="Time of the departure from the first stop")
+    offset = models.IntegerField(
+        help_text="Seconds added to the stop times of the template trip"
+    )
+    exact = models.BooleanField(
+        help_text="Is the departure exactly scheduled, or an estimate?"
+    )
+
+    def __str__(self):
+        return "%s %s" % (self.trip, self.departure)
+
+    def stop_times(self):
+        """Return the arrival and departure times of the departure
+
+        Returns a tuple of SecondsArray of the arrival and departure times
+        at the stops of the trip, in stop_sequence order.
+
+        Raises ValueError if a negative offset would move a stop time before
+        the start of the service day.
+        """
+        stop_times = self.trip.combinedstoptime_set.order_by("stop_sequence")
+        arrivals = stop_times.seconds_array("arrival_time")
+        departures = stop_times.seconds_array("departure_time")
+        if (arrivals < -self.offset).any() or (departures < -self.offset).any():
+            raise ValueError(
+                "Departure %s has stop times before the service day" % self
+            )
+        return arrivals + self.offset, departures + self.offset
+
+    @classmethod
+    def refresh(cls, feed):
+        """Expand the frequencies of a feed into departures
+
+        Departures start every headway_secs from start_time, while before
+        end_time.  The trip time of the template trip (see TripTime) must
+        be up to date.
+
+        Returns the number of departures.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM frequency_departure WHERE frequency_id IN (SELECT f.id FROM frequency f JOIN trip t ON t.id = f.trip_id JOIN route r ON r.id = t.route_id WHERE r.feed_id = %s)",
+                [feed.id],
+            )
+            cursor.execute(
+                """
+                INSERT INTO frequency_departure
+                    (frequency_id, trip_id, departure, "offset", exact)
+                SELECT f.id, f.trip_id, d.departure,
+                       d.departure - tt.start_time, f.exact_times = '1'
+                FROM frequency f
+                JOIN trip t ON t.id = f.trip_id
+                JOIN route r ON r.id = t.route_id
+                JOIN trip_time tt ON tt.trip_id = f.trip_id
+                CROSS JOIN LATERAL generate_series(
+                    f.start_time, f.end_time - 1, f.headway_secs
+                ) AS d(departure)
+                WHERE r.feed_id = %s AND f.headway_secs > 0
+                """,
+                [feed.id],
+            )
+            return cursor.rowcount
+
+    class Meta:
+        db_table = "frequency_departure"
+        app_label = "multigtfs"
+        indexes = [
+            models.Index(
+                fields=["trip", "departure"], name="frequency_departure_trip"
+            ),
+        ]
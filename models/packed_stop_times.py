@@ -0,0 +1,193 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from django.contrib.postgres.fields import ArrayField
+from django.db import connection, models
+
+from multigtfs.models.fields import SecondsField
+from multigtfs.models.pattern import Pattern
+from multigtfs.models.stop import Stop
+from multigtfs.models.trip import Trip
+
+
+class PackedStopTimes(models.Model):
+    """The stop times of a trip, packed into arrays
+
+    This is an optional compact storage for stop_time, with one row per
+    trip instead of one per stop.  The stops come from the pattern of the
+    trip, and the times are offsets from the first arrival, or from the
+    first departure if the trip has no arrival times.  Stop headsigns and
+    extra data are only kept for the stops that have them.
+
+    Packed stop times are read through UnpackedStopTime, and together with
+    the rows of stop_time through CombinedStopTime, which the derived views
+    (such as TripTime), departures and exports read.  Packed feeds are
+    unpacked before their stop times are updated (see refreshgeometries).
+    """
+
+    trip = models.OneToOneField(Trip, primary_key=True, on_delete=models.CASCADE)
+    pattern = models.ForeignKey(Pattern, on_delete=models.CASCADE)
+    start_time = SecondsField(null=True, help_text="First arrival time of the trip")
+    stop_sequences = ArrayField(models.IntegerField())
+    arrival_offsets = ArrayField(
+        models.IntegerField(null=True), help_text="Seconds since start_time"
+    )
+    departure_offsets = ArrayField(
+        models.IntegerField(null=True), help_text="Seconds since start_time"
+    )
+    distances = ArrayField(
+        models.FloatField(null=True),
+        null=True,
+        help_text="shape_dist_traveled of the stops, if any is set",
+    )
+    pickup_types = models.TextField(help_text="One character for each stop")
+    drop_off_types = models.TextField(help_text="One character for each stop")
+    interpolated = ArrayField(models.BooleanField())
+    details = models.JSONField(
+        null=True,
+        help_text="stop_headsign and extra_data, by position of the stop",
+    )
+
+    def __str__(self):
+        return str(self.trip)
+
+    @classmethod
+    def pack(cls, feed):
+        """Move the stop times of a feed into packed storage
+
+        The patterns of the feed (see Pattern) must be up to date.  Trips
+        without a pattern are left in stop_time.
+
+        Returns the number of packed trips.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO packed_stop_times
+                    (trip_id, pattern_id, start_time, stop_sequences,
+                     arrival_offsets, departure_offsets, distances,
+                     pickup_types, drop_off_types, interpolated, details)
+                SELECT trip_id, pattern_id, start_time,
+                       array_agg(stop_sequence ORDER BY position),
+                       array_agg(arrival_time - start_time ORDER BY position),
+                       array_agg(departure_time - start_time ORDER BY position),
+                       CASE WHEN count(shape_dist_traveled) > 0 THEN
+                           array_agg(shape_dist_traveled ORDER BY position)
+                       END,
+                       string_agg(rpad(pickup_type, 1), '' ORDER BY position),
+                       string_agg(rpad(drop_off_type, 1), '' ORDER BY position),
+                       array_agg(interpolated ORDER BY position),
+                       jsonb_object_agg(
+                           position::text,
+                           jsonb_build_object(
+                               'stop_headsign', stop_headsign,
+                               'extra_data', extra_data
+                           )
+                       ) FILTER (
+                           WHERE stop_headsign <> ''
+                              OR COALESCE(extra_data, '{}') <> '{}'
+                       )
+                FROM (
+                    SELECT st.*, t.pattern_id,
+                           COALESCE(
+                               min(st.arrival_time) OVER trip,
+                               min(st.departure_time) OVER trip
+                           ) AS start_time,
+                           row_number() OVER (trip ORDER BY st.stop_sequence)
+                               AS position
+                    FROM stop_time st
+                    JOIN trip t ON t.id = st.trip_id
+                    JOIN route r ON r.id = t.route_id
+                    WHERE r.feed_id = %s AND t.pattern_id IS NOT NULL
+                    WINDOW trip AS (PARTITION BY st.trip_id)
+                ) st
+                GROUP BY trip_id, pattern_id, start_time
+                """,
+                [feed.id],
+            )
+            count = cursor.rowcount
+            cursor.execute(
+                "DELETE FROM stop_time WHERE trip_id IN (SELECT p.trip_id FROM packed_stop_times p JOIN trip t ON t.id = p.trip_id JOIN route r ON r.id = t.route_id WHERE r.feed_id = %s)",
+                [feed.id],
+            )
+        return count
+
+    @classmethod
+    def unpack(cls, feed):
+        """Move the packed stop times of a feed back into stop_time
+
+        Returns the number of unpacked stop times.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO stop_time
+                    (trip_id, stop_id, arrival_time, departure_time,
+                     stop_sequence, stop_headsign, pickup_type, drop_off_type,
+                     shape_dist_traveled, interpolated, extra_data)
+                SELECT u.trip_id, u.stop_id, u.arrival_time, u.departure_time,
+                       u.stop_sequence, u.stop_headsign, u.pickup_type,
+                       u.drop_off_type, u.shape_dist_traveled, u.interpolated,
+                       u.extra_data
+                FROM unpacked_stop_time u
+                JOIN trip t ON t.id = u.trip_id
+                JOIN route r ON r.id = t.route_id
+                WHERE r.feed_id = %s
+                """,
+                [feed.id],
+            )
+            count = cursor.rowcount
+            cursor.execute(
+                "DELETE FROM packed_stop_times WHERE trip_id IN (SELECT t.id FROM trip t JOIN route r ON r.id = t.route_id WHERE r.feed_id = %s)",
+                [feed.id],
+            )
+        return count
+
+    @classmethod
+    def in_feed(cls, feed):
+        """Return the packed stop times of a feed"""
+        return cls.objects.filter(trip__route__feed=feed)
+
+    class Meta:
+        db_table = "packed_stop_times"
+        app_label = "multigtfs"
+        verbose_name_plural = "packed stop times"
+
+
+class UnpackedStopTime(models.Model):
+    """A stop time read from packed storage
+
+    This is a view over PackedStopTimes, with the fields of StopTime.  The
+    ID is made from the trip ID and the position of the stop in the trip.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    trip = models.ForeignKey(Trip, on_delete=models.DO_NOTHING)
+    stop = models.ForeignKey(Stop, on_delete=models.DO_NOTHING)
+    arrival_time = SecondsField(null=True)
+    departure_time = SecondsField(null=True)
+    stop_sequence = models.IntegerField()
+    stop_headsign = models.CharField(max_length=255)
+    pickup_type = models.CharField(max_length=1)
+    drop_off_type = models.CharField(max_length=1)
+    shape_dist_traveled = models.FloatField(null=True)
+    interpolated = models.BooleanField()
+    extra_data = models.JSONField()
+
+    def __str__(self):
+        return "%s-%s-%s" % (self.trip_id, self.stop_id, self.stop_sequence)
+
+    class Meta:
+        managed = False
+        db_table = "unpacked_stop_time"
@@ -0,0 +1,112 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from django.contrib.postgres.fields import ArrayField
+from django.db import connection, models
+
+from multigtfs.models.stop import Stop
+
+
+class Pattern(models.Model):
+    """A sequence of stops shared by trips
+
+    This data is not part of the GTFS.  Trips visiting the same stops in
+    the same order share a pattern, identified by the MD5 hash of the stop
+    sequence.
+    """
+
+    feed = models.ForeignKey("Feed", on_delete=models.CASCADE)
+    pattern_hash = models.CharField(
+        max_length=32, help_text="MD5 hash of the stop sequence"
+    )
+    stop_ids = ArrayField(
+        models.IntegerField(), help_text="IDs of the stops, in stop_sequence order"
+    )
+
+    def __str__(self):
+        return "%d-%s" % (self.feed_id, self.pattern_hash)
+
+    def stops(self):
+        """Return the stops of the pattern, in order"""
+        stops = Stop.objects.in_bulk(self.stop_ids)
+        return [stops[stop_id] for stop_id in self.stop_ids]
+
+    @classmethod
+    def refresh(cls, feed):
+        """Rebuild the patterns of a feed from its stop times
+
+        Replaces the patterns of the feed, and links each trip with stop
+        times to its pattern.
+
+        Raises ValueError if the feed has packed stop times (see
+        PackedStopTimes), which need their patterns.  Unpack them first.
+
+        Returns the number of patterns.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM packed_stop_times ps JOIN pattern p ON p.id = ps.pattern_id WHERE p.feed_id = %s)",
+                [feed.id],
+            )
+            if cursor.fetchone()[0]:
+                raise ValueError(
+                    "Feed %d has packed stop times, unpack them before"
+                    " refreshing the patterns" % feed.id
+                )
+            cursor.execute(
+                "UPDATE trip SET pattern_id = NULL WHERE route_id IN (SELECT id FROM route WHERE feed_id = %s)",
+                [feed.id],
+            )
+            cursor.execute("DELETE FROM pattern WHERE feed_id = %s", [feed.id])
+            cursor.execute(
+                """
+                WITH trip_stops AS (
+                    SELECT st.trip_id,
+                           array_agg(st.stop_id ORDER BY st.stop_sequence)
+                               AS stop_ids,
+                           md5(string_agg(
+                               st.stop_id::text, ',' ORDER BY st.stop_sequence
+                           )) AS pattern_hash
+                    FROM stop_time st
+                    JOIN trip t ON t.id = st.trip_id
+                    JOIN route r ON r.id = t.route_id
+                    WHERE r.feed_id = %(feed_id)s
+                    GROUP BY st.trip_id
+                ), inserted AS (
+                    INSERT INTO pattern (feed_id, pattern_hash, stop_ids)
+                    SELECT DISTINCT ON (pattern_hash)
+                           %(feed_id)s, pattern_hash, stop_ids
+                    FROM trip_stops
+                    ORDER BY pattern_hash
+                    RETURNING id, pattern_hash
+                )
+                UPDATE trip
+                SET pattern_id = p.id
+                FROM trip_stops s
+                JOIN inserted p ON p.pattern_hash = s.pattern_hash
+                WHERE trip.id = s.trip_id
+                """,
+                {"feed_id": feed.id},
+            )
+            cursor.execute("SELECT count(*) FROM pattern WHERE feed_id = %s", [feed.id])
+            return cursor.fetchone()[0]
+
+    class Meta:
+        db_table = "pattern"
+        app_label = "multigtfs"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["feed", "pattern_hash"], name="pattern_feed_hash"
+            ),
+        ]
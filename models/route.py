@@ -16,7 +16,7 @@ from __future__ import unicode_literals
 from typing import TYPE_CHECKING
 
 from django.contrib.gis.geos import MultiLineString
-from django.db.models import Manager
+from django.db.models import Manager, Q
 from multigtfs.models.base import models, Base
 
 if TYPE_CHECKING:
@@ -78,14 +78,16 @@ class Route(Base):
         return
         """Update the geometry from the Trips"""
         original = self.geometry
-        trips = self.trip_set.exclude(geometry__isnull=True)
+        trips = self.trip_set.filter(
+            Q(geometry__isnull=False) | Q(shape__geometry__isnull=False)
+        ).select_related("shape").with_geometry()
         unique_coords = set()
         unique_geom = list()
         for t in trips:
-            coords = t.geometry.coords
+            coords = t.path.coords
             if coords not in unique_coords:
                 unique_coords.add(coords)
-                unique_geom.append(t.geometry)
+                unique_geom.append(t.path)
         self.geometry = MultiLineString(unique_geom)
         if self.geometry != original:
             self.save()
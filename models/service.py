@@ -14,7 +14,22 @@
 # limitations under the License.
 from __future__ import unicode_literals
 
-from multigtfs.models.base import models, Base
+from multigtfs.models.base import models, Base, BaseManager
+
+
+class ServiceManager(BaseManager):
+    def ids_on_date_cached(self, feed, date):
+        """Return the IDs of the services active on a date, from the cache"""
+        return self.cached(
+            "ids_on_date",
+            (feed.id, date),
+            lambda: frozenset(
+                self.in_feed(feed)
+                .filter(servicedates__date=date)
+                .values_list("id", flat=True)
+            ),
+            feed.id,
+        )
 
 
 class Service(Base):
@@ -23,6 +38,8 @@ class Service(Base):
     Implements calendar.txt
     """
 
+    objects = ServiceManager()
+
     feed = models.ForeignKey('Feed', on_delete=models.CASCADE)
     service_id = models.CharField(
         max_length=255, db_index=True,
@@ -77,14 +94,7 @@ class Service(Base):
     _unique_fields = ('service_id',)
 
     @classmethod
-    def export_txt(cls, feed):
-        '''Export records as calendar.txt'''
-
-        # If no records with start/end dates, skip calendar.txt
-        objects = cls.objects.in_feed(feed)
-
-        if not objects.exclude(
-                start_date__isnull=True, end_date__isnull=True).exists():
-            return None
-
-        return super(Service, cls).export_txt(feed)
+    def _skip_export(cls, objects):
+        """Skip calendar.txt if no exported service has start/end dates"""
+        return not objects.exclude(
+            start_date__isnull=True, end_date__isnull=True).exists()
@@ -13,12 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import unicode_literals
+from csv import reader
+from logging import getLogger
 import warnings
 
 from django.contrib.gis.geos import LineString
+from django.contrib.postgres.fields import ArrayField
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from multigtfs.models.base import models, Base
+from multigtfs.app_settings import MULTIGTFS_COMPACT_SHAPES
+from multigtfs.models.base import (
+    models, Base, BaseManager, CSV_BOM, batch_size)
+
+logger = getLogger(__name__)
 
 
 class Shape(Base):
@@ -32,6 +39,12 @@ class Shape(Base):
     geometry = models.LineStringField(
         null=True, blank=True,
         help_text='Geometry cache of ShapePoints')
+    sequences = ArrayField(
+        models.IntegerField(), null=True, blank=True,
+        help_text='shape_pt_sequence of the vertices of a compact shape')
+    distances = ArrayField(
+        models.FloatField(null=True), null=True, blank=True,
+        help_text='shape_dist_traveled of the vertices of a compact shape')
 
     def __str__(self):
         return "%d-%s" % (self.feed.id, self.shape_id)
@@ -46,9 +59,135 @@ class Shape(Base):
             if self.geometry != original:
                 self.save()
                 if update_parent:
-                    for trip in self.trip_set.all():
+                    for trip in self.trip_set.with_geometry():
                         trip.update_geometry()
 
+    @classmethod
+    def import_compact_txt(cls, txt_file, feed, filter_func=None):
+        """Import shapes.txt as the geometry of the shapes
+
+        The points are not stored as ShapePoints, but only as the vertices
+        of Shape.geometry, with shape_pt_sequence in Shape.sequences and
+        shape_dist_traveled in Shape.distances.  These are arrays rather
+        than the M coordinate of a LineStringM, which GEOS and Django's
+        LineStringField don't support.  The vertices are read back through
+        ShapeVertex.  Shapes with a single point are stored as a ShapePoint,
+        as they have no geometry.  Extra columns are dropped, with a
+        warning.
+
+        The file is streamed: a shape is complete when the next shape_id
+        starts, as shapes.txt is usually grouped by shape, and the complete
+        shapes are stored in batches.  If the points of a stored shape
+        appear again, they are merged with the stored points.
+
+        Returns the number of imported points.
+        """
+        csv_reader = reader(txt_file, skipinitialspace=True)
+        columns = next(csv_reader, None)
+        if columns is None:
+            return 0
+        if columns and columns[0].startswith(CSV_BOM):
+            columns[0] = columns[0][len(CSV_BOM):]
+        extra_columns = set(columns) - set(c for c, _ in ShapePoint._column_map)
+        if extra_columns:
+            logger.warning(
+                "Extra columns of compact shapes are not imported: %s",
+                ", ".join(sorted(extra_columns)))
+
+        existing = dict(
+            (shape.shape_id, shape)
+            for shape in cls.objects.filter(feed=feed).only('shape_id'))
+        stored = set()
+        # Points of the shapes that are not stored yet, by shape_id and
+        # sequence, as (line number, lon, lat, traveled)
+        pending = {}
+        pending_count = 0
+        count = 0
+
+        def store():
+            """Store the pending shapes as shape geometries"""
+            new_shapes, updated_shapes, single_points = [], [], []
+            for shape_id, shape_points in pending.items():
+                shape = existing.get(shape_id)
+                if shape is None:
+                    shape = existing[shape_id] = cls(
+                        feed=feed, shape_id=shape_id)
+                    new_shapes.append(shape)
+                else:
+                    updated_shapes.append(shape)
+                stored.add(shape_id)
+                sequences = sorted(shape_points)
+                if len(sequences) == 1:
+                    _, lon, lat, traveled = shape_points[sequences[0]]
+                    shape.geometry = shape.sequences = shape.distances = None
+                    single_points.append((shape, ShapePoint(
+                        point='POINT(%s %s)' % (lon, lat),
+                        sequence=sequences[0], traveled=traveled)))
+                    continue
+                vertices = [shape_points[sequence] for sequence in sequences]
+                shape.geometry = LineString(
+                    [(lon, lat) for _, lon, lat, _ in vertices], srid=4326)
+                shape.sequences = sequences
+                distances = [traveled for _, _, _, traveled in vertices]
+                if any(d is not None for d in distances):
+                    shape.distances = distances
+                else:
+                    shape.distances = None
+            cls.objects.bulk_create(new_shapes)
+            cls.objects.bulk_update(
+                updated_shapes, ['geometry', 'sequences', 'distances'])
+            for shape, point in single_points:
+                point.shape = shape
+            ShapePoint.objects.bulk_create(
+                [point for _, point in single_points])
+            # Only keep the shape IDs in memory
+            for shape in new_shapes + updated_shapes:
+                shape.geometry = shape.sequences = shape.distances = None
+            pending.clear()
+
+        current = None
+        for row in csv_reader:
+            if not row:
+                continue
+            if filter_func and not filter_func(zip(columns, row)):
+                continue
+            values = dict(zip(columns, row))
+            shape_id = values['shape_id']
+            if shape_id != current:
+                current = shape_id
+                if pending_count >= batch_size and shape_id not in pending:
+                    store()
+                    pending_count = 0
+                if shape_id in stored:
+                    # Merge with the stored points of the shape
+                    stored.remove(shape_id)
+                    shape = existing[shape_id]
+                    pending[shape_id] = dict(
+                        (v.sequence, (None, v.point.x, v.point.y, v.traveled))
+                        for v in shape.vertices.all())
+                    pending_count += len(pending[shape_id])
+                    shape.points.all().delete()
+            shape_points = pending.setdefault(shape_id, {})
+            sequence = int(values['shape_pt_sequence'])
+            if sequence in shape_points:
+                duplicate = shape_points[sequence][0]
+                logger.warning(
+                    "%s line %d is a duplicate of %s, not imported.",
+                    ShapePoint._filename, csv_reader.line_num,
+                    "an earlier line" if duplicate is None
+                    else "line %d" % duplicate)
+                continue
+            traveled = values.get('shape_dist_traveled')
+            shape_points[sequence] = (
+                csv_reader.line_num,
+                float(values['shape_pt_lon'].lstrip('+')),
+                float(values['shape_pt_lat'].lstrip('+')),
+                float(traveled) if traveled else None)
+            pending_count += 1
+            count += 1
+        store()
+        return count
+
     class Meta:
         db_table = 'shape'
         app_label = 'multigtfs'
@@ -109,6 +248,22 @@ class ShapePoint(Base):
 
         super(ShapePoint, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def import_txt(cls, txt_file, feed, filter_func=None):
+        """Import from the GTFS text file
+
+        If MULTIGTFS_COMPACT_SHAPES is set, the points are only stored in
+        the shape geometries (see Shape.import_compact_txt).
+        """
+        if MULTIGTFS_COMPACT_SHAPES:
+            return Shape.import_compact_txt(txt_file, feed, filter_func)
+        return super(ShapePoint, cls).import_txt(txt_file, feed, filter_func)
+
+    @classmethod
+    def _export_objects(cls, feed):
+        """Export the points of compact shapes too, from ShapeVertex"""
+        return ShapeVertex.objects.in_feed(feed)
+
     class Meta:
         db_table = 'shape_point'
         app_label = 'multigtfs'
@@ -121,11 +276,41 @@ class ShapePoint(Base):
         ('shape_dist_traveled', 'traveled')
     )
     _filename = 'shapes.txt'
+    _export_with_copy = True
     _rel_to_feed = 'shape__feed'
     _sort_order = ('shape__shape_id', 'sequence')
     _unique_fields = ('shape_id', 'shape_pt_sequence')
 
 
+class ShapeVertex(models.Model):
+    """A point along the shape, from either storage of shapes
+
+    This is a view over the ShapePoints, and the vertices of the geometry
+    of the compact shapes, which have no ShapePoints.  The vertices of
+    compact shapes have negative IDs, and the sequences from
+    Shape.sequences, or are numbered from 1 if it's not set.
+    """
+    shape = models.ForeignKey(
+        'Shape', on_delete=models.DO_NOTHING, related_name='vertices')
+    point = models.PointField()
+    sequence = models.IntegerField()
+    traveled = models.FloatField(null=True, blank=True)
+    extra_data = models.JSONField(null=True)
+
+    objects = BaseManager()
+
+    _column_map = ShapePoint._column_map
+    _rel_to_feed = 'shape__feed'
+
+    def __str__(self):
+        return "%s-%d" % (self.shape, self.sequence)
+
+    class Meta:
+        managed = False
+        db_table = 'shape_vertex'
+        app_label = 'multigtfs'
+
+
 @receiver(post_save, sender=ShapePoint, dispatch_uid="post_save_shapepoint")
 def post_save_shapepoint(sender, instance, **kwargs):
     '''Update related objects when the ShapePoint is updated'''
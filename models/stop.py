@@ -13,24 +13,41 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import unicode_literals
+from datetime import timedelta
 from logging import getLogger
 import warnings
 
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from io import StringIO
-from multigtfs.models.base import models, Base
+from multigtfs.models.base import models, Base, BaseManager
 
 
 logger = getLogger(__name__)
 
 
+class StopManager(BaseManager):
+    def spatial_index(self, feed):
+        """Return the in-memory spatial index of the stops in a feed
+
+        The index is built on first use, and kept in the query cache until
+        the feed changes.  See multigtfs.stop_index.
+        """
+        from multigtfs.stop_index import StopIndex
+
+        return self.cached(
+            "spatial_index", (feed.id,), lambda: StopIndex(feed), feed.id
+        )
+
+
 class Stop(Base):
     """A stop or station
 
     Maps to stops.txt in the GTFS feed.
     """
 
+    objects = StopManager()
+
     feed = models.ForeignKey("Feed", on_delete=models.CASCADE)
     stop_id = models.CharField(
         max_length=255,
@@ -110,6 +127,51 @@ class Stop(Base):
 
     lat = property(getlat, setlat, doc="WGS 84 latitude of stop or station")
 
+    def departures(self, date, from_seconds=0, limit=10):
+        """Return the next departures from the stop on a service date
+
+        Departures from the child stops of a station are included, as are
+        trips of the previous service day that depart after midnight, with
+        times of 24:00:00 or later.  Both are read with the index on
+        (stop_id, departure_time).
+
+        Keyword arguments:
+        date - The service date
+        from_seconds - The earliest departure, in seconds (or Seconds)
+            since the start of the date
+        limit - The maximum number of departures
+
+        Returns a list of CombinedStopTime, so packed trips are included,
+        with related trips and routes, ordered by departure.  Each has a
+        service_date attribute, which is the date or the day before.
+        """
+        from multigtfs.models.stop_time import CombinedStopTime
+
+        from_seconds = int(getattr(from_seconds, "seconds", from_seconds))
+        stops = Stop.objects.filter(
+            models.Q(id=self.id) | models.Q(parent_station=self.id)
+        ).values("id")
+        departures = []
+        for service_date, offset in (
+            (date, 0),
+            (date - timedelta(days=1), 24 * 60 * 60),
+        ):
+            stop_times = (
+                CombinedStopTime.objects.filter(
+                    stop__in=stops,
+                    departure_time__gte=from_seconds + offset,
+                    trip__service__servicedates__date=service_date,
+                )
+                .select_related("trip", "trip__route")
+                .order_by("departure_time")[:limit]
+            )
+            for stop_time in stop_times:
+                stop_time.service_date = service_date
+                departure = stop_time.departure_time.seconds - offset
+                departures.append((departure, stop_time))
+        departures.sort(key=lambda departure: departure[0])
+        return [stop_time for _, stop_time in departures[:limit]]
+
     def __init__(self, *args, **kwargs):
         lat = kwargs.pop("lat", None)
         lon = kwargs.pop("lon", None)
@@ -174,6 +236,41 @@ class Stop(Base):
         logger.info("Imported %d non-station stops", stops)
         return stations + stops
 
+    @classmethod
+    def import_table(cls, path, feed, filter_func=None):
+        """Import from a stops.parquet or stops.arrow file
+
+        Stations need to be imported before stops
+        """
+        from pyarrow import array
+        from pyarrow.compute import and_, equal, invert
+
+        def is_station(batch):
+            """Which rows represent a station?"""
+            if "location_type" not in batch.schema.names:
+                return array([False] * batch.num_rows)
+            location_type = batch.column("location_type").cast("string")
+            return equal(location_type, "1").fill_null(False)
+
+        def selected(mask_func):
+            """Combine a mask with filter_func, if set"""
+            if filter_func is None:
+                return mask_func
+            return lambda batch: and_(mask_func(batch), filter_func(batch))
+
+        logger.info("Importing station stops")
+        stations = super(Stop, cls).import_table(path, feed, selected(is_station))
+        logger.info("Imported %d station stops", stations)
+
+        def is_stop(batch):
+            """Which rows represent a stop?"""
+            return invert(is_station(batch))
+
+        logger.info("Importing non-station stops")
+        stops = super(Stop, cls).import_table(path, feed, selected(is_stop))
+        logger.info("Imported %d non-station stops", stops)
+        return stations + stops
+
 
 @receiver(post_save, sender=Stop, dispatch_uid="post_save_stop")
 def post_save_stop(sender, instance, **kwargs):
@@ -185,5 +282,5 @@ def post_save_stop(sender, instance, **kwargs):
         .values_list("trip_id", flat=True)
         .distinct()
     )
-    for trip in Trip.objects.filter(id__in=trip_ids):
+    for trip in Trip.objects.filter(id__in=trip_ids).with_geometry():
         trip.update_geometry()
@@ -15,13 +15,37 @@
 from __future__ import unicode_literals
 
 from django.contrib.gis.db.models.functions import LineLocatePoint
+from django.db import connection
+from django.db.models import Case, F, Value, When
 
-from multigtfs.models.base import models, Base
+from multigtfs.models.base import models, Base, BaseManager
+from multigtfs.models.packed_stop_times import UnpackedStopTime
 from multigtfs.models.stop import Stop
 from multigtfs.models.trip import Trip
 from multigtfs.models.fields import SecondsField
 
 
+class StopTimeManager(BaseManager):
+    def for_trip_cached(self, trip):
+        """Return the stop times of a trip, in order, from the query cache
+
+        The stop times of packed trips (see PackedStopTimes) are returned as
+        UnpackedStopTime instances.
+        """
+
+        def compute():
+            stop_times = tuple(self.filter(trip=trip).order_by("stop_sequence"))
+            if not stop_times:
+                stop_times = tuple(
+                    UnpackedStopTime.objects.filter(trip=trip).order_by(
+                        "stop_sequence"
+                    )
+                )
+            return stop_times
+
+        return self.cached("for_trip", (trip.pk,), compute, trip._get_feed_id)
+
+
 class StopTime(Base):
     """A specific stop on a route on a trip.
 
@@ -31,6 +55,8 @@ class StopTime(Base):
     trip_id: int
     stop_id: int
 
+    objects = StopTimeManager()
+
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
     stop = models.ForeignKey(Stop, on_delete=models.CASCADE)
     arrival_time = SecondsField(
@@ -80,14 +106,98 @@ class StopTime(Base):
         blank=True,
         help_text="Distance of stop from start of shape",
     )
+    interpolated = models.BooleanField(
+        default=False,
+        help_text="Were the arrival and departure times interpolated?",
+    )
     extra_data = models.JSONField(default=dict, blank=True, null=True)
 
     def __str__(self):
         return "%s-%s-%s" % (self.trip_id, self.stop_id, self.stop_sequence)
 
+    @classmethod
+    def interpolate_times(cls, feed):
+        """Fill in the missing times of stops between timed stops
+
+        Stop times without an arrival or departure time get the time
+        interpolated between the previous and the next timed stop of the
+        trip.  The time is proportional to shape_dist_traveled, or to the
+        position of the stop in the gap if the distances are missing.  The
+        interpolated times are flagged, and are interpolated again on the
+        next run.  This runs as a single set-based UPDATE.
+
+        Returns the number of interpolated stop times.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH st AS (
+                    SELECT st.id, st.trip_id, st.stop_sequence,
+                           st.shape_dist_traveled AS dist,
+                           CASE WHEN st.interpolated THEN NULL
+                                ELSE COALESCE(st.departure_time, st.arrival_time)
+                           END AS departure,
+                           CASE WHEN st.interpolated THEN NULL
+                                ELSE COALESCE(st.arrival_time, st.departure_time)
+                           END AS arrival
+                    FROM stop_time st
+                    JOIN trip t ON t.id = st.trip_id
+                    JOIN route r ON r.id = t.route_id
+                    WHERE r.feed_id = %s
+                ), gaps AS (
+                    SELECT *,
+                           count(departure) OVER (
+                               PARTITION BY trip_id ORDER BY stop_sequence
+                           ) AS prev_gap,
+                           count(arrival) OVER (
+                               PARTITION BY trip_id ORDER BY stop_sequence DESC
+                           ) AS next_gap
+                    FROM st
+                ), bounds AS (
+                    SELECT id, arrival, dist,
+                           first_value(departure) OVER prev AS prev_time,
+                           first_value(dist) OVER prev AS prev_dist,
+                           row_number() OVER prev - 1 AS position,
+                           count(*) OVER (PARTITION BY trip_id, prev_gap) AS gap_size,
+                           first_value(arrival) OVER next AS next_time,
+                           first_value(dist) OVER next AS next_dist
+                    FROM gaps
+                    WINDOW prev AS (PARTITION BY trip_id, prev_gap ORDER BY stop_sequence),
+                           next AS (PARTITION BY trip_id, next_gap ORDER BY stop_sequence DESC)
+                ), interpolated AS (
+                    SELECT id, round(
+                        prev_time + (next_time - prev_time) * LEAST(GREATEST(
+                            CASE WHEN dist IS NOT NULL
+                                      AND prev_dist IS NOT NULL
+                                      AND next_dist > prev_dist
+                                 THEN (dist - prev_dist) / (next_dist - prev_dist)
+                                 ELSE position::float / gap_size
+                            END, 0), 1)
+                    ) AS time
+                    FROM bounds
+                    WHERE arrival IS NULL
+                      AND prev_time IS NOT NULL
+                      AND next_time IS NOT NULL
+                )
+                UPDATE stop_time
+                SET arrival_time = i.time,
+                    departure_time = i.time,
+                    interpolated = true
+                FROM interpolated i
+                WHERE stop_time.id = i.id
+                """,
+                [feed.id],
+            )
+            return cursor.rowcount
+
     class Meta:
         db_table = "stop_time"
         app_label = "multigtfs"
+        indexes = [
+            models.Index(
+                fields=["stop", "departure_time"], name="stop_time_stop_departure"
+            ),
+        ]
 
     _column_map = (
         ("trip_id", "trip__trip_id"),
@@ -101,6 +211,62 @@ class StopTime(Base):
         ("shape_dist_traveled", "shape_dist_traveled"),
     )
     _filename = "stop_times.txt"
+    _export_with_copy = True
     _rel_to_feed = "trip__route__feed"
     _sort_order = ("trip__trip_id", "stop_sequence")
     _unique_fields = ("trip_id", "stop_sequence")
+
+    @classmethod
+    def _export_field(cls, field_name):
+        """Export interpolated times as blank, as they were imported"""
+        if field_name in ("arrival_time", "departure_time"):
+            return Case(
+                When(interpolated=True, then=Value(None)),
+                default=F(field_name),
+                output_field=models.IntegerField(),
+            )
+        return super(StopTime, cls)._export_field(field_name)
+
+    @classmethod
+    def _export_objects(cls, feed):
+        """Export the packed stop times too, from CombinedStopTime"""
+        return CombinedStopTime.objects.in_feed(feed)
+
+
+class CombinedStopTime(models.Model):
+    """A stop time from either storage of stop times
+
+    This is a view over the rows of StopTime, and the UnpackedStopTime of
+    packed trips, with the fields of StopTime.  Code that reads the stop
+    times of any feed, packed or not, reads this view.  The packed stop
+    times have negative IDs.
+    """
+
+    trip_id: int
+    stop_id: int
+
+    objects = BaseManager()
+
+    id = models.BigIntegerField(primary_key=True)
+    trip = models.ForeignKey(Trip, on_delete=models.DO_NOTHING)
+    stop = models.ForeignKey(Stop, on_delete=models.DO_NOTHING)
+    arrival_time = SecondsField(default=None, null=True, blank=True)
+    departure_time = SecondsField(default=None, null=True, blank=True)
+    stop_sequence = models.IntegerField()
+    stop_headsign = models.CharField(max_length=255, blank=True)
+    pickup_type = models.CharField(max_length=1, blank=True)
+    drop_off_type = models.CharField(max_length=1, blank=True)
+    shape_dist_traveled = models.FloatField(null=True, blank=True)
+    interpolated = models.BooleanField(default=False)
+    extra_data = models.JSONField(default=dict, blank=True, null=True)
+
+    def __str__(self):
+        return "%s-%s-%s" % (self.trip_id, self.stop_id, self.stop_sequence)
+
+    class Meta:
+        managed = False
+        db_table = "combined_stop_time"
+        app_label = "multigtfs"
+
+    _column_map = StopTime._column_map
+    _rel_to_feed = StopTime._rel_to_feed
@@ -14,12 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import unicode_literals
-from datetime import date
+from datetime import date, datetime, timedelta
 from typing import TYPE_CHECKING
 
 from django.contrib.gis.geos import LineString
 from django.db.models import Manager
-from multigtfs.models.base import models, Base
+from django.utils import timezone
+from multigtfs.models.base import models, Base, BaseManager
 
 from multigtfs.models.shape import Shape
 from multigtfs.models.service import Service
@@ -27,10 +28,58 @@ from multigtfs.models.route import Route
 
 if TYPE_CHECKING:
     from app.models import VehicleStopTime
-    from multigtfs.models.stop_time import StopTime
+    from multigtfs.models.stop_time import CombinedStopTime, StopTime
     from multigtfs.models.trip_time import TripTime
 
 
+class TripManager(BaseManager):
+    def for_route_cached(self, route):
+        """Return the trips of a route from the query cache"""
+        return self.cached(
+            "for_route",
+            (route.pk,),
+            lambda: tuple(self.filter(route=route).order_by("trip_id")),
+            route.feed_id,
+        )
+
+    def active_at(self, feed, when):
+        """Return the IDs of the trips running at a time, or at each time
+
+        Trips of the previous service day are included while they run past
+        midnight, with times of 24:00:00 or later.  Lookups use an interval
+        index over TripTime (see multigtfs.trip_index), and the services
+        active on each date, both from the query cache.
+
+        Keyword arguments:
+        feed - The feed
+        when - A datetime in the time zone of the feed, or a list of them.
+            Aware datetimes are converted to the current time zone.
+
+        Returns a sorted list of trip IDs, or a list of them for a list of
+        datetimes.
+        """
+        from multigtfs.trip_index import DAY, TripIntervalIndex
+
+        index = self.cached(
+            "interval_index", (feed.id,), lambda: TripIntervalIndex(feed), feed.id
+        )
+        single = isinstance(when, datetime)
+        results = []
+        for moment in [when] if single else when:
+            if timezone.is_aware(moment):
+                moment = timezone.localtime(moment)
+            seconds = moment.hour * 3600 + moment.minute * 60 + moment.second
+            trip_ids = set()
+            for service_date, offset in (
+                (moment.date(), 0),
+                (moment.date() - timedelta(days=1), DAY),
+            ):
+                service_ids = Service.objects.ids_on_date_cached(feed, service_date)
+                trip_ids.update(index.active(seconds + offset, service_ids).tolist())
+            results.append(sorted(trip_ids))
+        return results[0] if single else results
+
+
 class Trip(Base):
     """A trip along a route
 
@@ -40,9 +89,12 @@ class Trip(Base):
     id: int
     route_id: int
     stoptime_set: Manager["StopTime"]
+    combinedstoptime_set: Manager["CombinedStopTime"]
     vehiclestoptime_set: Manager["VehicleStopTime"]
     triptime: "TripTime"
 
+    objects = TripManager()
+
     route = models.ForeignKey(Route, on_delete=models.CASCADE)
     service = models.ForeignKey(
         Service, null=True, blank=True, on_delete=models.SET_NULL
@@ -81,8 +133,15 @@ class Trip(Base):
         on_delete=models.SET_NULL,
         help_text="Shape used for this trip",
     )
+    pattern = models.ForeignKey(
+        "Pattern",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        help_text="Sequence of stops visited by this trip",
+    )
     geometry = models.LineStringField(
-        null=True, blank=True, help_text="Geometry cache of Shape or Stops"
+        null=True, blank=True, help_text="Geometry cache of Stops, if no Shape"
     )
     wheelchair_accessible = models.CharField(
         max_length=1,
@@ -106,13 +165,26 @@ class Trip(Base):
     )
     extra_data = models.JSONField(default=dict, blank=True, null=True)
 
+    @property
+    def path(self):
+        """The geometry of the Shape, or of the Stops for shapeless trips"""
+        if self.shape_id:
+            return self.shape.geometry
+        return self.geometry
+
     def update_geometry(self, update_parent=True):
-        """Update the geometry from the Shape or Stops"""
+        """Update the geometry from the Stops
+
+        Trips with a Shape share its geometry (see path), and don't store
+        a copy.
+        """
         original = self.geometry
-        if self.shape:
-            self.geometry = self.shape.geometry
+        if self.shape_id:
+            self.geometry = None
         else:
-            stoptimes = self.stoptime_set.order_by("stop_sequence")
+            stoptimes = self.combinedstoptime_set.order_by(
+                "stop_sequence"
+            ).select_related("stop")
             if stoptimes.count() > 1:
                 self.geometry = LineString([st.stop.point.coords for st in stoptimes])
         if self.geometry != original:
@@ -141,5 +213,6 @@ class Trip(Base):
         ("bikes_allowed", "bikes_allowed"),
     )
     _filename = "trips.txt"
+    _export_with_copy = True
     _rel_to_feed = "route__feed"
     _unique_fields = ("trip_id",)
@@ -0,0 +1,131 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process cache of schedule query results.
+
+Results are cached per feed, with the content revision of the feed (see
+FeedRevision) at the time they were computed.  Bumping a revision in this
+process drops the cached results of the feed at once.  Changes made by
+other processes are noticed when the revision is checked again, at most
+MULTIGTFS_QUERY_CACHE_REVISION_TTL seconds later.
+"""
+from collections import OrderedDict, namedtuple
+from threading import Lock
+import time
+
+from multigtfs.app_settings import (
+    MULTIGTFS_QUERY_CACHE_REVISION_TTL,
+    MULTIGTFS_QUERY_CACHE_SIZE,
+)
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class QueryCache(object):
+    """A bounded LRU cache of query results, invalidated by feed revision
+
+    Keyword arguments:
+    maxsize - The maximum number of cached results
+    revision_ttl - Seconds between checks of the revision of a feed
+    """
+
+    def __init__(self, maxsize=None, revision_ttl=None):
+        if maxsize is None:
+            maxsize = MULTIGTFS_QUERY_CACHE_SIZE
+        if revision_ttl is None:
+            revision_ttl = MULTIGTFS_QUERY_CACHE_REVISION_TTL
+        self.maxsize = maxsize
+        self.revision_ttl = revision_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._revisions = {}
+        self._lock = Lock()
+
+    def get(self, key, compute, feed_id):
+        """Return the cached result for a key, or compute and cache it
+
+        Keyword arguments:
+        key - A hashable key of the query
+        compute - A function that runs the query and returns the result
+        feed_id - The ID of the feed of the result, or a function that
+            returns it, which is only called when the result is computed
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            entry_feed_id, revision, result = entry
+            if self._feed_revision(entry_feed_id) == revision:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return result
+
+        if callable(feed_id):
+            feed_id = feed_id()
+        revision = self._feed_revision(feed_id)
+        result = compute()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (feed_id, revision, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self, feed_id=None):
+        """Drop the cached results of a feed, or of all feeds"""
+        with self._lock:
+            if feed_id is None:
+                self._entries.clear()
+                self._revisions.clear()
+            else:
+                self._revisions.pop(feed_id, None)
+                for key in [
+                    key
+                    for key, entry in self._entries.items()
+                    if entry[0] == feed_id
+                ]:
+                    del self._entries[key]
+
+    def clear(self):
+        """Drop all cached results, and reset the counters"""
+        self.invalidate()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Return the hits, misses, maximum and current size of the cache"""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def _feed_revision(self, feed_id):
+        """Get the content revision of a feed, checking it after the TTL"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._revisions.get(feed_id)
+        if cached is not None and now - cached[1] < self.revision_ttl:
+            return cached[0]
+
+        from multigtfs.models.feed_revision import FeedRevision
+
+        revision = FeedRevision.total(feed_id)
+        with self._lock:
+            self._revisions[feed_id] = (revision, now)
+        return revision
+
+
+query_cache = QueryCache()
@@ -0,0 +1,150 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-memory spatial index of the stops of a feed.
+
+Stops are projected onto a sphere of the Earth's mean radius, in 3D
+cartesian coordinates, where the straight-line (chord) distance orders
+points like the great-circle distance, with no distortion far from a
+projection center.  Lookups use a scipy KD-tree when scipy is installed,
+and a vectorized NumPy scan of all the stops otherwise.
+
+Use Stop.objects.spatial_index(feed) to get the index of a feed, which is
+built on first use and rebuilt when the feed changes.
+
+This requires numpy, which is an optional dependency.
+"""
+from collections import namedtuple
+
+from django.db.models import F, FloatField, Func
+
+from multigtfs.timetable import get_numpy
+
+EARTH_RADIUS = 6371008.8
+
+StopMatch = namedtuple("StopMatch", ["id", "stop_id", "distance"])
+
+
+def to_cartesian(np, lon, lat):
+    """Project WGS 84 longitudes and latitudes to points on the sphere"""
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return EARTH_RADIUS * np.stack(
+        (cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=-1
+    )
+
+
+def chord_to_distance(np, chord):
+    """Convert chord lengths to great-circle distances in meters"""
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / (2 * EARTH_RADIUS), 1.0))
+
+
+def distance_to_chord(np, distance):
+    """Convert great-circle distances in meters to chord lengths"""
+    angle = np.minimum(np.asarray(distance, dtype=np.float64) / EARTH_RADIUS, np.pi)
+    return 2 * EARTH_RADIUS * np.sin(angle / 2)
+
+
+class StopIndex(object):
+    """A spatial index of the stops in a feed
+
+    Queries take a longitude and latitude, or arrays of them for batched
+    queries, and return a list of StopMatch ordered by distance in meters,
+    or a list of such lists.
+    """
+
+    def __init__(self, feed):
+        np = self.np = get_numpy()
+        from multigtfs.models import Stop
+
+        rows = list(
+            Stop.objects.in_feed(feed)
+            .order_by("id")
+            .values_list(
+                "id",
+                "stop_id",
+                Func(F("point"), function="ST_X", output_field=FloatField()),
+                Func(F("point"), function="ST_Y", output_field=FloatField()),
+            )
+        )
+        self.feed_id = feed.id
+        self.ids = [row[0] for row in rows]
+        self.stop_ids = [row[1] for row in rows]
+        self.points = to_cartesian(
+            np, [row[2] for row in rows], [row[3] for row in rows]
+        ).reshape(-1, 3)
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            self.tree = None
+        else:
+            self.tree = cKDTree(self.points) if rows else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, lon, lat, k=1):
+        """Return the k nearest stops to a point, or to each point"""
+        np = self.np
+        queries = to_cartesian(np, lon, lat)
+        single = queries.ndim == 1
+        queries = queries.reshape(-1, 3)
+        k = min(k, len(self))
+        results = []
+        if k == 0:
+            results = [[] for _ in queries]
+        elif self.tree is not None:
+            chords, indices = self.tree.query(queries, k=k)
+            chords = chords.reshape(len(queries), k)
+            indices = indices.reshape(len(queries), k)
+            for row_chords, row_indices in zip(chords, indices):
+                results.append(self._matches(row_indices, row_chords))
+        else:
+            for query in queries:
+                chords = np.linalg.norm(self.points - query, axis=1)
+                indices = np.argpartition(chords, k - 1)[:k]
+                indices = indices[np.argsort(chords[indices], kind="stable")]
+                results.append(self._matches(indices, chords[indices]))
+        return results[0] if single else results
+
+    def within(self, lon, lat, radius_m):
+        """Return the stops within a distance in meters of a point, or of
+        each point"""
+        np = self.np
+        queries = to_cartesian(np, lon, lat)
+        single = queries.ndim == 1
+        queries = queries.reshape(-1, 3)
+        radius = float(distance_to_chord(np, radius_m))
+        results = []
+        for query in queries:
+            if self.tree is not None:
+                indices = np.asarray(
+                    self.tree.query_ball_point(query, radius), dtype=np.int64
+                )
+                chords = np.linalg.norm(self.points[indices] - query, axis=1)
+            else:
+                chords = np.linalg.norm(self.points - query, axis=1)
+                indices = np.flatnonzero(chords <= radius)
+                chords = chords[indices]
+            order = np.argsort(chords, kind="stable")
+            results.append(self._matches(indices[order], chords[order]))
+        return results[0] if single else results
+
+    def _matches(self, indices, chords):
+        distances = chord_to_distance(self.np, chords)
+        return [
+            StopMatch(self.ids[i], self.stop_ids[i], float(distance))
+            for i, distance in zip(indices.tolist(), distances.tolist())
+        ]
@@ -15,6 +15,7 @@
 
 from __future__ import unicode_literals
 
+from contextlib import nullcontext
 from django.test import TestCase
 from io import StringIO
 
@@ -104,6 +105,30 @@ Demo Transit Authority,http://google.com,America/Los_Angeles
         agency_txt = Agency.export_txt(self.feed)
         self.assertFalse(agency_txt)
 
+    def test_write_txt_agency_none(self):
+        def opener(filename):
+            self.fail('opener called without records')
+
+        self.assertIsNone(Agency.write_txt(self.feed, opener))
+
+    def test_write_txt_agency_minimal(self):
+        Agency.objects.create(
+            feed=self.feed, name='Demo Transit Authority',
+            url='http://google.com', timezone='America/Los_Angeles')
+        out = StringIO()
+        opened = []
+
+        def opener(filename):
+            opened.append(filename)
+            return nullcontext(out)
+
+        self.assertEqual(Agency.write_txt(self.feed, opener), 1)
+        self.assertEqual(opened, ['agency.txt'])
+        self.assertEqual(out.getvalue(), """\
+agency_name,agency_url,agency_timezone
+Demo Transit Authority,http://google.com,America/Los_Angeles
+""")
+
     def test_export_agency_minimal(self):
         Agency.objects.create(
             feed=self.feed, name='Demo Transit Authority',
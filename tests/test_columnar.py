@@ -0,0 +1,158 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+import shutil
+import tempfile
+import zipfile
+from unittest import skipUnless
+
+from django.test import TestCase
+
+from multigtfs.models import (
+    Agency, Feed, Route, Service, Stop, StopTime, Trip)
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:  # pragma: nocover
+    pyarrow = None
+
+
+@skipUnless(pyarrow, 'pyarrow is not installed')
+class ColumnarTest(TestCase):
+
+    def setUp(self):
+        self.feed = Feed.objects.create()
+        route = Route.objects.create(feed=self.feed, route_id='R1', rtype=3)
+        trip = Trip.objects.create(route=route, trip_id='T1')
+        stop = Stop.objects.create(
+            feed=self.feed, stop_id='S1', name='Stop',
+            point='POINT(17.0 51.1)')
+        StopTime.objects.create(
+            trip=trip, stop=stop, stop_sequence=1,
+            arrival_time='25:00:00', departure_time='25:01:00')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export_parquet(self):
+        records = self.feed.export_columnar(self.directory)
+        self.assertEqual(records['stop_times.parquet'], 1)
+        table = pyarrow.parquet.read_table(
+            os.path.join(self.directory, 'stop_times.parquet'))
+        self.assertEqual(table.to_pylist(), [{
+            'trip_id': 'T1',
+            'arrival_time': 90000,
+            'departure_time': 90060,
+            'stop_id': 'S1',
+            'stop_sequence': 1,
+        }])
+        self.assertEqual(table.schema.field('arrival_time').type,
+                         pyarrow.int32())
+        stops = pyarrow.parquet.read_table(
+            os.path.join(self.directory, 'stops.parquet'))
+        self.assertEqual(stops.column('stop_lon').to_pylist(), [17.0])
+
+    def test_export_arrow(self):
+        records = self.feed.export_columnar(self.directory, fmt='arrow')
+        self.assertEqual(records['trips.arrow'], 1)
+        with pyarrow.ipc.open_file(
+                os.path.join(self.directory, 'trips.arrow')) as reader:
+            table = reader.read_all()
+        self.assertEqual(table.column('trip_id').to_pylist(), ['T1'])
+
+    def test_import_round_trip(self):
+        self.feed.export_columnar(self.directory)
+        feed = Feed.objects.create()
+        feed.import_gtfs(self.directory)
+        stop_time = StopTime.objects.get(trip__route__feed=feed)
+        self.assertEqual(stop_time.trip.trip_id, 'T1')
+        self.assertEqual(stop_time.stop.stop_id, 'S1')
+        self.assertEqual(str(stop_time.arrival_time), '25:00:00')
+        self.assertEqual(stop_time.stop.point.coords, (17.0, 51.1))
+
+    def test_import_invalid_schema(self):
+        table = pyarrow.table({
+            'trip_id': ['T1'],
+            'stop_id': ['S1'],
+            'stop_sequence': [1],
+            'arrival_time': ['25:00:00'],
+        })
+        path = os.path.join(self.directory, 'stop_times.parquet')
+        pyarrow.parquet.write_table(table, path)
+        with self.assertRaises(ValueError):
+            StopTime.import_table(path, Feed.objects.create())
+
+    def test_import_zip(self):
+        self.feed.export_columnar(self.directory)
+        path = os.path.join(self.directory, 'feed.zip')
+        with zipfile.ZipFile(path, 'w') as z:
+            for name in os.listdir(self.directory):
+                if name != 'feed.zip':
+                    z.write(os.path.join(self.directory, name), name)
+        feed = Feed.objects.create()
+        feed.import_gtfs(path)
+        stop_time = StopTime.objects.get(trip__route__feed=feed)
+        self.assertEqual(str(stop_time.arrival_time), '25:00:00')
+
+    def test_import_prefers_columnar(self):
+        self.feed.export_columnar(self.directory)
+        with open(os.path.join(self.directory, 'stops.txt'), 'w') as f:
+            f.write('stop_id,stop_name,stop_lat,stop_lon\n'
+                    'S1,Text stop,51.1,17.0\n')
+        feed = Feed.objects.create()
+        with self.assertLogs('multigtfs.models.feed', 'WARNING'):
+            feed.import_gtfs(self.directory)
+        self.assertEqual(
+            list(Stop.objects.filter(feed=feed).values_list('name', flat=True)),
+            ['Stop'])
+
+    def test_import_stops_filter(self):
+        stops = pyarrow.table({
+            'stop_id': ['S1', 'S2'],
+            'stop_name': ['One', 'Two'],
+            'stop_lat': [51.1, 51.2],
+            'stop_lon': [17.0, 17.1],
+        })
+        path = os.path.join(self.directory, 'stops.parquet')
+        pyarrow.parquet.write_table(stops, path)
+        feed = Feed.objects.create()
+        count = Stop.import_table(
+            path, feed,
+            lambda batch: pyarrow.compute.equal(batch.column('stop_id'), 'S2'))
+        self.assertEqual(count, 1)
+        self.assertEqual(Stop.objects.get(feed=feed).stop_id, 'S2')
+
+    def test_export_skips_undated_calendar(self):
+        Service.objects.create(feed=self.feed, service_id='UNDATED')
+        records = self.feed.export_columnar(self.directory)
+        self.assertNotIn('calendar.parquet', records)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, 'calendar.parquet')))
+
+    def test_import_blank_unique_column(self):
+        Agency.objects.create(
+            feed=self.feed, name='Agency', url='http://example.com',
+            timezone='Europe/Warsaw')
+        self.feed.export_columnar(self.directory)
+        agency = pyarrow.parquet.read_table(
+            os.path.join(self.directory, 'agency.parquet'))
+        self.assertNotIn('agency_id', agency.schema.names)
+        feed = Feed.objects.create()
+        feed.import_gtfs(self.directory)
+        self.assertEqual(Agency.objects.get(feed=feed).agency_id, '')
@@ -0,0 +1,64 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import date
+
+from django.test import TestCase
+
+from multigtfs.models import (
+    Block, DutyChain, Feed, Route, Service, ServiceDates, Stop, StopTime,
+    Trip, TripTime)
+
+
+class DutyChainTest(TestCase):
+
+    def setUp(self):
+        self.feed = Feed.objects.create()
+        route = Route.objects.create(feed=self.feed, route_id='10', rtype=3)
+        service = Service.objects.create(feed=self.feed, service_id='S')
+        block = Block.objects.create(feed=self.feed, block_id='B1')
+        stop = Stop.objects.create(
+            feed=self.feed, stop_id='STOP', point='POINT(17.0 51.1)')
+        self.day = date(2024, 3, 1)
+        ServiceDates.objects.create(service=service, date=self.day)
+        self.trips = []
+        for trip_id, start, end in (
+                ('T2', '09:00:00', '10:00:00'),
+                ('T1', '08:00:00', '08:50:00')):
+            trip = Trip.objects.create(
+                route=route, service=service, trip_id=trip_id, brigade_id=3,
+                block=block)
+            StopTime.objects.create(
+                trip=trip, stop=stop, stop_sequence=1, arrival_time=start)
+            StopTime.objects.create(
+                trip=trip, stop=stop, stop_sequence=2, arrival_time=end)
+            self.trips.append(trip)
+        TripTime.refresh()
+        DutyChain.refresh()
+
+    def test_chain(self):
+        chain = DutyChain.chain(self.feed, self.day, DutyChain.BRIGADE, '10:3')
+        self.assertEqual(
+            [(link.trip.trip_id, link.position, link.layover)
+             for link in chain],
+            [('T1', 1, None), ('T2', 2, 600)])
+
+    def test_chain_of_trip(self):
+        with self.assertNumQueries(1):
+            chain = list(DutyChain.chain_of_trip(
+                self.trips[0], self.day, DutyChain.BLOCK))
+        self.assertEqual(
+            [link.trip.trip_id for link in chain], ['T1', 'T2'])
+        self.assertEqual(chain[0].chain_id, 'B1')
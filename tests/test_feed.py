@@ -15,15 +15,17 @@
 
 from __future__ import unicode_literals
 
+import hashlib
 import os
 import shutil
 import tempfile
 import zipfile
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
+from multigtfs.export_cache import ExportCache, export_dependencies
 from multigtfs.models import (
-    Agency, Block, Fare, FareRule, Feed, FeedInfo, Frequency,
+    Agency, Block, Fare, FareRule, Feed, FeedInfo, FeedRevision, Frequency,
     Route, Service, ServiceDate, Shape, ShapePoint, Stop, StopTime, Transfer,
     Trip, Zone)
 
@@ -760,6 +762,9 @@ adult,''' + s_fare_a + b''',USD,0,,7200
         shapes_out = self.normalize(z_out.read('shapes.txt'))
         self.assertEqual(shapes_in, shapes_out)
 
+        # Times missing in the feed are interpolated, but exported as blank
+        self.assertTrue(StopTime.objects.filter(
+            trip__route__feed=feed, interpolated=True).exists())
         stop_times_in = self.normalize(z_in.read('stop_times.txt'))
         stop_times_out = self.normalize(z_out.read('stop_times.txt'))
         self.assertEqual(stop_times_in, stop_times_out)
@@ -888,3 +893,103 @@ route_id,service_id,trip_id,direction_id,block_id,shape_id,trip_type
 route_id,service_id,trip_id,direction_id,block_id,shape_id
 34,W.411,5215038,0,3401,235511
 ''')
+
+    def test_export_gtfs_cached(self):
+        test_path = os.path.abspath(os.path.join(fixtures_dir, 'test1.zip'))
+        feed = Feed.objects.create()
+        feed.import_gtfs(test_path)
+        self.temp_dir = tempfile.mkdtemp()
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        out1 = os.path.join(self.temp_dir, 'out1.zip')
+        out2 = os.path.join(self.temp_dir, 'out2.zip')
+        feed.export_gtfs(out1, cache_dir=cache_dir)
+        feed.export_gtfs(out2, cache_dir=cache_dir)
+        with open(out1, 'rb') as f1, open(out2, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+        gtfs_order = (ServiceDate, StopTime)
+        old_keys = ExportCache(cache_dir, feed, gtfs_order).keys
+        old_revision = feed.revision
+        ServiceDate.objects.in_feed(feed).first().save()
+        self.assertEqual(feed.revision, old_revision + 1)
+        new_keys = ExportCache(cache_dir, feed, gtfs_order).keys
+        self.assertNotEqual(old_keys[ServiceDate], new_keys[ServiceDate])
+        self.assertEqual(old_keys[StopTime], new_keys[StopTime])
+
+    def test_revision_bumped_by_dependency(self):
+        feed = Feed.objects.create()
+        self.assertEqual(feed.revision, 0)
+        route = Route.objects.create(feed=feed, route_id='R1', rtype=3)
+        trip = Trip.objects.create(route=route, trip_id='T1')
+        self.assertEqual(feed.revisions(), {'Route': 1, 'Trip': 1})
+        trip.delete()
+        self.assertEqual(feed.revisions(), {'Route': 1, 'Trip': 2})
+        self.assertIn('Trip', export_dependencies(StopTime))
+        self.assertIn('Route', export_dependencies(StopTime))
+
+    def test_revision_bulk(self):
+        feed = Feed.objects.create()
+        route = Route.objects.create(feed=feed, route_id='R1', rtype=3)
+        trips = [
+            Trip.objects.create(route=route, trip_id='T%d' % i)
+            for i in range(3)]
+        with FeedRevision.bulk(feed.id):
+            # One query per save, and no revision bump
+            with self.assertNumQueries(3):
+                for trip in trips:
+                    trip.save()
+            self.assertEqual(feed.revisions(), {'Route': 1, 'Trip': 3})
+        self.assertEqual(feed.revisions(), {'Route': 1, 'Trip': 4})
+
+    def test_revision_feed_id_from_loaded_relation(self):
+        feed = Feed.objects.create()
+        route = Route.objects.create(feed=feed, route_id='R1', rtype=3)
+        trip = Trip.objects.create(route=route, trip_id='T1')
+        with self.assertNumQueries(0):
+            self.assertEqual(trip._get_feed_id(), feed.id)
+
+    def test_export_gtfs_deterministic(self):
+        test_path = os.path.abspath(os.path.join(fixtures_dir, 'test1.zip'))
+        self.temp_dir = tempfile.mkdtemp()
+        digests = []
+        contents = []
+        for i in range(2):
+            feed = Feed.objects.create()
+            feed.import_gtfs(test_path)
+            out_path = os.path.join(self.temp_dir, 'out%d.zip' % i)
+            digests.append(feed.export_gtfs(out_path, deterministic=True))
+            with open(out_path, 'rb') as out_file:
+                contents.append(out_file.read())
+        self.assertEqual(contents[0], contents[1])
+        self.assertEqual(digests[0], digests[1])
+        self.assertEqual(
+            digests[0]['archive'], hashlib.sha256(contents[0]).hexdigest())
+        z_out = zipfile.ZipFile(os.path.join(self.temp_dir, 'out0.zip'))
+        for info in z_out.infolist():
+            self.assertEqual(info.date_time, (1980, 1, 1, 0, 0, 0))
+            self.assertEqual(
+                digests[0]['files'][info.filename],
+                hashlib.sha256(z_out.read(info.filename)).hexdigest())
+
+
+class ParallelExportTest(TransactionTestCase):
+    """Export in worker processes, which need committed data"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_export_gtfs_parallel(self):
+        test_path = os.path.abspath(os.path.join(fixtures_dir, 'test1.zip'))
+        feed = Feed.objects.create()
+        feed.import_gtfs(test_path)
+        serial_path = os.path.join(self.temp_dir, 'serial.zip')
+        parallel_path = os.path.join(self.temp_dir, 'parallel.zip')
+        serial = feed.export_gtfs(serial_path, deterministic=True)
+        parallel = feed.export_gtfs(
+            parallel_path, processes=2, deterministic=True)
+        self.assertEqual(parallel, serial)
+        z_out = zipfile.ZipFile(parallel_path)
+        self.assertIn('stop_times.txt', z_out.namelist())
@@ -0,0 +1,106 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import nullcontext
+from datetime import date
+from io import StringIO
+
+from django.test import TestCase
+
+from multigtfs.feed_filter import FeedFilter
+from multigtfs.models import (
+    Agency, Feed, Route, Service, Stop, StopTime, Trip)
+
+
+class FeedFilterTest(TestCase):
+
+    def setUp(self):
+        self.feed = Feed.objects.create()
+        agency1 = Agency.objects.create(
+            feed=self.feed, agency_id='A1', name='North',
+            url='http://example.com', timezone='Europe/Warsaw')
+        agency2 = Agency.objects.create(
+            feed=self.feed, agency_id='A2', name='South',
+            url='http://example.com', timezone='Europe/Warsaw')
+        route1 = Route.objects.create(
+            feed=self.feed, route_id='R1', agency=agency1, rtype=3)
+        route2 = Route.objects.create(
+            feed=self.feed, route_id='R2', agency=agency2, rtype=3)
+        trip1 = Trip.objects.create(route=route1, trip_id='T1')
+        trip2 = Trip.objects.create(route=route2, trip_id='T2')
+        north = Stop.objects.create(
+            feed=self.feed, stop_id='N', name='North',
+            point='POINT(17.0 51.2)')
+        center = Stop.objects.create(
+            feed=self.feed, stop_id='C', name='Center',
+            point='POINT(17.0 51.1)')
+        south = Stop.objects.create(
+            feed=self.feed, stop_id='S', name='South',
+            point='POINT(17.0 51.0)')
+        StopTime.objects.create(trip=trip1, stop=north, stop_sequence=1)
+        StopTime.objects.create(trip=trip1, stop=center, stop_sequence=2)
+        StopTime.objects.create(trip=trip2, stop=center, stop_sequence=1)
+        StopTime.objects.create(trip=trip2, stop=south, stop_sequence=2)
+
+    def export(self, klass, feed_filter):
+        out = StringIO()
+        klass.write_txt(
+            self.feed, lambda filename: nullcontext(out),
+            feed_filter=feed_filter)
+        return out.getvalue()
+
+    def test_route_ids(self):
+        feed_filter = FeedFilter(route_ids=['R1'])
+        self.assertEqual(self.export(Trip, feed_filter), """\
+route_id,trip_id
+R1,T1
+""")
+        self.assertEqual(self.export(StopTime, feed_filter), """\
+trip_id,stop_id,stop_sequence
+T1,N,1
+T1,C,2
+""")
+        self.assertEqual(
+            sorted(feed_filter.stops(self.feed).values_list(
+                'stop_id', flat=True)),
+            ['C', 'N'])
+        self.assertEqual(
+            list(feed_filter.filter(
+                Agency, self.feed, Agency.objects.in_feed(self.feed),
+            ).values_list('agency_id', flat=True)),
+            ['A1'])
+
+    def test_bbox(self):
+        feed_filter = FeedFilter(bbox=(16.9, 50.9, 17.1, 51.05))
+        self.assertEqual(
+            list(feed_filter.trips(self.feed).values_list(
+                'trip_id', flat=True)),
+            ['T2'])
+        self.assertEqual(
+            list(feed_filter.routes(self.feed).values_list(
+                'route_id', flat=True)),
+            ['R2'])
+
+    def test_calendar_of_filtered_services(self):
+        dated = Service.objects.create(
+            feed=self.feed, service_id='DATED', start_date=date(2024, 1, 1),
+            end_date=date(2024, 12, 31))
+        undated = Service.objects.create(feed=self.feed, service_id='UNDATED')
+        Trip.objects.filter(trip_id='T1').update(service=dated)
+        Trip.objects.filter(trip_id='T2').update(service=undated)
+        # Only services without start/end dates are exported
+        self.assertEqual(self.export(Service, FeedFilter(route_ids=['R2'])), '')
+        self.assertIn(
+            'DATED', self.export(Service, FeedFilter(route_ids=['R1'])))
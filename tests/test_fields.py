@@ -14,10 +14,17 @@
 # limitations under the License.
 
 from __future__ import unicode_literals
+from datetime import datetime, timedelta
+from unittest import skipUnless
 
 from django.test import TestCase
 
-from multigtfs.models.fields import Seconds, SecondsField
+from multigtfs.models.fields import Seconds, SecondsArray, SecondsField
+
+try:
+    import numpy
+except ImportError:  # pragma: nocover
+    numpy = None
 
 
 class SecondsTest(TestCase):
@@ -86,3 +93,48 @@ class SecondsFieldTest(TestCase):
 
     def test_prep_db_value_None(self):
         self.assertIsNone(self.f.get_prep_value(None))
+
+
+@skipUnless(numpy, 'numpy is not installed')
+class SecondsArrayTest(TestCase):
+
+    def setUp(self):
+        self.times = SecondsArray([Seconds(60), None, 90000])
+
+    def test_format(self):
+        self.assertEqual(self.times.format(), ['00:01:00', '', '25:00:00'])
+        self.assertEqual(list(self.times), [Seconds(60), None, Seconds(90000)])
+
+    def test_add_sub(self):
+        self.assertEqual(
+            (self.times + timedelta(minutes=1)).format(),
+            ['00:02:00', '', '25:01:00'])
+        self.assertEqual(
+            (self.times - timedelta(minutes=2)).format(),
+            ['23:59:00', '', '24:58:00'])
+        self.assertEqual(
+            [str(t) for t in (self.times - timedelta(minutes=2))
+             if t is not None],
+            [str(Seconds(60) - timedelta(minutes=2)),
+             str(Seconds(90000) - timedelta(minutes=2))])
+
+    def test_sub_missing_operand(self):
+        others = SecondsArray([None, Seconds(30), Seconds(60)])
+        self.assertEqual(
+            (self.times - others).format(), ['', '', '24:59:00'])
+        self.assertEqual(
+            (self.times + others).format(), ['', '', '25:01:00'])
+
+    def test_delay(self):
+        moment = datetime(2024, 3, 1, 0, 3)
+        delays = self.times.delay([moment, moment, moment])
+        self.assertEqual(delays[0], numpy.timedelta64(120, 's'))
+        self.assertTrue(numpy.isnat(delays[1]))
+        self.assertEqual(
+            delays[2].astype(object), Seconds(90000).delay(moment))
+
+    def test_comparison(self):
+        self.assertEqual(
+            list(self.times < Seconds(3600)), [True, False, False])
+        self.assertEqual(
+            list(self.times >= self.times), [True, False, True])
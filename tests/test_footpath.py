@@ -0,0 +1,48 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import TestCase
+
+from multigtfs.models import Feed, Footpath, Stop
+
+
+class FootpathTest(TestCase):
+
+    def setUp(self):
+        self.feed = Feed.objects.create()
+        # About 111 m per 0.001 degree of latitude
+        for stop_id, lat, location_type in (
+                ('A', 51.100, ''), ('B', 51.102, '0'), ('C', 51.110, ''),
+                ('STATION', 51.101, '1'), ('ENTRANCE', 51.1005, '2'),
+                ('NODE', 51.1015, '3')):
+            Stop.objects.create(
+                feed=self.feed, stop_id=stop_id, location_type=location_type,
+                point='POINT(17.0 %s)' % lat)
+
+    def test_generate(self):
+        self.assertEqual(Footpath.generate(self.feed, max_distance=300), 2)
+        footpaths = Footpath.objects.order_by('from_stop__stop_id')
+        self.assertEqual(
+            [(f.from_stop.stop_id, f.to_stop.stop_id) for f in footpaths],
+            [('A', 'B'), ('B', 'A')])
+        self.assertAlmostEqual(footpaths[0].distance, 222.5, delta=1)
+        self.assertEqual(
+            footpaths[0].walking_time,
+            int(-(-footpaths[0].distance * 1.25 // 1.3)))
+
+    def test_generate_replaces(self):
+        Footpath.generate(self.feed, max_distance=300)
+        self.assertEqual(Footpath.generate(self.feed, max_distance=100), 0)
+        self.assertFalse(Footpath.objects.exists())
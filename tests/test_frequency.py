@@ -16,14 +16,22 @@
 from __future__ import unicode_literals
 from datetime import date
 from json import loads
+from unittest import skipUnless
 
 from django.core.serializers import serialize
 from django.test import TestCase
 from io import StringIO
 
-from multigtfs.models import Feed, Frequency, Route, Service, Trip
+from multigtfs.models import (
+    Feed, Frequency, FrequencyDeparture, Route, Service, Stop, StopTime, Trip,
+    TripTime)
 from multigtfs.models.fields import Seconds
 
+try:
+    import numpy
+except ImportError:  # pragma: nocover
+    numpy = None
+
 
 class FrequencyTest(TestCase):
     def setUp(self):
@@ -141,3 +149,49 @@ STBA,05:00:00,25:00:00,1800
                 "end_time": "25:00:00"}}]
         self.maxDiff = None
         self.assertEqual(expected, actual)
+
+    def test_expand_departures(self):
+        stop = Stop.objects.create(
+            feed=self.feed, stop_id='STOP', point='POINT(17.0 51.1)')
+        StopTime.objects.create(
+            trip=self.trip, stop=stop, stop_sequence=1,
+            arrival_time='06:05:00', departure_time='06:05:00')
+        StopTime.objects.create(
+            trip=self.trip, stop=stop, stop_sequence=2,
+            arrival_time='06:15:00', departure_time='06:16:00')
+        Frequency.objects.create(
+            trip=self.trip, start_time='06:00:00', end_time='07:00:00',
+            headway_secs=1200, exact_times='1')
+        TripTime.refresh()
+
+        self.assertEqual(FrequencyDeparture.refresh(self.feed), 3)
+        departures = FrequencyDeparture.objects.order_by('departure')
+        self.assertEqual(
+            [(str(d.departure), d.offset, d.exact) for d in departures], [
+                ('06:00:00', -300, True),
+                ('06:20:00', 900, True),
+                ('06:40:00', 2100, True)])
+
+    @skipUnless(numpy, "numpy is not installed")
+    def test_departure_stop_times_negative_offset(self):
+        stop = Stop.objects.create(
+            feed=self.feed, stop_id='STOP', point='POINT(17.0 51.1)')
+        StopTime.objects.create(
+            trip=self.trip, stop=stop, stop_sequence=1,
+            arrival_time='00:05:00', departure_time='00:05:00')
+        StopTime.objects.create(
+            trip=self.trip, stop=stop, stop_sequence=2,
+            arrival_time='00:15:00', departure_time='00:16:00')
+        frequency = Frequency.objects.create(
+            trip=self.trip, start_time='00:00:00', end_time='01:00:00',
+            headway_secs=1200)
+        departure = FrequencyDeparture.objects.create(
+            frequency=frequency, trip=self.trip, departure='00:00:00',
+            offset=-300, exact=False)
+        arrivals, departures = departure.stop_times()
+        self.assertEqual(arrivals.format(), ['00:00:00', '00:10:00'])
+        self.assertEqual(departures.format(), ['00:00:00', '00:11:00'])
+        # Not wrapped into the previous day
+        departure.offset = -600
+        with self.assertRaises(ValueError):
+            departure.stop_times()
@@ -0,0 +1,111 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os.path
+
+from django.test import TestCase
+
+from multigtfs.models import (
+    CombinedStopTime, Feed, PackedStopTimes, Pattern, Route, Stop, StopTime,
+    Trip, TripTime, UnpackedStopTime)
+
+fixtures_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+FIELDS = (
+    'stop_id', 'arrival_time', 'departure_time', 'stop_sequence',
+    'stop_headsign', 'pickup_type', 'drop_off_type', 'shape_dist_traveled',
+    'interpolated', 'extra_data')
+
+
+class PackedStopTimesTest(TestCase):
+
+    def setUp(self):
+        self.feed = Feed.objects.create()
+        route = Route.objects.create(feed=self.feed, route_id='R1', rtype=3)
+        self.trip = Trip.objects.create(route=route, trip_id='T1')
+        for sequence, (stop_id, time, headsign, pickup) in enumerate((
+                ('A', '08:00:00', '', ''),
+                ('B', '08:05:00', 'Centrum', '1'),
+                ('C', None, '', '0')), start=5):
+            stop = Stop.objects.create(
+                feed=self.feed, stop_id=stop_id, point='POINT(17.0 51.1)')
+            StopTime.objects.create(
+                trip=self.trip, stop=stop, stop_sequence=sequence,
+                arrival_time=time, departure_time=time,
+                stop_headsign=headsign, pickup_type=pickup,
+                extra_data={'x': 1} if stop_id == 'C' else {})
+        Pattern.refresh(self.feed)
+
+    def stop_times(self, queryset):
+        return [
+            tuple(getattr(st, field) for field in FIELDS)
+            for st in queryset.order_by('stop_sequence')]
+
+    def test_pack_unpack(self):
+        original = self.stop_times(StopTime.objects.all())
+        self.assertEqual(PackedStopTimes.pack(self.feed), 1)
+        self.assertFalse(StopTime.objects.exists())
+        packed = PackedStopTimes.objects.get()
+        self.assertEqual(packed.arrival_offsets, [0, 300, None])
+        self.assertEqual(packed.pickup_types, ' 10')
+        self.assertEqual(
+            self.stop_times(UnpackedStopTime.objects.all()), original)
+
+        self.assertEqual(PackedStopTimes.unpack(self.feed), 3)
+        self.assertFalse(PackedStopTimes.objects.exists())
+        self.assertEqual(self.stop_times(StopTime.objects.all()), original)
+
+    def test_pack_departures_only(self):
+        StopTime.objects.update(arrival_time=None)
+        original = self.stop_times(StopTime.objects.all())
+        PackedStopTimes.pack(self.feed)
+        packed = PackedStopTimes.objects.get()
+        self.assertEqual(str(packed.start_time), '08:00:00')
+        self.assertEqual(packed.departure_offsets, [0, 300, None])
+        self.assertEqual(
+            self.stop_times(UnpackedStopTime.objects.all()), original)
+
+    def test_refresh_patterns_packed(self):
+        PackedStopTimes.pack(self.feed)
+        with self.assertRaises(ValueError):
+            Pattern.refresh(self.feed)
+        PackedStopTimes.unpack(self.feed)
+        self.assertEqual(Pattern.refresh(self.feed), 1)
+
+    def test_for_trip_cached(self):
+        PackedStopTimes.pack(self.feed)
+        stop_times = StopTime.objects.for_trip_cached(self.trip)
+        self.assertEqual(
+            [st.stop.stop_id for st in stop_times], ['A', 'B', 'C'])
+
+    def test_combined(self):
+        original = self.stop_times(StopTime.objects.all())
+        PackedStopTimes.pack(self.feed)
+        self.assertEqual(
+            self.stop_times(CombinedStopTime.objects.in_feed(self.feed)),
+            original)
+
+    def test_export_packed(self):
+        stop_times_txt = StopTime.export_txt(self.feed)
+        PackedStopTimes.pack(self.feed)
+        self.assertEqual(StopTime.export_txt(self.feed), stop_times_txt)
+
+    def test_trip_time_after_import(self):
+        PackedStopTimes.pack(self.feed)
+        Feed.objects.create().import_gtfs(
+            os.path.join(fixtures_dir, 'test1.zip'))
+        trip_time = TripTime.objects.get(trip=self.trip)
+        self.assertEqual(
+            (trip_time.start_time.seconds, trip_time.end_time.seconds),
+            (8 * 3600, 8 * 3600 + 300))
@@ -0,0 +1,52 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import TestCase
+
+from multigtfs.models import Feed, Pattern, Route, Stop, StopTime, Trip
+
+
+class PatternTest(TestCase):
+
+    def setUp(self):
+        self.feed = Feed.objects.create()
+        route = Route.objects.create(feed=self.feed, route_id='R1', rtype=3)
+        self.stops = [
+            Stop.objects.create(
+                feed=self.feed, stop_id=stop_id, point='POINT(17.0 51.1)')
+            for stop_id in ('A', 'B', 'C')]
+        a, b, c = self.stops
+        for trip_id, stops in (
+                ('T1', (a, b, c)), ('T2', (a, b, c)), ('T3', (c, b, a))):
+            trip = Trip.objects.create(route=route, trip_id=trip_id)
+            for sequence, stop in enumerate(stops, start=1):
+                StopTime.objects.create(
+                    trip=trip, stop=stop, stop_sequence=sequence)
+        Trip.objects.create(route=route, trip_id='EMPTY')
+
+    def test_refresh(self):
+        self.assertEqual(Pattern.refresh(self.feed), 2)
+        trips = {trip.trip_id: trip for trip in Trip.objects.all()}
+        self.assertEqual(trips['T1'].pattern_id, trips['T2'].pattern_id)
+        self.assertNotEqual(trips['T1'].pattern_id, trips['T3'].pattern_id)
+        self.assertIsNone(trips['EMPTY'].pattern_id)
+        self.assertEqual(trips['T3'].pattern.stops(), self.stops[::-1])
+
+    def test_refresh_again(self):
+        Pattern.refresh(self.feed)
+        self.assertEqual(Pattern.refresh(self.feed), 2)
+        self.assertEqual(Pattern.objects.count(), 2)
+        self.assertFalse(Trip.objects.filter(
+            pattern__isnull=True).exclude(trip_id='EMPTY').exists())
@@ -0,0 +1,67 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import TestCase
+
+from multigtfs.models import Feed, Route, Stop, StopTime, Trip
+from multigtfs.query_cache import QueryCache, query_cache
+
+
+class QueryCacheTest(TestCase):
+
+    def setUp(self):
+        query_cache.clear()
+        self.feed = Feed.objects.create()
+        route = Route.objects.create(feed=self.feed, route_id='R1', rtype=3)
+        self.trip = Trip.objects.create(route=route, trip_id='T1')
+        self.stop = Stop.objects.create(
+            feed=self.feed, stop_id='S1', point='POINT(17.0 51.1)')
+        StopTime.objects.create(
+            trip=self.trip, stop=self.stop, stop_sequence=1)
+
+    def test_for_trip_cached(self):
+        stop_times = StopTime.objects.for_trip_cached(self.trip)
+        self.assertEqual([st.stop_sequence for st in stop_times], [1])
+        with self.assertNumQueries(0):
+            self.assertIs(
+                StopTime.objects.for_trip_cached(self.trip), stop_times)
+        info = query_cache.info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_invalidated_by_save(self):
+        StopTime.objects.for_trip_cached(self.trip)
+        StopTime.objects.create(
+            trip=self.trip, stop=self.stop, stop_sequence=2)
+        stop_times = StopTime.objects.for_trip_cached(self.trip)
+        self.assertEqual([st.stop_sequence for st in stop_times], [1, 2])
+        self.assertEqual(query_cache.info().misses, 2)
+
+    def test_other_feed_not_invalidated(self):
+        StopTime.objects.for_trip_cached(self.trip)
+        Stop.objects.create(
+            feed=Feed.objects.create(), stop_id='S1',
+            point='POINT(17.0 51.1)')
+        with self.assertNumQueries(0):
+            StopTime.objects.for_trip_cached(self.trip)
+
+    def test_lru_eviction(self):
+        cache = QueryCache(maxsize=2)
+        cache.get('a', lambda: 1, self.feed.id)
+        cache.get('b', lambda: 2, self.feed.id)
+        cache.get('a', lambda: 1, self.feed.id)
+        cache.get('c', lambda: 3, self.feed.id)
+        self.assertEqual(cache.get('a', lambda: None, self.feed.id), 1)
+        self.assertIsNone(cache.get('b', lambda: None, self.feed.id))
+        self.assertEqual(cache.info().currsize, 2)
@@ -18,6 +18,7 @@ from __future__ import unicode_literals
 from django.contrib.gis.geos import MultiLineString
 from django.test import TestCase
 from io import StringIO
+from unittest import mock
 
 from multigtfs.models import Feed, Route, Shape, ShapePoint, Trip
 
@@ -164,7 +165,8 @@ S1,36.425288,-117.133162,1,1.1
         self.assertEqual(
             shape.geometry.coords,
             ((-117.133162, 36.425288), (-117.13, 36.42)))
-        self.assertEqual(trip.geometry, shape.geometry)
+        self.assertIsNone(trip.geometry)
+        self.assertEqual(trip.path, shape.geometry)
         self.assertEqual(route.geometry,
                          MultiLineString(shape.geometry, srid=4326))
 
@@ -210,3 +212,68 @@ S1,36.425288,-117.133162,1,1.1
             ((-117.1, 36.42), (-117.2, 36.42), (-117.3, 36.42),
              (-117.4, 36.42), (-117.5, 36.42), (-117.6, 36.42),
              (-117.7, 36.42), (-117.8, 36.42), (-117.9, 36.42)))
+
+    def test_import_compact(self):
+        shape_txt = StringIO("""\
+shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence,shape_dist_traveled
+S1,36.42,-117.2,20,1.5
+S1,36.42,-117.1,10,0
+S2,36.43,-117.1,1,
+""")
+        self.assertEqual(Shape.import_compact_txt(shape_txt, self.feed), 3)
+        shape = Shape.objects.get(shape_id='S1')
+        self.assertEqual(
+            shape.geometry.coords, ((-117.1, 36.42), (-117.2, 36.42)))
+        self.assertEqual(shape.distances, [0, 1.5])
+        self.assertEqual(shape.sequences, [10, 20])
+        self.assertFalse(shape.points.exists())
+        self.assertEqual(
+            [v.sequence for v in shape.vertices.order_by('sequence')],
+            [10, 20])
+        single = Shape.objects.get(shape_id='S2')
+        self.assertEqual(single.geometry, None)
+        self.assertEqual(single.points.get().sequence, 1)
+
+    def test_import_compact_batches(self):
+        shape_txt = StringIO("""\
+shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence
+S1,36.42,-117.1,1
+S2,36.43,-117.1,1
+S2,36.43,-117.2,2
+S1,36.42,-117.3,3
+S1,36.42,-117.2,2
+S1,36.42,-117.4,3
+""")
+        with mock.patch('multigtfs.models.shape.batch_size', 1):
+            count = Shape.import_compact_txt(shape_txt, self.feed)
+        self.assertEqual(count, 5)
+        shape = Shape.objects.with_geometry().get(shape_id='S1')
+        self.assertEqual(
+            shape.geometry.coords,
+            ((-117.1, 36.42), (-117.2, 36.42), (-117.3, 36.42)))
+        self.assertEqual(shape.sequences, [1, 2, 3])
+        self.assertFalse(shape.points.exists())
+        shape = Shape.objects.with_geometry().get(shape_id='S2')
+        self.assertEqual(
+            shape.geometry.coords, ((-117.1, 36.43), (-117.2, 36.43)))
+
+    def test_export_compact(self):
+        shape = Shape.objects.create(feed=self.feed, shape_id='S1')
+        ShapePoint.objects.create(
+            shape=shape, point="POINT(-117.1 36.42)", sequence=5)
+        Shape.objects.create(
+            feed=self.feed, shape_id='S2',
+            geometry='LINESTRING(-117.1 36.43, -117.2 36.43)',
+            sequences=[10, 20], distances=[0, 1.5])
+        Shape.objects.create(
+            feed=self.feed, shape_id='S3',
+            geometry='LINESTRING(-117.1 36.44, -117.2 36.44)')
+        shape_txt = ShapePoint.export_txt(self.feed)
+        self.assertEqual(shape_txt, """\
+shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence,shape_dist_traveled
+S1,36.42,-117.1,5,
+S2,36.43,-117.1,10,0.0
+S2,36.43,-117.2,20,1.5
+S3,36.44,-117.1,1,
+S3,36.44,-117.2,2,
+""")
@@ -14,13 +14,16 @@
 # limitations under the License.
 
 from __future__ import unicode_literals
+from datetime import date, timedelta
 
 from django.contrib.gis.geos import MultiLineString
 from django.test import TestCase
 from io import StringIO
 
 from multigtfs.compat import bom_prefix_csv, force_utf8
-from multigtfs.models import Feed, Route, Stop, StopTime, Trip, Zone
+from multigtfs.models import (
+    Feed, Route, Service, ServiceDates, Stop, StopTime, Trip, Zone)
+from multigtfs.models.fields import Seconds
 
 
 class StopTest(TestCase):
@@ -327,3 +330,32 @@ FUR_CREEK_RES,Furnace Creek Resort (Demo),36.425288,-117.133162,7
             ((-117.133162, 36.425288), (-117.13, 36.42)))
         self.assertEqual(route.geometry,
                          MultiLineString(trip.geometry, srid=4326))
+
+    def test_departures(self):
+        route = Route.objects.create(feed=self.feed, route_id='R1', rtype=3)
+        service = Service.objects.create(feed=self.feed, service_id='S')
+        station = Stop.objects.create(
+            feed=self.feed, stop_id='STATION', location_type='1',
+            point="POINT(-117.133162 36.425288)")
+        platform = Stop.objects.create(
+            feed=self.feed, stop_id='PLATFORM', parent_station=station,
+            point="POINT(-117.133162 36.425288)")
+        day = date(2024, 3, 1)
+        ServiceDates.objects.create(service=service, date=day)
+        ServiceDates.objects.create(
+            service=service, date=day - timedelta(days=1))
+        for trip_id, departure in (
+                ('EARLY', '05:00:00'), ('LATE', '08:30:00'),
+                ('NIGHT', '24:45:00'), ('DAY', '09:00:00')):
+            trip = Trip.objects.create(
+                route=route, service=service, trip_id=trip_id)
+            StopTime.objects.create(
+                stop=platform, trip=trip, stop_sequence=1,
+                departure_time=departure)
+
+        departures = station.departures(day, Seconds.from_hms(0, 30), 3)
+        self.assertEqual(
+            [(st.trip.trip_id, st.service_date) for st in departures], [
+                ('NIGHT', day - timedelta(days=1)),
+                ('EARLY', day),
+                ('LATE', day)])
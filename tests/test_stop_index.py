@@ -0,0 +1,72 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import skipUnless
+
+from django.test import TestCase
+
+from multigtfs.models import Feed, Stop
+from multigtfs.query_cache import query_cache
+
+try:
+    import numpy
+except ImportError:  # pragma: nocover
+    numpy = None
+
+
+@skipUnless(numpy, 'numpy is not installed')
+class StopIndexTest(TestCase):
+
+    def setUp(self):
+        query_cache.clear()
+        self.feed = Feed.objects.create()
+        # About 111 m per 0.001 degree of latitude
+        for stop_id, lat in (('A', 51.100), ('B', 51.101), ('C', 51.105)):
+            Stop.objects.create(
+                feed=self.feed, stop_id=stop_id,
+                point='POINT(17.0 %s)' % lat)
+
+    def assert_queries(self, index):
+        nearest = index.nearest(17.0, 51.1004, k=2)
+        self.assertEqual([m.stop_id for m in nearest], ['A', 'B'])
+        self.assertAlmostEqual(nearest[0].distance, 44.5, delta=0.5)
+
+        within = index.within(17.0, 51.1004, 200)
+        self.assertEqual([m.stop_id for m in within], ['A', 'B'])
+
+        batched = index.nearest([17.0, 17.0], [51.1, 51.106])
+        self.assertEqual(
+            [[m.stop_id for m in matches] for matches in batched],
+            [['A'], ['C']])
+        batched = index.within([17.0, 17.0], [51.1, 51.2], 10)
+        self.assertEqual(
+            [[m.stop_id for m in matches] for matches in batched],
+            [['A'], []])
+
+    def test_queries(self):
+        self.assert_queries(Stop.objects.spatial_index(self.feed))
+
+    def test_queries_without_kdtree(self):
+        index = Stop.objects.spatial_index(self.feed)
+        index.tree = None
+        self.assert_queries(index)
+
+    def test_rebuilt_when_feed_changes(self):
+        index = Stop.objects.spatial_index(self.feed)
+        self.assertIs(Stop.objects.spatial_index(self.feed), index)
+        Stop.objects.create(
+            feed=self.feed, stop_id='D', point='POINT(17.0 51.0)')
+        index = Stop.objects.spatial_index(self.feed)
+        self.assertEqual(len(index), 4)
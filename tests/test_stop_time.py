@@ -16,10 +16,14 @@
 from __future__ import unicode_literals
 from datetime import time
 
+from django.db.models import (
+    ExpressionWrapper, F, FloatField, IntegerField, Value)
 from django.test import TestCase
 from io import StringIO
+from unittest import mock
 
 from multigtfs.models import Feed, Route, Stop, StopTime, Trip
+from multigtfs.models.base import FloatText, SecondsText
 
 
 class StopTimeTest(TestCase):
@@ -230,3 +234,81 @@ STBA,,,SALOON,2,,,,
 STBA,,,GENERAL_STORE,3,,,,
 STBA,07:00:00,07:00:00,MORGUE,4,MORT,,,
 """)
+
+    def test_export_copy_matches_python(self):
+        StopTime.objects.create(
+            trip=self.trip, arrival_time='6:00:00', departure_time='6:00:00',
+            stop=self.stop, stop_sequence=1, stop_headsign='Main, North',
+            pickup_type=2, drop_off_type=1, shape_dist_traveled=5.0)
+        stop2 = Stop.objects.create(
+            feed=self.feed, stop_id='SALOON', point="POINT(-117.1 36.5)")
+        StopTime.objects.create(
+            trip=self.trip, arrival_time='25:01:02', departure_time='125:0:0',
+            stop=stop2, stop_sequence=2, shape_dist_traveled=0.0001)
+        stop3 = Stop.objects.create(
+            feed=self.feed, stop_id='GENERAL_STORE',
+            point="POINT(-117.2 36.5)")
+        StopTime.objects.create(
+            trip=self.trip, stop=stop3, stop_sequence=3,
+            shape_dist_traveled=1234.5678)
+        copy_txt = StopTime.export_txt(self.feed)
+        with mock.patch.object(StopTime, '_export_with_copy', False):
+            python_txt = StopTime.export_txt(self.feed)
+        self.assertEqual(copy_txt, python_txt)
+        self.assertEqual(copy_txt, """\
+trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,\
+pickup_type,drop_off_type,shape_dist_traveled
+STBA,06:00:00,06:00:00,STAGECOACH,1,"Main, North",2,1,5.0
+STBA,25:01:02,125:00:00,SALOON,2,,,,0.0001
+STBA,,,GENERAL_STORE,3,,,,1234.5678
+""")
+
+    def test_interpolate_times(self):
+        for sequence, arrival, dist in (
+                (1, '06:00:00', 0.0), (2, None, 100.0), (3, None, None),
+                (4, '06:10:00', 1000.0), (5, None, None)):
+            StopTime.objects.create(
+                trip=self.trip, stop=self.stop, stop_sequence=sequence,
+                arrival_time=arrival, departure_time=arrival,
+                shape_dist_traveled=dist)
+        self.assertEqual(StopTime.interpolate_times(self.feed), 2)
+        stop_times = StopTime.objects.filter(
+            trip=self.trip).order_by('stop_sequence')
+        self.assertEqual(
+            [(str(st.arrival_time), st.interpolated) for st in stop_times], [
+                ('06:00:00', False),
+                ('06:01:00', True),
+                ('06:06:40', True),
+                ('06:10:00', False),
+                ('None', False)])
+
+    def test_export_interpolated_blank(self):
+        for sequence, arrival in (
+                (1, '06:00:00'), (2, None), (3, '06:10:00')):
+            StopTime.objects.create(
+                trip=self.trip, stop=self.stop, stop_sequence=sequence,
+                arrival_time=arrival, departure_time=arrival)
+        self.assertEqual(StopTime.interpolate_times(self.feed), 1)
+        copy_txt = StopTime.export_txt(self.feed)
+        with mock.patch.object(StopTime, '_export_with_copy', False):
+            python_txt = StopTime.export_txt(self.feed)
+        self.assertEqual(copy_txt, python_txt)
+        self.assertEqual(copy_txt, """\
+trip_id,arrival_time,departure_time,stop_id,stop_sequence
+STBA,06:00:00,06:00:00,STAGECOACH,1
+STBA,,,STAGECOACH,2
+STBA,06:10:00,06:10:00,STAGECOACH,3
+""")
+
+    def test_copy_formatters_with_params(self):
+        StopTime.objects.create(
+            trip=self.trip, stop=self.stop, stop_sequence=1,
+            arrival_time='6:00:00', departure_time='6:00:00',
+            shape_dist_traveled=1.0)
+        texts = StopTime.objects.values_list(
+            SecondsText(ExpressionWrapper(
+                F('arrival_time') + Value(60), output_field=IntegerField())),
+            FloatText(ExpressionWrapper(
+                F('shape_dist_traveled') + Value(0.5),
+                output_field=FloatField())))
+        self.assertEqual(list(texts), [('06:01:00', '1.5')])
@@ -0,0 +1,85 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.test import TestCase
+
+from multigtfs.models import Feed, Route, Service, Stop, StopTime, Trip
+from multigtfs.timetable import Timetable, compile_timetable
+
+try:
+    import numpy
+except ImportError:  # pragma: nocover
+    numpy = None
+
+
+@skipUnless(numpy, 'numpy is not installed')
+class TimetableTest(TestCase):
+
+    def setUp(self):
+        self.feed = Feed.objects.create()
+        route = Route.objects.create(feed=self.feed, route_id='R1', rtype=3)
+        service = Service.objects.create(feed=self.feed, service_id='S')
+        trip1 = Trip.objects.create(route=route, service=service, trip_id='T1')
+        trip2 = Trip.objects.create(route=route, service=service, trip_id='T2')
+        stop1 = Stop.objects.create(
+            feed=self.feed, stop_id='A', point='POINT(17.0 51.1)')
+        stop2 = Stop.objects.create(
+            feed=self.feed, stop_id='B', point='POINT(17.1 51.1)')
+        StopTime.objects.create(
+            trip=trip1, stop=stop1, stop_sequence=1,
+            arrival_time='08:00:00', departure_time='08:00:00')
+        StopTime.objects.create(
+            trip=trip1, stop=stop2, stop_sequence=2,
+            arrival_time='08:10:00', departure_time='08:11:00',
+            shape_dist_traveled=1500.0)
+        StopTime.objects.create(
+            trip=trip2, stop=stop1, stop_sequence=1,
+            arrival_time='07:00:00', departure_time='07:00:00')
+        self.directory = os.path.join(tempfile.mkdtemp(), 'timetable')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.directory))
+
+    def test_compile(self):
+        compile_timetable(self.feed, self.directory)
+        timetable = Timetable(self.directory)
+        self.assertEqual(len(timetable), 3)
+        self.assertTrue(timetable.is_current(self.feed))
+
+        stop_times = timetable.trip_stop_times('T1')
+        self.assertEqual(
+            [timetable.stop_ids[i] for i in stop_times['stop']], ['A', 'B'])
+        self.assertEqual(list(stop_times['departure']), [28800, 29460])
+        self.assertEqual(stop_times['shape_dist_traveled'][1], 1500.0)
+
+        departures = timetable.stop_departures('A')
+        self.assertEqual(
+            [timetable.trip_ids[i] for i in departures['trip']], ['T2', 'T1'])
+        self.assertEqual(list(departures['departure']), [25200, 28800])
+        self.assertEqual(
+            [timetable.service_ids[i] for i in departures['service']],
+            ['S', 'S'])
+
+    def test_compile_replaces_snapshot(self):
+        compile_timetable(self.feed, self.directory)
+        StopTime.objects.filter(trip__trip_id='T2').delete()
+        timetable = compile_timetable(self.feed, self.directory)
+        self.assertEqual(len(timetable), 2)
+        self.assertFalse(os.path.exists(self.directory + '.tmp'))
@@ -14,12 +14,30 @@
 # limitations under the License.
 
 from __future__ import unicode_literals
-from datetime import date, time
+from datetime import date, datetime, time, timedelta
+from unittest import skipUnless
 
 from django.test import TestCase
 from io import StringIO
 
-from multigtfs.models import Block, Feed, Route, Service, Shape, Stop, StopTime, Trip
+from multigtfs.models import (
+    Block,
+    Feed,
+    Route,
+    Service,
+    ServiceDates,
+    Shape,
+    Stop,
+    StopTime,
+    Trip,
+    TripTime,
+)
+from multigtfs.query_cache import query_cache
+
+try:
+    import numpy
+except ImportError:  # pragma: nocover
+    numpy = None
 
 
 class TripTest(TestCase):
@@ -216,9 +234,33 @@ R1,S1,T1,Headsign,HS,0,B1,S1,2,1
             shape_id="S1",
             geometry="LINESTRING(-117.133162 36.425288, -117.14 36.43)",
         )
-        trip = Trip.objects.create(route=self.route, trip_id="T1", shape=shape)
+        trip = Trip.objects.create(
+            route=self.route,
+            trip_id="T1",
+            shape=shape,
+            geometry="LINESTRING(-117.1 36.4, -117.2 36.5)",
+        )
         trip.update_geometry()
-        self.assertEqual(trip.geometry, shape.geometry)
+        self.assertIsNone(trip.geometry)
+        self.assertEqual(trip.path, shape.geometry)
+
+    def test_geometry_deferred(self):
+        Trip.objects.create(
+            route=self.route,
+            trip_id="T1",
+            geometry="LINESTRING(-117.1 36.4, -117.2 36.5)",
+        )
+        trip = Trip.objects.in_feed(self.feed).get()
+        self.assertEqual(trip.get_deferred_fields(), {"geometry"})
+        trip = Trip.objects.in_feed(self.feed).defer("headsign").with_geometry().get()
+        self.assertEqual(trip.get_deferred_fields(), {"headsign"})
+        with self.assertNumQueries(0):
+            self.assertEqual(len(trip.geometry.coords), 2)
+        trip = Trip.objects.in_feed(self.feed).only("trip_id").with_geometry().get()
+        deferred = trip.get_deferred_fields()
+        self.assertIn("headsign", deferred)
+        self.assertNotIn("trip_id", deferred)
+        self.assertNotIn("geometry", deferred)
 
     def test_update_geometry_has_stoptimes(self):
         stop1 = Stop.objects.create(
@@ -246,3 +288,78 @@ R1,S1,T1,Headsign,HS,0,B1,S1,2,1
         self.assertEqual(
             trip.geometry.coords, ((-117.133162, 36.425288), (-117.14, 36.43))
         )
+
+    @skipUnless(numpy, "numpy is not installed")
+    def test_active_at(self):
+        query_cache.clear()
+        service = Service.objects.create(feed=self.feed, service_id="S1")
+        stop = Stop.objects.create(
+            feed=self.feed, stop_id="STOP", point="POINT(17.0 51.1)"
+        )
+        day = date(2024, 3, 1)
+        ServiceDates.objects.create(service=service, date=day)
+        ServiceDates.objects.create(service=service, date=day - timedelta(days=1))
+        trips = {}
+        for trip_id, start, end in (
+            ("MORNING", "08:00:00", "09:00:00"),
+            ("NIGHT", "23:30:00", "24:30:00"),
+            ("LONG", "05:00:00", "12:00:00"),
+        ):
+            trip = trips[trip_id] = Trip.objects.create(
+                route=self.route, service=service, trip_id=trip_id
+            )
+            StopTime.objects.create(
+                trip=trip, stop=stop, stop_sequence=1, arrival_time=start
+            )
+            StopTime.objects.create(
+                trip=trip, stop=stop, stop_sequence=2, arrival_time=end
+            )
+        TripTime.refresh()
+
+        self.assertEqual(
+            Trip.objects.active_at(self.feed, datetime(2024, 3, 1, 8, 30)),
+            sorted([trips["MORNING"].id, trips["LONG"].id]),
+        )
+        self.assertEqual(
+            Trip.objects.active_at(
+                self.feed,
+                [datetime(2024, 3, 1, 0, 15), datetime(2024, 3, 2, 0, 15)],
+            ),
+            [[trips["NIGHT"].id], [trips["NIGHT"].id]],
+        )
+
+    @skipUnless(numpy, "numpy is not installed")
+    def test_interval_index_long_trip(self):
+        from multigtfs.trip_index import TripIntervalIndex
+
+        service = Service.objects.create(feed=self.feed, service_id="S1")
+        stop = Stop.objects.create(
+            feed=self.feed, stop_id="STOP", point="POINT(17.0 51.1)"
+        )
+        trips = {}
+        times = [("LONG", 2 * 3600, 22 * 3600)] + [
+            ("T%02d" % hour, hour * 3600, hour * 3600 + 1800)
+            for hour in range(6, 20)
+        ]
+        for trip_id, start, end in times:
+            trip = trips[trip_id] = Trip.objects.create(
+                route=self.route, service=service, trip_id=trip_id
+            )
+            StopTime.objects.create(
+                trip=trip, stop=stop, stop_sequence=1, arrival_time=start
+            )
+            StopTime.objects.create(
+                trip=trip, stop=stop, stop_sequence=2, arrival_time=end
+            )
+        TripTime.refresh()
+
+        index = TripIntervalIndex(self.feed)
+        self.assertEqual(len(index), 15)
+        noon = 12 * 3600 + 600
+        self.assertEqual(
+            sorted(index.active(noon, [service.id]).tolist()),
+            sorted([trips["LONG"].id, trips["T12"].id]),
+        )
+        # The long trip doesn't widen the search for the short ones
+        scanned = sum(end - start for _, start, end in index.candidates(noon))
+        self.assertEqual(scanned, 2)
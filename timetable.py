@@ -0,0 +1,272 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compiled timetable snapshots of feeds.
+
+A snapshot is a directory of NumPy .npy files with the stop times of a
+feed, opened with memory mapping, so worker processes share the pages of
+the operating system cache rather than each loading a copy.  Trips,
+stops and services are numbered by their order of database ID, and the
+stop times are stored twice in CSR (compressed sparse row) layout:
+
+- By trip: the stop times of trip i are rows trip_offsets[i] to
+  trip_offsets[i + 1] of the st_* arrays, in stop_sequence order.
+- By stop: the stop times at stop j are the rows listed in stop_visits
+  from stop_offsets[j] to stop_offsets[j + 1], in departure order.
+
+Times are in seconds since the start of the service day, with -1 for a
+missing time, and missing distances are NaN.
+
+This requires numpy, which is an optional dependency.
+"""
+from array import array
+from logging import getLogger
+import json
+import os
+import os.path
+import shutil
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import ExpressionWrapper, F, IntegerField
+
+from multigtfs.models import CombinedStopTime, Service, Stop, Trip
+from multigtfs.models.base import batch_size
+
+logger = getLogger(__name__)
+
+FORMAT_VERSION = 1
+ARRAYS = (
+    "trip_db_ids",
+    "trip_service",
+    "trip_offsets",
+    "stop_db_ids",
+    "stop_offsets",
+    "stop_visits",
+    "st_trip",
+    "st_stop",
+    "st_arrival",
+    "st_departure",
+    "st_shape_dist_traveled",
+)
+
+
+def get_numpy():
+    """Import numpy, or raise ImproperlyConfigured if not installed"""
+    try:
+        import numpy
+    except ImportError:  # pragma: nocover
+        raise ImproperlyConfigured("numpy is required for timetable snapshots")
+    return numpy
+
+
+def _csr_offsets(np, indices, count):
+    """Return the CSR offsets of rows grouped by sorted indices"""
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=count), out=offsets[1:])
+    return offsets
+
+
+def compile_timetable(feed, directory):
+    """Compile the stop times of a feed into a snapshot directory
+
+    The snapshot is written next to the directory and moved into place, so
+    readers never see a partial snapshot.  Processes that already opened
+    the previous snapshot keep reading it until they reopen it.
+
+    Returns the opened Timetable.
+    """
+    np = get_numpy()
+    revision = feed.revision
+
+    trips = Trip.objects.in_feed(feed).order_by("id")
+    trip_rows = list(trips.values_list("id", "trip_id", "service_id"))
+    stop_rows = list(
+        Stop.objects.in_feed(feed).order_by("id").values_list("id", "stop_id")
+    )
+    service_rows = list(
+        Service.objects.in_feed(feed).order_by("id").values_list("id", "service_id")
+    )
+    trip_db_ids = np.array([row[0] for row in trip_rows], dtype=np.int64)
+    stop_db_ids = np.array([row[0] for row in stop_rows], dtype=np.int64)
+    service_db_ids = np.array([row[0] for row in service_rows], dtype=np.int64)
+    trip_service = np.searchsorted(
+        service_db_ids,
+        np.array([row[2] or 0 for row in trip_rows], dtype=np.int64),
+    ).astype(np.int32)
+    trip_service[[row[2] is None for row in trip_rows]] = -1
+
+    # Stream the stop times into compact arrays
+    st_trip_ids = array("q")
+    st_stop_ids = array("q")
+    st_arrival = array("i")
+    st_departure = array("i")
+    st_dist = array("d")
+    stop_times = (
+        CombinedStopTime.objects.in_feed(feed)
+        .order_by("trip_id", "stop_sequence")
+        .values_list(
+            "trip_id",
+            "stop_id",
+            ExpressionWrapper(F("arrival_time"), output_field=IntegerField()),
+            ExpressionWrapper(F("departure_time"), output_field=IntegerField()),
+            "shape_dist_traveled",
+        )
+    )
+    for trip_id, stop_id, arrival, departure, dist in stop_times.iterator(
+        chunk_size=batch_size
+    ):
+        st_trip_ids.append(trip_id)
+        st_stop_ids.append(stop_id)
+        st_arrival.append(-1 if arrival is None else arrival)
+        st_departure.append(-1 if departure is None else departure)
+        st_dist.append(float("nan") if dist is None else dist)
+
+    st_trip = np.searchsorted(
+        trip_db_ids, np.frombuffer(st_trip_ids, dtype=np.int64)
+    ).astype(np.int32)
+    st_stop = np.searchsorted(
+        stop_db_ids, np.frombuffer(st_stop_ids, dtype=np.int64)
+    ).astype(np.int32)
+    arrays = {
+        "trip_db_ids": trip_db_ids,
+        "trip_service": trip_service,
+        "trip_offsets": _csr_offsets(np, st_trip, len(trip_rows)),
+        "stop_db_ids": stop_db_ids,
+        "stop_offsets": _csr_offsets(np, st_stop, len(stop_rows)),
+        "st_trip": st_trip,
+        "st_stop": st_stop,
+        "st_arrival": np.frombuffer(st_arrival, dtype=np.int32),
+        "st_departure": np.frombuffer(st_departure, dtype=np.int32),
+        "st_shape_dist_traveled": np.frombuffer(st_dist, dtype=np.float64),
+    }
+    arrays["stop_visits"] = np.lexsort((arrays["st_departure"], st_stop)).astype(
+        np.int64
+    )
+    meta = {
+        "version": FORMAT_VERSION,
+        "feed_id": feed.id,
+        "revision": revision,
+        "trip_ids": [row[1] for row in trip_rows],
+        "stop_ids": [row[1] for row in stop_rows],
+        "service_ids": [row[1] for row in service_rows],
+    }
+
+    directory = os.path.abspath(directory)
+    temp_dir = directory + ".tmp"
+    old_dir = directory + ".old"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    for name in ARRAYS:
+        np.save(os.path.join(temp_dir, name + ".npy"), arrays[name])
+    with open(os.path.join(temp_dir, "meta.json"), "w") as meta_file:
+        json.dump(meta, meta_file)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old_dir)
+    os.rename(temp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logger.info(
+        "Compiled timetable of %d stop times in %d trips to %s",
+        len(st_trip),
+        len(trip_rows),
+        directory,
+    )
+    return Timetable(directory)
+
+
+class Timetable(object):
+    """A memory-mapped timetable snapshot of a feed
+
+    Lookups return read-only NumPy arrays that are views of the mapped
+    files, so they are not copied.
+
+    Keyword arguments:
+    directory - The snapshot directory written by compile_timetable
+    """
+
+    def __init__(self, directory):
+        np = get_numpy()
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(
+                "Timetable snapshot %s has version %s, expected %s"
+                % (directory, meta["version"], FORMAT_VERSION)
+            )
+        self.feed_id = meta["feed_id"]
+        self.revision = meta["revision"]
+        self.trip_ids = meta["trip_ids"]
+        self.stop_ids = meta["stop_ids"]
+        self.service_ids = meta["service_ids"]
+        self._trip_index = dict((v, i) for i, v in enumerate(self.trip_ids))
+        self._stop_index = dict((v, i) for i, v in enumerate(self.stop_ids))
+        for name in ARRAYS:
+            path = os.path.join(directory, name + ".npy")
+            setattr(self, name, np.load(path, mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.st_trip)
+
+    def is_current(self, feed):
+        """Is the snapshot up to date with the records of the feed?"""
+        return feed.id == self.feed_id and feed.revision == self.revision
+
+    def trip_index(self, trip_id):
+        """Return the index of a trip, by GTFS trip_id"""
+        return self._trip_index[trip_id]
+
+    def stop_index(self, stop_id):
+        """Return the index of a stop, by GTFS stop_id"""
+        return self._stop_index[stop_id]
+
+    def trip_rows(self, trip_id):
+        """Return the slice of the stop times of a trip"""
+        index = self.trip_index(trip_id)
+        return slice(int(self.trip_offsets[index]), int(self.trip_offsets[index + 1]))
+
+    def trip_stop_times(self, trip_id):
+        """Return the stop times of a trip, in stop_sequence order
+
+        Returns a dictionary of arrays: stop (stop indices), arrival and
+        departure (seconds, -1 if missing), and shape_dist_traveled.
+        """
+        rows = self.trip_rows(trip_id)
+        return {
+            "stop": self.st_stop[rows],
+            "arrival": self.st_arrival[rows],
+            "departure": self.st_departure[rows],
+            "shape_dist_traveled": self.st_shape_dist_traveled[rows],
+        }
+
+    def stop_rows(self, stop_id):
+        """Return the stop time rows at a stop, in departure order"""
+        index = self.stop_index(stop_id)
+        start, end = self.stop_offsets[index], self.stop_offsets[index + 1]
+        return self.stop_visits[start:end]
+
+    def stop_departures(self, stop_id):
+        """Return the trips at a stop, in departure order
+
+        Returns a dictionary of arrays: trip and service (indices),
+        arrival and departure (seconds, -1 if missing).
+        """
+        rows = self.stop_rows(stop_id)
+        trips = self.st_trip[rows]
+        return {
+            "trip": trips,
+            "service": self.trip_service[trips],
+            "arrival": self.st_arrival[rows],
+            "departure": self.st_departure[rows],
+        }
@@ -0,0 +1,122 @@
+#
+# Copyright 2024 Filip Pazera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-memory interval index of the trip times of a feed.
+
+The (start_time, end_time) intervals of TripTime are split into buckets by
+duration class, where each class at most doubles the duration of the
+previous one, and sorted by start within each bucket.  A trip that is
+running at a time t started at most the max_duration of its bucket before
+t, so the candidates are found with two binary searches per bucket.  Since
+the trips of a bucket have similar durations, a few long trips don't widen
+the search for the others, and most candidates are running.  Only the
+candidates are checked for their end and service.
+
+Use Trip.objects.active_at(feed, when) for lookups, which keeps the index
+of the feed in the query cache until the feed changes.
+
+This requires numpy, which is an optional dependency.
+"""
+from collections import namedtuple
+
+from django.db.models import ExpressionWrapper, F, IntegerField
+
+from multigtfs.timetable import get_numpy
+
+DAY = 24 * 60 * 60
+
+IntervalBucket = namedtuple(
+    "IntervalBucket", ["starts", "ends", "trip_ids", "service_ids", "max_duration"]
+)
+
+# Trips up to this long are in the first duration class
+MIN_DURATION_CLASS = 15 * 60
+
+
+def duration_class(duration):
+    """Return the duration class of a trip, doubling from MIN_DURATION_CLASS"""
+    return (max(0, duration - 1) // MIN_DURATION_CLASS).bit_length()
+
+
+class TripIntervalIndex(object):
+    """The trip time intervals of a feed, by duration class and start time"""
+
+    def __init__(self, feed):
+        np = self.np = get_numpy()
+        from multigtfs.models import TripTime
+
+        rows = list(
+            TripTime.objects.filter(trip__route__feed=feed).values_list(
+                ExpressionWrapper(F("start_time"), output_field=IntegerField()),
+                ExpressionWrapper(F("end_time"), output_field=IntegerField()),
+                "trip_id",
+                "trip__service_id",
+            )
+        )
+        classes = {}
+        for row in rows:
+            if row[0] is not None and row[1] is not None:
+                classes.setdefault(duration_class(row[1] - row[0]), []).append(row)
+        self.buckets = []
+        for key in sorted(classes):
+            bucket_rows = sorted(classes[key])
+            starts = np.array([row[0] for row in bucket_rows], dtype=np.int32)
+            ends = np.array([row[1] for row in bucket_rows], dtype=np.int32)
+            self.buckets.append(
+                IntervalBucket(
+                    starts=starts,
+                    ends=ends,
+                    trip_ids=np.array(
+                        [row[2] for row in bucket_rows], dtype=np.int64
+                    ),
+                    service_ids=np.array(
+                        [-1 if row[3] is None else row[3] for row in bucket_rows],
+                        dtype=np.int64,
+                    ),
+                    max_duration=int((ends - starts).max()),
+                )
+            )
+
+    def __len__(self):
+        return sum(len(bucket.trip_ids) for bucket in self.buckets)
+
+    def candidates(self, seconds):
+        """Return (bucket, start, end) slices of trips that may be running
+
+        Keyword arguments:
+        seconds - The time, in seconds since the start of the service day
+        """
+        np = self.np
+        for bucket in self.buckets:
+            earliest = seconds - bucket.max_duration
+            start = np.searchsorted(bucket.starts, earliest, "left")
+            end = np.searchsorted(bucket.starts, seconds, "right")
+            if start < end:
+                yield bucket, start, end
+
+    def active(self, seconds, service_ids):
+        """Return the IDs of the trips running at a time of a service day
+
+        Keyword arguments:
+        seconds - The time, in seconds since the start of the service day
+        service_ids - The IDs of the services active on the service day
+        """
+        np = self.np
+        service_ids = np.fromiter(service_ids, dtype=np.int64)
+        found = [np.empty(0, dtype=np.int64)]
+        for bucket, start, end in self.candidates(seconds):
+            running = bucket.ends[start:end] >= seconds
+            running &= np.isin(bucket.service_ids[start:end], service_ids)
+            found.append(bucket.trip_ids[start:end][running])
+        return np.concatenate(found)